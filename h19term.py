@@ -77,6 +77,57 @@
 # Jun 01, 2020   V2.4  Added Xmodem transfer.
 # Aug 22, 2020   V2.5  Add toggling window box drawing characters for Linux copy and paste.
 #                      Add keypad associations to help screen.
+# Oct 19, 2026   V2.6  Add session recorder, CTRL-A W to toggle or --record on the
+#                      command line.  Add --replay with --speed and --headless.
+#                      Serial input is now read in bulk.
+#                      Add memory mapped file viewer, CTRL-A V views the log file.
+#                      Replace auto date matching with a general trigger/response
+#                      engine configured with [Trigger] sections in .h19termrc.
+#                      Add expect style scripting with --script.
+#                      Ports can be tcp://, telnet:// or pty: as well as serial
+#                      devices, add --port.
+#                      Run several sessions in one h19term, CTRL-A 1-9 or TAB switches.
+#                      Add --fake-host, a pretend H8 with RX for testing.
+#                      Add session statistics, CTRL-A I or --stats-socket.
+#                      Add CTRL-A O to start and stop the profiler.
+#                      Measure keystroke to echo latency, see CTRL-A I.
+#                      Faster start, pysinewave is loaded on the first bell, setfont
+#                      only runs when needed and ports are probed in the
+#                      background.  Add --startup-bench.
+#                      Find the H8's port and baud rate, A in CTRL-A P or --probe.
+#                      XMODEM transfers can raise the link speed with ESC r,
+#                      set xmodemboost.
+#                      Hold screen mode works, SHIFT-DOWN is the SCROLL key.  Send
+#                      XOFF/XON (or drop RTS) when we fall behind, set flowcontrol.
+#                      Keys are all taken at once and sent in one write, paced by
+#                      keyrepeatrate after a burst of 20, pastes are no longer lost.
+#                      CTRL-\ toggles local line editing with a searchable history
+#                      kept in ~/.h19term_history, replacing the unfinished
+#                      command history.
+#                      CTRL-A T draws typing before the host echoes it, set
+#                      predictecho to start with it on.
+#                      Backspace no longer waits on the H8's echo, holding it down
+#                      is smooth and PIE's escape sequences aren't lost.
+#                      Add --mirror and --mirror-websocket to watch the screens and
+#                      read them as JSON from other programs.
+#                      Add --render to turn recordings and raw captures into text
+#                      or HTML transcripts, on every core.
+#                      Add --trace to write what the terminal made of the host's
+#                      output as JSON lines, --trace-ops picks which.
+#                      Fix ANSI sequences with parameters, which still used Python 2
+#                      string functions, the cursor position report (line first),
+#                      ESC K moving the cursor, ESC L and ESC M taking the 25th
+#                      line with them, insert mode typing backwards and escape
+#                      sequences that could move the cursor off the screen.
+#                      Wrapping off the bottom line scrolls, wrapping on the 25th
+#                      line no longer crashes and a TAB stops at the last column.
+#                      Add a built in Z80 running CP/M 2.2, --port cpm:DIR makes
+#                      host directories or 8 inch disk images its drives.
+#                      Add --drive-server, host directories served as drives on
+#                      the XMODEM port, set driveserver.  Only the host side, the
+#                      H8 driver for it is still to be written.
+#                      CTRL-A F and --fanout send one file to several machines at
+#                      once, one XMODEM sender thread each, set fanoutports.
 
 import os
 import re
@@ -85,10 +136,32 @@ import time
 import curses
 import locale
 import serial
+import select
+import socket
+import stat
+import errno
 import string
+import mmap
+import bisect
+import shlex
+import codecs
+import struct
+import gzip
+import ctypes
+import random
+import fcntl
+import termios
+import subprocess
+import argparse
+import threading
 import datetime
+import json
+import html
+import queue
+import concurrent.futures
+import base64
+import hashlib
 import configparser
-from pysinewave import SineWave
 
 
 # This must be set to output unicode characters
@@ -103,7 +176,13 @@ code = locale.getpreferredencoding()
 SERIAL_PORT = '/dev/ttyUSB0'
 XMODEM_PORT = '/dev/ttyUSB1'
 BAUD_RATE = 9600
+SESSION_PORTS = ''      # more ports separated by commas, each gets its own session
 XMODEM_RATE = 9600
+XMODEM_BOOST = 0        # highest rate to try raising XMODEM transfers to, 0 is off
+DRIVE_SERVER = ''       # directories served as drives on the XMODEM port, separated by commas
+FANOUT_PORTS = ''       # XMODEM ports of the machines a fan-out send goes to, separated by commas
+FLOW_CONTROL = 'xonxoff'    # how we hold the host back, xonxoff, rtscts or none
+PREDICT_ECHO = False    # draw typed characters before the host echoes them
 
 # Set the autorun mode for xmodem transfers.  Auto run can only be used with the
 # RX.COM companion application that comes with H19term.  The "USER" mode can be
@@ -134,6 +213,10 @@ CPM_TIME_FORMAT = "Enter the time (HH:MM:SS): "
 HDOS_DATE_FORMAT = r"^Date.(\d\d-\w\w\w-\d\d)?."      # Date (01-Jan-77)?
 # Haven't tested this as I don't have the date patches in for HDOS
 
+# Auto responder triggers, each is a [Trigger <name>] section in .h19termrc
+# with match, send, regex and bootonly settings.  See the manual.
+TRIGGERS = []
+
 # Colours defined when running on Raspberry Pi or Linux Console.  This does not
 # set the colours when running under X11.
 LC_WHITE = 'FFFFFF'
@@ -153,15 +236,137 @@ DEFAULT_COLOUR = 0
 
 # ************  END OF USER MODIFIABLE SETTINGS *****************************
 
-VERSION = 'V2.5 - Python 3'
-VERSION_DATE = 'Aug 22, 2020'
+VERSION = 'V2.6 - Python 3'
+VERSION_DATE = 'Oct 19, 2026'
 
 CONFIG_FILE = os.path.join(os.environ['HOME'], '.h19termrc')
 LOG_FILE = os.path.join(os.environ['HOME'], 'h19term.log')
+HISTORY_FILE = os.path.join(os.environ['HOME'], '.h19term_history')
+PORTS_FILE = os.path.join(os.environ['HOME'], '.h19term_ports')
+PORTS_MAX_AGE = 7 * 86400   # seconds a saved port probe is used before probing again
+HISTORY_SIZE = 500      # lines kept by the line editor
 
 SIO_WAIT = None
 SIO_NO_WAIT = 0
 
+ANSI_CMDS = "ABCDHJKLMNPfhlmnpqrsuz"
+ANSI_ILLEGAL = "<@!$%^&*+-"
+ANSI_MAX_SEQ = 32       # give up waiting for a terminator after this many
+
+# Session recordings are a magic header followed by records of
+# (microseconds since last record, direction, length) and the data bytes.
+RECORD_MAGIC = b'H19REC\x01\n'
+RECORD_HEADER = struct.Struct('<IBH')
+RECORD_COALESCE = 0.005     # bytes closer together than this share a record
+RECEIVED = 0
+SENT = 1
+
+VIEW_CHUNK = 1 << 20    # file viewer indexes and searches in chunks this size
+VIEW_TICK = 250         # ms between file viewer idle passes
+VIEW_CONTROL_CHARS = {i: '^' + chr(i + 64) for i in range(32)}
+VIEW_CONTROL_CHARS[127] = '^?'
+
+TRIGGER_BOOT_LINES = 50     # bootonly triggers are ignored after this many lines
+TRIGGER_LINE_MAX = 256      # longest line kept for regex triggers
+STRIP_HIGH_BIT = bytes(i & 0x7F for i in range(256))
+
+SCRIPT_COMMANDS = ('send', 'sendline', 'expect', 'expect-re', 'prompt', 'timeout',
+                   'ontimeout', 'pace', 'sleep', 'label', 'goto', 'capture', 'xmodem',
+                   'echo', 'exit')
+SCRIPT_TIMEOUT = 30.0       # default seconds to wait in expect and prompt
+SCRIPT_BACKLOG = 4096      # received bytes kept for the next expect
+SCRIPT_IDLE = 1.0           # longest wait between script steps with no deadline
+SCRIPT_PROMPT = r'^(?:[A-P]\d{0,2}>|>) ?$'    # CP/M A> or A0>, HDOS >
+
+# Ports can be a serial device, tcp://host:port, telnet://host:port,
+# pty:command to run a program such as an emulator on a pseudo terminal or
+# cpm:DIR for the built in CP/M machine.
+TRANSPORT_READ = 65536      # most bytes taken from a socket or pty at once
+TRANSPORT_IDLE = 0.1        # longest the main loop sleeps waiting for input
+TELNET_IAC = 255
+TELNET_DONT = 254
+TELNET_DO = 253
+TELNET_WONT = 252
+TELNET_WILL = 251
+TELNET_SB = 250
+TELNET_BRK = 243
+TELNET_SE = 240
+TELNET_OPTIONS = (0, 1, 3)  # binary, echo and suppress go ahead, all else refused
+
+# cpm:DIR[,DIR...] runs CP/M 2.2 on a built in Z80, see CpmMachine.  The
+# BDOS and the BIOS jump table lead to ED FE, which traps to Python.
+CPM_SLICE = 20000           # Z80 instructions between looks at the keyboard and the screen
+CPM_IDLE_POLLS = 200        # console polls with nothing typed before a polling program naps
+CPM_IDLE = 0.01             # seconds a polling program naps for
+CPM_TPA = 0x0100
+CPM_BDOS = 0xEC06           # where the JP at 5 goes, programs take it as the top of memory
+CPM_BIOS = 0xFA00           # jump table, its traps are at CPM_BIOS + 0x40
+CPM_DPB = 0xFA80            # disk parameters of host directories
+CPM_IMAGE_DPB = 0xFA90      # and of 8 inch disk images
+CPM_XLT = 0xFAA0            # sector skew of the images
+CPM_DPH = 0xFAC0            # directories, images at CPM_DPH + 16
+CPM_DIRBUF = 0xFB00
+CPM_ALV = 0xFC00
+CPM_TRAP = b'\xed\xfe\xc9'   # trap then RET
+CPM_RECORD = 128
+CPM_READ_AHEAD = 64         # records a directory drive reads from a file at once
+CPM_EOF = 0x1A
+CPM_IMAGE_SIZE = 77 * 26 * 128
+CPM_IMAGE_SKEW = (1, 7, 13, 19, 25, 5, 11, 17, 23, 3, 9, 15, 21,
+                  2, 8, 14, 20, 26, 6, 12, 18, 24, 4, 10, 16, 22)
+CPM_NAME_CHARS = frozenset(string.ascii_uppercase + string.digits + '!#$%&\'()-@^_`{}~')
+CPM_UART_DATA = 0xE8        # the H8's console 8250
+CPM_UART_STATUS = 0xED
+# The drive server answers BDOS file calls from a driver on the H8, see
+# DriveServer
+DRIVE_STX = 0x02            # starts every frame
+DRIVE_FRAME_TIMEOUT = 1.0   # seconds the rest of a frame has once its STX is in
+DRIVE_FCB = 0x1000          # where a request's FCB and record go in the server's BDOS
+DRIVE_DMA = 0x1080
+DRIVE_CALLS = frozenset((15, 16, 17, 18, 19, 20, 21, 22, 23, 30, 33, 34, 35, 36, 40))
+DRIVE_WRITES = frozenset((21, 34, 40))      # requests that carry a record
+DRIVE_READS = frozenset((17, 18, 20, 33))   # answers that carry one
+Z80_SZ = bytes((v & 0xA8) | (0x40 if v == 0 else 0) for v in range(256))
+Z80_SZP = bytes(Z80_SZ[v] | (0 if bin(v).count('1') & 1 else 4) for v in range(256))
+Z80_CONDITIONS = (0x40, 0x01, 0x04, 0x80)    # Z C P/V S flags of NZ/Z NC/C PO/PE P/M
+Z80_MEM_OPS = ((0x34, 0x35, 0x36, 0x46, 0x4E, 0x56, 0x5E, 0x66, 0x6E, 0x7E, 0x77) +
+               tuple(range(0x70, 0x76)) + tuple(range(0x86, 0xC0, 8)))   # ops with an (HL)
+
+PROBE_TIME = 0.08           # seconds listening at each baud rate
+PROBE_READ = 256            # most bytes looked at for each rate
+PROBE_MIN_BYTES = 2         # fewer than this and the rate scores nothing
+PROBE_GOOD = 0.9            # stop trying rates on a port once one scores this
+PROBE_ESCAPES = b'ABCDEFGHIJKLMNOYZbjklnopqrtuvwxyz@#{}[]=<>\\'   # H19 ESC commands
+
+KDFONTOP = 0x4B72           # console font ioctl, see font_loaded()
+KD_FONT_OP_GET = 1
+FONT_VPITCH = 32            # rows the kernel gives each glyph, whatever its height
+FONT_MAX_CHARS = 512
+CONSOLE_FONT_OP = struct.Struct('IIIIIP')   # op, flags, width, height, charcount, data
+
+STATS_FILE = 'h19term-stats.json'  # CTRL-A I dump, written next to LOG_FILE
+RENDER_CHUNK = 4096     # bytes of a raw capture between --render-mode frames looks
+TRACE_OPS = ('print', 'cursor', 'erase', 'edit', 'mode', 'report', 'bell', 'other')
+TRACE_RUN_GAP = 0.01    # seconds between printed characters that starts a new print run
+TRACE_CONTROLS = {'\r': 'cursor', '\n': 'cursor', '\b': 'cursor', '\x7f': 'erase',
+                  '\x07': 'bell'}
+TRACE_HEATH = {c: op for op, cmds in (('cursor', 'ABCDHIYjk'), ('erase', 'EJKblo'),
+                                      ('edit', 'LMN'), ('report', 'Zn#]'),
+                                      ('mode', 'FGO@pqrtuvwxyz{}[\\=<>'))
+               for c in cmds}
+TRACE_ANSI = {c: op for op, cmds in (('cursor', 'ABCDHfsu'), ('erase', 'JK'),
+                                     ('edit', 'LMP'), ('report', 'npq'), ('mode', 'hlmrz'))
+              for c in cmds}
+MIRROR_TICK = 0.05      # seconds between looks at the screen while someone watches
+MIRROR_BACKLOG = 64     # updates a viewer can fall behind before it gets a fresh snapshot
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+STATS_TICK = 200            # ms between stats popup redraws
+ECHO_TIMEOUT = 2.0          # seconds before a typed character is given up on
+BS_ECHO = b'\x08 \x08'      # the H8's answer to a backspace
+BS_ECHO_WAIT = 0.03         # seconds we hold a ^H back waiting for the rest of BS_ECHO
+PREDICT_TIMEOUT = 1.0       # seconds a predicted echo is shown before it is taken back
+PREDICT_QUIET = 2.0         # seconds without predictions after an escape sequence or a miss
+
 SHIFT_FKEY = curses.KEY_F9
 ENTER_FKEY = curses.KEY_F10
 ERASE_FKEY = curses.KEY_F11
@@ -186,14 +391,42 @@ TAB = '\x09'
 ESC = '\x1b'
 NUL = '\x00'
 
-KEY = 1  # Used in backspace to tell if key or incoming serial char
+# XMODEM control bytes
+SOH = b'\x01'
+EOT = b'\x04'
+ACK = b'\x06'
+NAK = b'\x15'
+CAN = b'\x18'
+
+# XMODEM speed boost, the sender asks for a rate with the H19's ESC r, the
+# receiver ACKs, both switch and the test pattern has to come back unchanged
+BOOST_PATTERN = bytes(range(0, 256, 4))
+BOOST_TIMEOUT = 1.0     # seconds the receiver waits for the pattern before going back
+BOOST_ERRORS = 3        # NAKs in a row on a block before stepping the rate down
+XMODEM_RETRIES = 10     # NAKs on one block before the transfer is given up
+FANOUT_TICK = 0.1       # seconds between redraws of the fan-out summary
+H19_RATES = [110, 150, 300, 600, 1200, 1800, 2000, 2400, 3600, 4800, 7200, 9600, 19200, 38400]
+
+# Flow control bytes
+XON = b'\x11'
+XOFF = b'\x13'
+
+# Receive flow control, we stop the host once this much is waiting to be put
+# on the screen (or hold screen has a full page up) and start it again once
+# we are back under the low mark
+FLOW_HIGH = 8192
+FLOW_LOW = 1024
+RX_SLICE = 4096     # bytes each session gets through per trip round the main loop
+HOLD_PAGE = 24      # lines hold screen mode lets through before stopping
+
 BLANK_LINE = "                                                                               "
 
 NOCHAR = -1
 CURSOR = [0,0]
-SAVED_CURSOR = [0,0]
 
 KEY_REPEAT_RATE = 0.09  #10ish CPS, more than this and PIE editor has char overflows
+KEY_BURST = 20          # typed characters that go out at once before the rate applies
+KEY_DRAIN = 256         # most keys taken from the keyboard per trip round the main loop
 
 class H19Keys:
 
@@ -243,6 +476,7 @@ class H19Screen:
     def __init__(self, scn, stat):
         self.screen = scn
         self.status = stat
+        self.savedCursor = [0,0]
 
 
     h19_graphics = [
@@ -290,38 +524,37 @@ class H19Screen:
 
     #
     def bell(self):
+        if self.headless:
+            return
         if time.time() - self.bell_start_time > 1.0 or self.bell_start_time == 0.0:
+            first = self.sessions[0]
             try:
-                self.sinewave.play()
+                if first.sinewave is None:
+                    # pysinewave brings in NumPy and sounddevice which take
+                    # seconds to load on a Pi, so wait for the first bell.
+                    # A sine wave with a pitch of 25 for the H19 BELL.
+                    from pysinewave import SineWave
+                    first.sinewave = SineWave(pitch=25)
+                first.sinewave.play()
                 self.bell_start_time = time.time()
                 time.sleep(0.16)
-                self.sinewave.stop()
+                first.sinewave.stop()
             except:
                 pass    # sometimes this fails with ugly python throw up
 
 
-    def backspace(self, sio, ch): # H8 will return ^H <SPACE> ^H when we
-        y,x = self.screen.getyx()   # send it a ^H key
-        if ch == KEY:
-            if x > 0:
-                self.sio_write(sio, chr(8))
-                c = self.sio_read(sio, TIMEOUT=0.01)   # ^H or timeout
-                if c == chr(8):
-                    c = self.sio_read(sio, TIMEOUT=0.01)     # <SPACE>
-                    if c == ' ':
-                        c = self.sio_read(sio, TIMEOUT=0.01) # ^H
-                        self.screen.delch(y, x-1)
-                    else:
-                        self.screen.move(y,x-1)  # sometimes we only get 1 ^H
-                else:
-                    return(c)
-
-        else:
-            if x == 0:
-                return('')
-            #self.screen.delch(y, x-1)
+    def backspace(self):
+        y,x = self.screen.getyx()
+        if x > 0:
             self.screen.move(y, x-1)
 
+    # The H8 answers a ^H we send with ^H <SPACE> ^H, take the character
+    # off the line
+    def erase_echo(self):
+        y,x = self.screen.getyx()
+        if x > 0:
+            self.screen.delch(y, x-1)
+
     def tab(self):  # so far don't need this
         pass
 
@@ -335,9 +568,14 @@ class H19Screen:
             y = 23
             self.screen.move(y,x)
         else:
-            self.screen.move(y+1,x)
+            y += 1
+            self.screen.move(y,x)
         if self.autoCarriageReturnMode:
             self.screen.move(y,0)
+        if self.holdScreenMode and not self.headless:
+            self.holdLines -= 1
+            if self.holdLines <= 0:
+                self.set_held(True)
 
     def carriage_return(self):
         y,x = self.screen.getyx()
@@ -348,7 +586,7 @@ class H19Screen:
         self.screen.move(y, 0)
         if self.autoLinefeedMode:
             #self.log("[Y->%s, X->%s]" % (y,x))
-            self.screen.move(y+1,0)
+            self.linefeed()
 
     def escape(self):
         pass
@@ -361,8 +599,12 @@ class H19Screen:
         #self.screen.addch(' ')
         pass
 
-    def scroll_key(self):
-        pass
+    # With hold screen on SCROLL lets one more line through, SHIFT-SCROLL
+    # another page
+    def scroll_key(self, page=False):
+        if self.held:
+            self.holdLines = HOLD_PAGE if page else 1
+            self.set_held(False)
 
     def break_key(self, sio):
         sio.sendBreak()
@@ -370,42 +612,39 @@ class H19Screen:
     # Cursor functions
     def cursor_home(self):
         y, x = self.screen.getyx()
-        if x == 24:
-            self.screen.move(0,x)
+        if y == 24:     # home on the 25th line is the start of it
+            self.screen.move(24,0)
         else:
             self.screen.move(0,0)
 
+    # Movement stops at the edges of the screen
     def cursor_forward(self, n=1):
         y,x = self.screen.getyx()
         if n == 0:
             n = 1
-        if x == 79:
-            return
-        self.screen.move(y, x+n)
+        self.screen.move(y, min(x+n, 79))
 
     def cursor_backward(self, n=1):
         y,x = self.screen.getyx()
         if n == 0:
             n = 1
-        if x == 0:
-            return
-        self.screen.move(y, x-n)
+        self.screen.move(y, max(x-n, 0))
 
     def cursor_down(self, n=1):
         y,x = self.screen.getyx()
         if n == 0:
             n = 1
-        if y == 23:
+        if y >= 23:
             return
-        self.screen.move(y+n, x)
+        self.screen.move(min(y+n, 23), x)
 
     def cursor_up(self, n=1):
         y,x = self.screen.getyx()
         if n == 0:
             n = 1
-        if y == 0:
+        if y == 0 or y == 24:
             return
-        self.screen.move(y-n, x)
+        self.screen.move(max(y-n, 0), x)
 
     def reverse_linefeed(self):
         self.screen.scrollok(True)
@@ -416,29 +655,21 @@ class H19Screen:
             self.screen.move(y-1,x)
         #self.screen.scrollok(False)
 
+    # Line then column, as ESC Y takes them, or ESC [ Pl;Pc R in ANSI mode
     def cursor_position_report(self, sio):
         if self.ansiMode:
             y,x = self.screen.getyx()
-            sio.write(ESC.encode())
-            sio.write(b'[')
-            sio.write((chr(x + 32)).encode())
-            sio.write(b';')
-            sio.write((chr(y + 32)).encode())
-            sio.write(b'R')
+            self.sio_write(sio, ESC + '[%d;%dR' % (y + 1, x + 1))
         else:
             y,x = self.screen.getyx()
-            sio.write(ESC.encode())
-            sio.write(b'Y')
-            sio.write((chr(x + 32)).encode())
-            sio.write((chr(y + 32)).encode())
+            self.sio_write(sio, ESC + 'Y' + chr(y + 32) + chr(x + 32))
 
     def save_cursor_position(self):
         y,x = self.screen.getyx()
-        SAVED_CURSOR[0] = y
-        SAVED_CURSOR[1] = x
+        self.savedCursor = [y,x]
 
     def goto_saved_cursor_position(self):
-        self.screen.move(SAVED_CURSOR[0],SAVED_CURSOR[1])
+        self.screen.move(self.savedCursor[0],self.savedCursor[1])
         self.screen.refresh()
 
     def set_cursor_position(self, line, col):
@@ -447,18 +678,15 @@ class H19Screen:
         else:
             self.screen.scrollok(True)
 
-        if line > 24:
-            return
-        if col > 79:
-            self.screen.move(line, 79)
-            return
-
-        self.screen.move(line, col)
+        # A line off the screen leaves the cursor on its line, a column
+        # past the end puts it at the end
+        y, x = self.screen.getyx()
+        if not 0 <= line <= 24:
+            line = y
+        self.screen.move(line, min(max(col, 0), 79))
 
     def can_perform_as_vt52(self,sio):
-        sio.write(ESC)
-        sio.write('/')
-        sio.write('K')
+        self.sio_write(sio, ESC + '/K')
 
     # Erasing and editing
 
@@ -509,17 +737,28 @@ class H19Screen:
         self.screen.addnstr(BLANK_LINE,x)
 
     def erase_to_end_of_line(self):
-        y,x = self.screen.getyx()
         self.screen.clrtoeol()
-        if x > 0:
-            self.screen.move(y,x-1)
-#        self.screen.refresh()
 
+    # Both leave the cursor at the start of the line.  insertln() and
+    # deleteln() would move the 25th line too, so the lines from the
+    # cursor down are scrolled instead.
     def insert_line(self):
-        self.screen.insertln()
+        self.shift_lines(-1)
 
     def delete_line(self):
-        self.screen.deleteln()
+        self.shift_lines(1)
+
+    def shift_lines(self, n):
+        y,x = self.screen.getyx()
+        if y == 24:
+            self.screen.move(24,0)
+            self.screen.clrtoeol()
+            return
+        self.screen.scrollok(True)
+        self.screen.setscrreg(y, 23)
+        self.screen.scroll(n)
+        self.screen.setscrreg(0, 23)
+        self.screen.move(y,0)
 
     def delete_character(self):
         y,x = self.screen.getyx()
@@ -532,239 +771,4420 @@ class H19Screen:
         self.insertMode = False
 
 
-class H19Term(H19Keys, H19Screen):
-    """ H19 terminal.
+class HiddenWindow:
+    """ Wraps the curses window of a session that is not on screen.
 
-        Supports I/O using a serial port.
+        Drawing goes into the window as usual but refreshes are dropped, so
+        a background session keeps its screen up to date without showing it.
     """
 
-    def __init__(self):
-        self.screen = None
-        self.status = None
-        self.logio = False
-        self.showbox = True
-        self.baudrate = [110, 150, 300, 600, 1200, 1800, 2000, 2400, 3600, 4800, 7200, 9600, 19200, 38400]
+    def __init__(self, win):
+        self.win = win
 
-        H19Screen.__init__(self, self.screen, self.status)
+    def __getattr__(self, name):
+        attr = getattr(self.win, name)
+        setattr(self, name, attr)   # only looked up the first time
+        return attr
 
-    def get_h19config(self):
-        global SERIAL_PORT, XMODEM_PORT, BAUD_RATE, PRELOAD_FONT, FONT, BEEP
-        global AUTO_CPM_DATE, CPM_DATE_FORMAT, CPM_TIME_FORMAT, XMODEM_RATE
-        global AUTO_HDOS_DATE, HDOS_DATE_FORMAT, INSTALL_PATH, AUTORUN_MODE
-        global KEY_REPEAT_RATE, DEFAULT_COLOUR, RUN_PATH
-        global LC_WHITE, LC_GREEN, LC_YELLOW
-        global LC_BLUE, LC_CYAN, LC_MAGENTA, LC_RED
-        Config = configparser.ConfigParser(allow_no_value = True)
+    def refresh(self):
+        pass
 
-        updateFile = True
-        # If it exists get the settings otherwise write them to a file
-        if os.path.isfile(CONFIG_FILE):
-            updateFile = False
+    def noutrefresh(self):
+        pass
 
-            try:
-                Config.read(CONFIG_FILE)
-                if Config.has_option('General', 'RunPath'):
-                    RUN_PATH = Config.get('General', 'RunPath')
-                else: updateFile = True
-                if Config.has_option('General','KeyRepeatRate'):
-                    KEY_REPEAT_RATE = Config.getfloat('General','KeyRepeatRate')
-                else: updateFile = True
-                if Config.has_option('General','SoundFile'):
-                    BEEP = Config.get('General','SoundFile')
-                else: updateFile = True
 
-                if Config.has_option('SerialComms', 'port'):
-                    SERIAL_PORT = Config.get('SerialComms', 'port')
-                else: updateFile = True
-                if Config.has_option('SerialComms', 'baudRate'):
-                    BAUD_RATE = Config.getint('SerialComms', 'baudRate')
-                else: updateFile = True
+class HeadlessWindow:
+    """ Stand in for a curses window when there is no display.
 
-                if Config.has_option('SerialComms', 'xmodemport'):
-                    XMODEM_PORT = Config.get('SerialComms', 'xmodemport')
-                else: updateFile = True
-                if Config.has_option('SerialComms', 'xmodembaudrate'):
-                    XMODEM_RATE = Config.getint('SerialComms', 'xmodembaudrate')
-                else: updateFile = True
+        Implements the part of the curses window API that H19Screen uses,
+        following the ncurses rules for wrapping and scrolling, so the
+        terminal can be driven from a replay without a screen.
+    """
 
-                if Config.has_option('AutoRun', 'autorunmode'):
-                    AUTORUN_MODE = Config.get('AutoRun', 'autorunmode')
-                else: updateFile = True
+    def __init__(self, lines, cols):
+        self.lines = lines
+        self.cols = cols
+        self.text = [[' '] * cols for _ in range(lines)]
+        self.attrs = [[0] * cols for _ in range(lines)]
+        self.y = 0
+        self.x = 0
+        self.attr = 0
+        self.scroll_ok = False
+        self.top = 0
+        self.bottom = lines - 1
+        self.keys = []  # pending input returned by getch()
+        self.scrolled = None    # [(text, attrs)] of rows scrolled off the top, if kept
+
+    def _args(self, args, required=1):
+        # curses allows an optional leading y, x on most calls
+        if len(args) >= required + 2:
+            self.move(args[0], args[1])
+            args = args[2:]
+        return args
+
+    def _blank(self):
+        return [' '] * self.cols, [0] * self.cols
+
+    def _scroll(self, top, bottom, n):
+        for _ in range(abs(n)):
+            text, attrs = self._blank()
+            if n > 0:
+                if self.scrolled is not None and top == 0:
+                    self.scrolled.append((self.text[top], self.attrs[top]))
+                del self.text[top]
+                del self.attrs[top]
+                self.text.insert(bottom, text)
+                self.attrs.insert(bottom, attrs)
+            else:
+                del self.text[bottom]
+                del self.attrs[bottom]
+                self.text.insert(top, text)
+                self.attrs.insert(top, attrs)
+
+    def _newline(self):
+        # ncurses _nc_newline_forces_scroll()
+        if self.top <= self.y <= self.bottom:
+            if self.y == self.bottom:
+                return True
+            self.y += 1
+        elif self.y < self.lines - 1:
+            self.y += 1
+        return False
+
+    def _put(self, ch, attr):
+        if ch == '\n':
+            self.clrtoeol()
+            if self._newline():
+                if not self.scroll_ok:
+                    raise curses.error('waddch() returned ERR')
+                self._scroll(self.top, self.bottom, 1)
+            self.x = 0
+            return
+        if ch == '\r':
+            self.x = 0
+            return
+        if ch == '\b':
+            if self.x > 0:
+                self.x -= 1
+            return
+        if ch == '\t':
+            self._put(' ', attr)
+            while self.x % 8:
+                self._put(' ', attr)
+            return
+        self.text[self.y][self.x] = ch
+        self.attrs[self.y][self.x] = attr | self.attr
+        self.x += 1
+        if self.x >= self.cols:
+            if self._newline():
+                self.x = self.cols - 1
+                if not self.scroll_ok:
+                    raise curses.error('waddch() returned ERR')
+                self._scroll(self.top, self.bottom, 1)
+            self.x = 0
+
+    def getyx(self):
+        return self.y, self.x
+
+    def getmaxyx(self):
+        return self.lines, self.cols
+
+    def move(self, y, x):
+        if not (0 <= y < self.lines and 0 <= x < self.cols):
+            raise curses.error('wmove() returned ERR')
+        self.y = y
+        self.x = x
+
+    def addch(self, *args):
+        args = self._args(args)
+        ch = args[0]
+        if isinstance(ch, int):
+            ch = chr(ch & 0xFF)
+        self._put(ch, args[1] if len(args) > 1 else 0)
+
+    def addstr(self, *args):
+        args = self._args(args)
+        attr = args[1] if len(args) > 1 else 0
+        for ch in str(args[0]):
+            self._put(ch, attr)
+
+    def addnstr(self, *args):
+        args = self._args(args, 2)
+        attr = args[2] if len(args) > 2 else 0
+        for ch in str(args[0])[:args[1]]:
+            self._put(ch, attr)
+
+    def insstr(self, *args):
+        args = self._args(args)
+        s = str(args[0])[:self.cols - self.x]
+        attr = (args[1] if len(args) > 1 else 0) | self.attr
+        row = self.text[self.y]
+        self.text[self.y] = (row[:self.x] + list(s) + row[self.x:])[:self.cols]
+        row = self.attrs[self.y]
+        self.attrs[self.y] = (row[:self.x] + [attr] * len(s) + row[self.x:])[:self.cols]
+
+    def insch(self, *args):
+        args = self._args(args)
+        ch = args[0]
+        if isinstance(ch, int):
+            ch = chr(ch & 0xFF)
+        self.insstr(ch, *args[1:])
+
+    def delch(self, *args):
+        self._args(args, 0)
+        del self.text[self.y][self.x]
+        del self.attrs[self.y][self.x]
+        self.text[self.y].append(' ')
+        self.attrs[self.y].append(0)
+
+    def clrtoeol(self):
+        for i in range(self.x, self.cols):
+            self.text[self.y][i] = ' '
+            self.attrs[self.y][i] = 0
+
+    def clrtobot(self):
+        self.clrtoeol()
+        for i in range(self.y + 1, self.lines):
+            self.text[i], self.attrs[i] = self._blank()
+
+    def erase(self):
+        for i in range(self.lines):
+            self.text[i], self.attrs[i] = self._blank()
+        self.y = 0
+        self.x = 0
+
+    clear = erase
+
+    def insertln(self):
+        self._scroll(self.y, self.lines - 1, -1)
+
+    def deleteln(self):
+        self._scroll(self.y, self.lines - 1, 1)
+
+    def scroll(self, n=1):
+        if not self.scroll_ok:
+            raise curses.error('scroll() returned ERR')
+        self._scroll(self.top, self.bottom, n)
+
+    def scrollok(self, flag):
+        self.scroll_ok = bool(flag)
+
+    def setscrreg(self, top, bottom):
+        self.top = top
+        self.bottom = bottom
+
+    def attron(self, attr):
+        self.attr |= attr
+
+    def attroff(self, attr):
+        self.attr &= ~attr
+
+    def attrset(self, attr):
+        self.attr = attr
+
+    def hline(self, y, x, ch, n):
+        if isinstance(ch, int):
+            ch = chr(ch & 0xFF) if ch < 0x100 else '-'
+        for i in range(x, min(x + n, self.cols)):
+            self.text[y][i] = ch
+
+    def inch(self, *args):
+        self._args(args, 0)
+        return ord(self.text[self.y][self.x]) | self.attrs[self.y][self.x]
+
+    def instr(self, *args):
+        args = self._args(args, 0)
+        n = args[0] if args else self.cols - self.x
+        return ''.join(self.text[self.y][self.x:self.x + n]).encode(code, 'replace')
+
+    def getch(self, *args):
+        if self.keys:
+            return self.keys.pop(0)
+        return NOCHAR
+
+    def refresh(self, *args):
+        pass
 
-                if Config.has_option('Fonts','Preload'):
-                    PRELOAD_FONT = Config.getboolean('Fonts','Preload')
-                else: updateFile = True
-                if Config.has_option('Fonts','Font'):
-                    FONT = Config.get('Fonts','Font')
-                else: updateFile = True
+    noutrefresh = touchwin = idlok = keypad = nodelay = leaveok = refresh
+    box = border = refresh
 
-                if Config.has_option('Colours','DefaultColour'):
-                    DEFAULT_COLOUR = Config.getint('Colours','DefaultColour')
-                else: updateFile = True
-                if Config.has_option('Colours','White'):
-                    LC_WHITE = Config.get('Colours','White')
-                else: updateFile = True
-                if Config.has_option('Colours','Green'):
-                    LC_GREEN = Config.get('Colours','Green')
-                else: updateFile = True
-                if Config.has_option('Colours','Yellow'):
-                    LC_YELLOW = Config.get('Colours','Yellow')
-                else: updateFile = True
-                if Config.has_option('Colours','Blue'):
-                    LC_BLUE = Config.get('Colours','Blue')
-                else: updateFile = True
-                if Config.has_option('Colours','Cyan'):
-                    LC_CYAN = Config.get('Colours','Cyan')
-                else: updateFile = True
-                if Config.has_option('Colours','Magenta'):
-                    LC_MAGENTA = Config.get('Colours','Magenta')
-                else: updateFile = True
-                if Config.has_option('Colours','Red'):
-                    LC_RED = Config.get('Colours','Red')
-                else: updateFile = True
+    def rows(self):
+        return [''.join(row) for row in self.text]
 
-                if Config.has_option('Date','AutoCpmDate'):
-                    AUTO_CPM_DATE = Config.getboolean('Date','AutoCpmDate')
-                else: updateFile = True
-                if Config.has_option('Date','CpmDate'):
-                    CPM_DATE_FORMAT = Config.get('Date','CpmDate')
-                else: updateFile = True
-                if Config.has_option('Date','CpmTime'):
-                    CPM_TIME_FORMAT = Config.get('Date','CpmTime')
-                else: updateFile = True
-                if Config.has_option('Date','AutoHdosDate'):
-                    AUTO_HDOS_DATE = Config.getboolean('Date','AutoHdosDate')
-                else: updateFile = True
-                if Config.has_option('Date','HdosDate'):
-                    HDOS_DATE_FORMAT = Config.get('Date','HdosDate')
-                else: updateFile = True
 
-            except:
-                print("Problem reading configuration file .h19termrc, skipping...")
+class SessionRecorder:
+    """ Records everything sent and received on the serial port.
 
-        if updateFile:
-            print("\nConfiguration file ~/.h19termrc not found:")
-            print("    A new one will be created after serial port selection...")
-            print("    You may edit this file to set your defaults...\n")
-            print("\nChecking serial ports...")
+        Unlike the log file the recording is byte for byte what went over
+        the wire, with timing, so it can be played back with --replay.
+    """
 
-            enterOne = -1
-            availablePorts = []
-            try:
-                from serial.tools.list_ports import comports
-                print("    These are a list of ports found on this system, there may be others")
-                print("    but they didn't show up in the probe...\n")
+    def __init__(self, filename):
+        self.filename = filename
+        self.fd = open(filename, 'wb')
+        self.fd.write(RECORD_MAGIC)
+        self.last = time.time()     # time of the last record written
+        self.started = self.last    # time the pending record started
+        self.direction = RECEIVED
+        self.pending = bytearray()
+
+    def record(self, direction, data):
+        if len(data) > 0xFFFF:      # a record holds at most 64K
+            for pos in range(0, len(data), 0xFFFF):
+                self.record(direction, data[pos:pos + 0xFFFF])
+            return
+        now = time.time()
+        if self.pending and (direction != self.direction or
+                             now - self.started > RECORD_COALESCE or
+                             len(self.pending) + len(data) > 0xFFFF):
+            self.flush()
+        if not self.pending:
+            self.started = now
+            self.direction = direction
+        self.pending += data
+
+    def flush(self):
+        if not self.pending:
+            return
+        delta = min(int((self.started - self.last) * 1000000), 0xFFFFFFFF)
+        self.fd.write(RECORD_HEADER.pack(max(delta, 0), self.direction, len(self.pending)))
+        self.fd.write(self.pending)
+        self.last = self.started
+        self.pending = bytearray()
+
+    def close(self):
+        self.flush()
+        self.fd.close()
+
+    @staticmethod
+    def check_magic(fd):
+        if fd.read(len(RECORD_MAGIC)) != RECORD_MAGIC:
+            raise ValueError("%s is not an h19term session recording" % fd.name)
+
+    @staticmethod
+    def read_records(fd):
+        # Generator of (seconds, direction, data) from an open recording
+        # positioned after the magic, see check_magic()
+        while True:
+            header = fd.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            delta, direction, length = RECORD_HEADER.unpack(header)
+            yield delta / 1000000.0, direction, fd.read(length)
 
-                i = 0
-                for port, desc, hwid in sorted(comports()):
-                    if hwid != 'n/a':
-                        i += 1
-                        availablePorts.append(port)
-                        print('%s.  %-15s %s' % (i,port, desc))
-                print('%s.  %-15s %s' % (i+1,'Enter one', ''))
-                enterOne = i+1
-            except:
-                print("Your python serial package doesn't have the serial port probe")
-                print("We'll have to work around it and just offer a couple of standard")
-                print("ports without knowing if they actually exist...\n")
-                print('%s.  %-15s %s' % ('1','/dev/ttyS0', 'Builtin port '))
-                print('%s.  %-15s %s' % ('2','/dev/ttyUSB0', 'USB to RS232 cable'))
-                print('%s.  %-15s %s' % ('3','Enter one', ''))
-                enetrOne = 3
-                availablePorts.append('/dev/ttyS0')
-                availablePorts.append('/dev/ttyUSB0')
 
-            print("\n   Please select one of these, or press <Enter> if you would")
-            print("   like to enter your own by editing your ~/.h19termrc configuration file.")
-            print("\n   Python doesn't always find all available ports on your computer.")
-            print("   A default baud rate of 9600 will be choosen.\n")
+class TraceWriter:
+    """ Writes what the terminal made of the host's output for --trace.
 
-            portno = input("Enter number: ")
+        One JSON object a line: t, seconds since the trace started, op, one
+        of TRACE_OPS, and the seq, text or bytes sent and where the cursor
+        was.  The terminal only queues them, a thread formats and writes.
+    """
 
-            if len(portno) > 0:
-                if int(portno) == enterOne:
-                    while True:
-                        print('\nEnter a port in the form of /dev/<devicename> or <enter> to quit')
-                        s = input('Enter port: ')
-                        if s == '':
-                            print("Using default port -> %s" % SERIAL_PORT)
-                            break
-                        if not os.path.exists(s):
-                            print('That port device doesn\'t exist...')
-                        else:
-                            SERIAL_PORT = s
-                            print("Setting port to -> %s" % SERIAL_PORT)
-                            break
-                else:
-                    SERIAL_PORT = availablePorts[int(portno)-1]
-                    print("Setting port to -> %s" % SERIAL_PORT)
-            else:
-                print("Using default port -> %s" % SERIAL_PORT)
-            print("Writing new ~/.h19termrc file...")
+    def __init__(self, filename, ops=TRACE_OPS):
+        self.fd = open(filename, 'w')
+        self.ops = set(ops)
+        self.start = time.perf_counter()
+        self.run = []               # printed characters not yet written
+        self.runStart = (0.0, 0, 0)  # time, y and x of the first of them
+        self.runLast = 0.0
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.write, daemon=True)
+        self.thread.start()
+
+    def text(self, ch, y, x):
+        if 'print' not in self.ops:
+            return
+        now = time.perf_counter()
+        if self.run and now - self.runLast > TRACE_RUN_GAP:
+            self.end_run()
+        if not self.run:
+            self.runStart = (now, y, x)
+        self.run.append(ch)
+        self.runLast = now
+
+    def end_run(self):
+        if self.run:
+            t, y, x = self.runStart
+            self.queue.put((t, 'print', {'text': ''.join(self.run), 'y': y, 'x': x}))
+            self.run = []
+
+    def op(self, op, fields):
+        self.end_run()
+        if op in self.ops:
+            self.queue.put((time.perf_counter(), op, fields))
+
+    def write(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            t, op, fields = item
+            record = {'t': round(t - self.start, 6), 'op': op}
+            record.update(fields)
+            self.fd.write(json.dumps(record) + '\n')
+        self.fd.close()
 
-            self.write_h19config(True)  # True if it's a new file not a rewrite
+    def close(self):
+        self.end_run()
+        self.queue.put(None)
+        self.thread.join()
 
-    def write_h19config(self, new=False):
-        cfgfile = ''
-        Config = configparser.ConfigParser(allow_no_value = True)
+
+class ReplayPort:
+    """ Serial port stand in that plays back a session recording.
+
+        Received data is released on the recorded timing divided by speed,
+        a speed of 0 releases it as fast as it can be read.  Anything
+        written to the port is thrown away.
+    """
+
+    def __init__(self, filename, speed=1.0):
+        self.port = filename
+        self.baudrate = BAUD_RATE
+        self.timeout = 0
+        self.out_waiting = 0
+        self.speed = speed
+        self.fd = open(filename, 'rb')
         try:
-            cfgfile = open(CONFIG_FILE, 'w')
-        except:
-            print("Problem opening configuration file .h19term, skipping...")
+            SessionRecorder.check_magic(self.fd)
+        except ValueError:
+            self.fd.close()
+            raise
+        self.records = SessionRecorder.read_records(self.fd)
+        self.next = None
+        self.eof = False
+        self.buf = bytearray()
+        self.clock = 0.0        # replay time the last record was released
+        self.start = time.time()
+        self.total = 0
+
+    def _release(self, wait):
+        # Move the records that are due into buf.  wait is how long we may
+        # sleep for the next one when nothing is buffered, None for ever.
+        while not self.eof and len(self.buf) < 4096:
+            if self.next is None:
+                self.next = next(self.records, None)
+                if self.next is None:
+                    self.eof = True
+                    self.fd.close()
+                    break
+            delta, direction, data = self.next
+            due = self.clock
+            if self.speed > 0:
+                due += delta / self.speed
+                early = due - (time.time() - self.start)
+                if early > 0:
+                    if self.buf or (wait is not None and early > wait):
+                        break
+                    time.sleep(early)
+            self.clock = due
+            self.next = None
+            if direction == RECEIVED:
+                self.buf += data
+                self.total += len(data)
+
+    @property
+    def in_waiting(self):
+        self._release(0)
+        return len(self.buf)
+
+    def read(self, n=1):
+        self._release(self.timeout)
+        data = bytes(self.buf[:n])
+        del self.buf[:n]
+        return data
+
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
 
-        # add the settings to the structure of the file, and lets write it out...
-        Config.add_section('General')
-        Config.add_section('SerialComms')
-        Config.add_section('AutoRun')
-        Config.add_section('Fonts')
-        Config.add_section('Colours')
-        Config.add_section('Date')
-        Config.set('General','SoundFile', BEEP)
-        Config.set('General','RunPath', str(RUN_PATH))
-        Config.set('General','# Use caution when increasing repeat rate to avoid overruns')
-        Config.set('General','KeyRepeatRate', str(KEY_REPEAT_RATE))
-        Config.set('SerialComms','Port', SERIAL_PORT)
-        Config.set('SerialComms','BaudRate', str(BAUD_RATE))
-        Config.set('SerialComms','XmodemPort', XMODEM_PORT)
-        Config.set('SerialComms','XmodemBaudRate', str(XMODEM_RATE))
+    def sendBreak(self, duration=0.25):
+        pass
 
-        Config.set('AutoRun', 'AutoRunMode', str(AUTORUN_MODE))
+    def close(self):
+        self.fd.close()
 
-        Config.set('Fonts','Preload',str(PRELOAD_FONT))
-        Config.set('Fonts','Font',FONT)
 
-        Config.set('Colours','# Custom colours used only for Linux console, see manual')
-        Config.set('Colours', 'White', LC_WHITE)
-        Config.set('Colours', 'Green', LC_GREEN)
-        Config.set('Colours', 'Yellow', LC_YELLOW)
-        Config.set('Colours', 'Blue', LC_BLUE)
-        Config.set('Colours', 'Cyan', LC_CYAN)
-        Config.set('Colours', 'Magenta', LC_MAGENTA)
-        Config.set('Colours', 'Red', LC_RED)
-        Config.set('Colours','# Default colour of H19term on console or Xterm, see manual')
-        Config.set('Colours','DefaultColour', str(DEFAULT_COLOUR))
+class NullPort:
+    """ A port with nothing to say that throws away what is written to it,
+        for running captured data through the terminal.
+    """
 
-        Config.set('Date','AutoCpmDate',str(AUTO_CPM_DATE))
-        Config.set('Date','CpmDate',CPM_DATE_FORMAT)
-        Config.set('Date','CpmTime',CPM_TIME_FORMAT)
-        Config.set('Date','AutoHdosDate',str(AUTO_HDOS_DATE))
-        Config.set('Date','HdosDate',HDOS_DATE_FORMAT)
-        Config.write(cfgfile)
-        cfgfile.close()
-        if new:
-            sys.exit()
+    port = 'null'
+    timeout = 0
+    in_waiting = 0
+    out_waiting = 0
 
-    def setup_screen(self):
-        self.cur = curses.initscr()  # Initialize curses.
-        curses.start_color()
+    def read(self, n=1):
+        return b''
 
-        if curses.termname() == b'linux':
-            if PRELOAD_FONT:
-                os.system("setfont %s" % os.path.join(INSTALL_PATH, FONT))
+    def write(self, data):
+        return len(data)
 
-            # setup colours for console only, X11 colours are set in the
-            # terminal application such as gnome-terminal
-            #
+    def flush(self):
+        pass
+
+
+class TranscriptRenderer:
+    """ Turns session captures into transcripts of what was on the screen.
+
+        A capture is an h19term recording or the raw bytes from the host.
+        Each runs through a headless terminal, as many at once as there are
+        cores, and the transcript is the final screen, everything that
+        scrolled off the top and then the final screen, or every screen
+        that was different from the one before.
+    """
+
+    MODES = ('final', 'scrollback', 'frames')
+
+    def __init__(self, mode='final', html=False, outdir=None, jobs=None):
+        self.mode = mode
+        self.html = html
+        self.outdir = outdir
+        self.jobs = jobs
+
+    def output_name(self, path):
+        name = os.path.basename(path) + ('.html' if self.html else '.txt')
+        return os.path.join(self.outdir or os.path.dirname(path), name)
+
+    # Yields (path, output file, error) as each capture is done
+    def run(self, paths):
+        with concurrent.futures.ProcessPoolExecutor(self.jobs) as pool:
+            jobs = {pool.submit(TranscriptRenderer.render_file, path, self.output_name(path),
+                                self.mode, self.html): path for path in paths}
+            for job in concurrent.futures.as_completed(jobs):
+                try:
+                    yield jobs[job], job.result(), None
+                except (OSError, ValueError, curses.error) as e:
+                    yield jobs[job], None, e
+
+    # (seconds or byte offset, data) of what the host sent
+    @staticmethod
+    def chunks(path):
+        with open(path, 'rb') as fd:
+            if fd.read(len(RECORD_MAGIC)) == RECORD_MAGIC:
+                seconds = 0.0
+                for delta, direction, data in SessionRecorder.read_records(fd):
+                    seconds += delta
+                    if direction == RECEIVED:
+                        yield '%.3f s' % seconds, data
+                return
+            fd.seek(0)
+            while True:
+                offset = fd.tell()
+                data = fd.read(RENDER_CHUNK)
+                if not data:
+                    return
+                yield 'byte %d' % offset, data
+
+    @staticmethod
+    def render_file(path, outname, mode, as_html):
+        text = TranscriptRenderer.render(path, mode, as_html)
+        with open(outname, 'w', encoding='utf-8') as out:
+            out.write(text)
+        return outname
+
+    @staticmethod
+    def render(path, mode, as_html=False):
+        term = H19Term()
+        term.setup_headless()
+        term.sio = NullPort()
+        screen = term.screen
+        if mode == 'scrollback':
+            screen.scrolled = []
+        frames = []
+        last = None
+        for where, data in TranscriptRenderer.chunks(path):
+            term.rxbuf += data
+            term.process_buffered(term.sio)
+            if mode == 'frames':
+                rows = list(zip([list(t) for t in screen.text], [list(a) for a in screen.attrs]))
+                if rows != last:
+                    frames.append((where, rows))
+                    last = rows
+        final = list(zip(screen.text, screen.attrs))
+        if mode == 'scrollback':
+            pages = [(None, screen.scrolled + final)]
+        elif mode == 'frames':
+            pages = frames
+        else:
+            pages = [(None, final)]
+        if as_html:
+            return TranscriptRenderer.as_html(os.path.basename(path), pages)
+        out = []
+        for where, rows in pages:
+            if where is not None:
+                out.append('--- %s ---' % where)
+            out.extend(TranscriptRenderer.trim([''.join(t).rstrip() for t, a in rows]))
+        return '\n'.join(out) + '\n'
+
+    @staticmethod
+    def trim(lines):
+        while lines and not lines[-1]:
+            lines = lines[:-1]
+        return lines
+
+    @staticmethod
+    def html_row(text, attrs):
+        out = ''
+        i = 0
+        while i < len(text):
+            rev = attrs[i] & curses.A_REVERSE
+            j = i
+            while j < len(text) and attrs[j] & curses.A_REVERSE == rev:
+                j += 1
+            run = html.escape(''.join(text[i:j]))
+            out += '<span class="rev">%s</span>' % run if rev else run
+            i = j
+        return out.rstrip()
+
+    @staticmethod
+    def as_html(title, pages):
+        out = ['<!DOCTYPE html>', '<html><head><meta charset="utf-8">',
+               '<title>%s</title>' % html.escape(title),
+               '<style>pre { background: #000; color: #3c3; padding: 1em }',
+               '.rev { background: #3c3; color: #000 }</style></head><body>']
+        for where, rows in pages:
+            if where is not None:
+                out.append('<h3>%s</h3>' % html.escape(where))
+            lines = [TranscriptRenderer.html_row(t, a) for t, a in rows]
+            out.append('<pre>%s</pre>' % '\n'.join(TranscriptRenderer.trim(lines)))
+        out.append('</body></html>')
+        return '\n'.join(out) + '\n'
+
+
+class StreamPort:
+    """ Base for ports that are not serial devices.
+
+        Looks enough like a pyserial Serial for the rest of h19term, reads
+        whatever the other end has sent in one go and has no baud rate
+        limit.  Subclasses provide fileno(), _recv() and _send().
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.baudrate = BAUD_RATE   # shown on the status line, otherwise ignored
+        self.timeout = 0
+        self.out_waiting = 0
+        self.buf = bytearray()
+        self.eof = False
+
+    def _fill(self, timeout):
+        if self.eof:
+            return
+        if timeout != 0:
+            ready, w, x = select.select([self], [], [], timeout)
+            if not ready:
+                return
+        while True:
+            data = self._recv()
+            if data is None:        # nothing more waiting
+                return
+            if data == b'':
+                self.eof = True
+                return
+            self.buf += data
+            if len(data) < TRANSPORT_READ:
+                return
+
+    @property
+    def in_waiting(self):
+        if not self.buf:
+            self._fill(0)
+        return len(self.buf)
+
+    def read(self, n=1):
+        if not self.buf:
+            self._fill(self.timeout)
+        data = bytes(self.buf[:n])
+        del self.buf[:n]
+        return data
+
+    def write(self, data):
+        if not self.eof:
+            self._send(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def sendBreak(self, duration=0.25):
+        pass
+
+
+class NetworkPort(StreamPort):
+    """ A TCP connection to an emulator or terminal server.
+
+        tcp://host:port is a raw byte stream, telnet://host:port also
+        handles telnet option negotiation, agreeing to binary, echo and
+        suppress go ahead and refusing everything else.
+    """
+
+    def __init__(self, port):
+        StreamPort.__init__(self, port)
+        scheme, address = port.split('://', 1)
+        host, sep, service = address.rpartition(':')
+        if not sep or not service.isdigit():
+            raise ValueError("%s needs a host and port number" % port)
+        self.telnet = scheme == 'telnet'
+        self.sock = socket.create_connection((host.strip('[]') or 'localhost', int(service)), 10)
+        self.sock.setblocking(False)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.state = None       # telnet command being parsed
+        self.command = 0
+        self.options = {}       # (option, our side) to what we last said
+        self.binary = False     # other end will take CR without a NUL after it
+        if self.telnet:
+            for option in TELNET_OPTIONS:
+                self._negotiate(TELNET_DO, option)
+            self._negotiate(TELNET_WILL, 0)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def _recv(self):
+        try:
+            data = self.sock.recv(TRANSPORT_READ)
+        except (BlockingIOError, InterruptedError):
+            return None
+        except OSError:
+            return b''
+        if self.telnet and data:
+            data = self._telnet(data)
+            if not data:
+                return None     # all negotiation, see if there is more
+        return data
+
+    def write(self, data):
+        if self.telnet:
+            data = data.replace(b'\xff', b'\xff\xff')
+            if not self.binary:
+                data = data.replace(b'\r', b'\r\x00')
+        return StreamPort.write(self, data)
+
+    def _send(self, data):
+        try:
+            self.sock.setblocking(True)
+            self.sock.sendall(data)
+        except OSError:
+            self.eof = True
+        finally:
+            self.sock.setblocking(False)
+
+    # Say WILL/WONT about our side or DO/DONT about theirs, unless that is
+    # what we last said, so a confirmation is never answered again.
+    def _negotiate(self, command, option):
+        side = command in (TELNET_WILL, TELNET_WONT)
+        if self.options.get((option, side)) == command:
+            return
+        self.options[(option, side)] = command
+        self._send(bytes((TELNET_IAC, command, option)))
+
+    # Strip telnet commands out of the received data and answer them
+    def _telnet(self, data):
+        out = bytearray()
+        for b in data:
+            if self.state is None:
+                if b == TELNET_IAC:
+                    self.state = TELNET_IAC
+                else:
+                    out.append(b)
+            elif self.state == TELNET_IAC:
+                if b == TELNET_IAC:
+                    out.append(b)
+                    self.state = None
+                elif b in (TELNET_WILL, TELNET_WONT, TELNET_DO, TELNET_DONT):
+                    self.command = b
+                    self.state = TELNET_WILL
+                elif b == TELNET_SB:
+                    self.state = TELNET_SB
+                else:
+                    self.state = None
+            elif self.state == TELNET_WILL:
+                self.state = None
+                accept = b in TELNET_OPTIONS
+                if self.command == TELNET_WILL:
+                    self._negotiate(TELNET_DO if accept else TELNET_DONT, b)
+                elif self.command == TELNET_DO:
+                    accept = accept and b != 1     # we don't echo
+                    self._negotiate(TELNET_WILL if accept else TELNET_WONT, b)
+                    if b == 0:
+                        self.binary = accept
+                elif self.command == TELNET_WONT:
+                    self._negotiate(TELNET_DONT, b)
+                else:
+                    self._negotiate(TELNET_WONT, b)
+                    if b == 0:
+                        self.binary = False
+            elif self.state == TELNET_SB:
+                if b == TELNET_IAC:
+                    self.state = TELNET_SE
+            elif self.state == TELNET_SE:
+                self.state = None if b == TELNET_SE else TELNET_SB
+        return bytes(out)
+
+    def sendBreak(self, duration=0.25):
+        if self.telnet:
+            self._send(bytes((TELNET_IAC, TELNET_BRK)))
+
+    def close(self):
+        self.sock.close()
+
+
+class PtyPort(StreamPort):
+    """ Runs a program on a pseudo terminal, pty:command args.
+
+        The program sees a 24x80 terminal with TERM set to h19, so a CP/M
+        emulator or anything else that talks to a terminal can be run
+        directly inside h19term.
+    """
+
+    def __init__(self, port):
+        StreamPort.__init__(self, port)
+        args = shlex.split(port[4:])
+        if not args:
+            raise ValueError("pty: needs a command to run")
+        self.master, slave = os.openpty()
+        fcntl.ioctl(slave, termios.TIOCSWINSZ, struct.pack('HHHH', 24, 80, 0, 0))
+        env = dict(os.environ, TERM='h19', LINES='24', COLUMNS='80')
+        try:
+            self.process = subprocess.Popen(args, stdin=slave, stdout=slave, stderr=slave,
+                                            env=env, start_new_session=True,
+                                            preexec_fn=self._controlling_tty)
+        except OSError:
+            os.close(self.master)
+            raise
+        finally:
+            os.close(slave)
+        os.set_blocking(self.master, False)
+
+    @staticmethod
+    def _controlling_tty():
+        # Runs in the child, job control needs the pty as its terminal
+        fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+
+    def fileno(self):
+        return self.master
+
+    def _recv(self):
+        try:
+            return os.read(self.master, TRANSPORT_READ)
+        except (BlockingIOError, InterruptedError):
+            return None
+        except OSError:     # EIO once the program has exited
+            return b''
+
+    def _send(self, data):
+        while data:
+            try:
+                data = data[os.write(self.master, data):]
+            except BlockingIOError:
+                select.select([], [self.master], [], 1.0)
+            except OSError:
+                self.eof = True
+                return
+
+    def sendBreak(self, duration=0.25):
+        try:
+            termios.tcsendbreak(self.master, 0)
+        except termios.error:
+            pass
+
+    def close(self):
+        os.close(self.master)
+        if self.process.poll() is None:
+            self.process.terminate()
+
+
+class CpmPort(StreamPort):
+    """ CP/M 2.2 on the built in Z80, cpm:DIR[,DIR...].
+
+        Each directory, or 8 inch disk image, is a drive from A: on.  The
+        machine runs in a thread and BREAK warm boots it.
+    """
+
+    def __init__(self, port):
+        StreamPort.__init__(self, port)
+        drives = CpmMachine.open_drives(port[4:])
+        self.input, output = os.pipe()
+        os.set_blocking(self.input, False)
+        self.machine = CpmMachine(drives, output)
+        self.thread = threading.Thread(target=self.machine.run, name='cpm', daemon=True)
+        self.thread.start()
+
+    def fileno(self):
+        return self.input
+
+    def _recv(self):
+        try:
+            return os.read(self.input, TRANSPORT_READ)
+        except BlockingIOError:
+            return None
+
+    def _send(self, data):
+        self.machine.type(data)
+
+    def sendBreak(self, duration=0.25):
+        self.machine.reset()
+
+    def close(self):
+        self.machine.stop()
+        os.close(self.input)
+
+
+class FileViewer:
+    """ Pager for help, log and capture files of any size.
+
+        The file is memory mapped and only the lines on screen are ever
+        decoded.  A sparse line index is built a chunk at a time while the
+        viewer is idle, searches run in a worker thread and follow mode
+        tails a file that is still growing.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.fd = open(filename, 'rb')
+        self.mm = b''
+        self.size = 0
+        self.top = 0            # offset of the first line on screen
+        self.col = 0            # horizontal scroll
+        self.chunks = [0]       # line count at the start of each VIEW_CHUNK
+        self.message = ''
+        self.follow = False
+        self.regex = None
+        self.match = None       # (start, end) of the last search hit
+        self.search_thread = None
+        self.search_cancel = False
+        self.search_result = None
+        self.search_pos = 0
+        self.remap()
+
+    # A search still running is stopped while the map changes under it and
+    # then carries on from where it got to
+    def remap(self):
+        size = os.fstat(self.fd.fileno()).st_size
+        if size == self.size:
+            return False
+        searching = self.search_thread is not None and self.search_thread.is_alive()
+        if searching:
+            self.search_cancel = True
+            self.search_thread.join()
+        if isinstance(self.mm, mmap.mmap):
+            self.mm.close()
+        self.mm = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.size = size
+        if searching:
+            self.start_search(self.regex.pattern.decode(), self.search_pos)
+        return True
+
+    def close(self):
+        self.search_cancel = True
+        if self.search_thread:
+            self.search_thread.join()
+        if isinstance(self.mm, mmap.mmap):
+            self.mm.close()
+        self.fd.close()
+
+    # Line navigation works on byte offsets so nothing needs to be indexed
+    # before the first screen is drawn.
+    def line_start(self, pos):
+        return self.mm.rfind(b'\n', 0, pos) + 1
+
+    def line_end(self, pos):
+        end = self.mm.find(b'\n', pos)
+        return self.size if end < 0 else end
+
+    def next_line(self, pos):
+        end = self.mm.find(b'\n', pos)
+        if end < 0 or end + 1 >= self.size:
+            return None
+        return end + 1
+
+    def prev_line(self, pos):
+        if pos <= 0:
+            return None
+        return self.line_start(pos - 1)
+
+    def last_page(self, rows):
+        pos = self.line_start(max(self.size - 1, 0))
+        for _ in range(rows - 1):
+            prev = self.prev_line(pos)
+            if prev is None:
+                break
+            pos = prev
+        return pos
+
+    def index_more(self, chunks=64):
+        # Extend the line index, returns False once the whole file is done
+        for _ in range(chunks):
+            start = (len(self.chunks) - 1) * VIEW_CHUNK
+            if start >= self.size:
+                return False
+            end = min(start + VIEW_CHUNK, self.size)
+            if end - start < VIEW_CHUNK:
+                return False    # last partial chunk is counted on demand
+            self.chunks.append(self.chunks[-1] + self.mm[start:end].count(b'\n'))
+        return True
+
+    def line_number(self, pos):
+        i = pos // VIEW_CHUNK
+        if i >= len(self.chunks):
+            return None
+        start = i * VIEW_CHUNK
+        return self.chunks[i] + self.mm[start:pos].count(b'\n') + 1
+
+    def goto_line(self, n):
+        # Only walks within an indexed chunk so it never scans the whole file
+        i = bisect.bisect_right(self.chunks, n - 1) - 1
+        pos = self.line_start(i * VIEW_CHUNK)
+        line = self.line_number(pos)
+        limit = (i + 2) * VIEW_CHUNK
+        while line < n and pos < limit:
+            nxt = self.next_line(pos)
+            if nxt is None:
+                break
+            pos = nxt
+            line += 1
+        return pos
+
+    def display_line(self, pos):
+        text = self.mm[pos:self.line_end(pos)].rstrip(b'\r').decode('utf-8', 'replace')
+        if text.startswith('\ufeff'):
+            text = text[1:]
+        return text.expandtabs().translate(VIEW_CONTROL_CHARS)
+
+    # Screen column a byte of the line at pos lands on after display_line()
+    def display_column(self, pos, offset):
+        text = self.mm[pos:offset].decode('utf-8', 'replace')
+        if text.startswith('\ufeff'):
+            text = text[1:]
+        return len(text.expandtabs().translate(VIEW_CONTROL_CHARS))
+
+    def _search(self, regex, pos):
+        while pos < self.size and not self.search_cancel:
+            end = self.line_end(min(pos + VIEW_CHUNK, self.size))
+            m = regex.search(self.mm, pos, end)
+            if m:
+                self.search_result = (m.start(), m.end())
+                return
+            pos = end + 1
+            self.search_pos = pos
+        if not self.search_cancel:
+            self.search_result = False
+
+    def start_search(self, pattern, pos):
+        try:
+            self.regex = re.compile(pattern.encode())
+        except re.error as e:
+            self.message = "Bad pattern: %s" % e
+            return
+        self.search_cancel = False
+        self.search_result = None
+        self.search_pos = pos
+        self.search_thread = threading.Thread(target=self._search, args=(self.regex, pos),
+                                              daemon=True)
+        self.search_thread.start()
+
+    def prompt(self, win, rows, text):
+        win.nodelay(0)
+        win.move(rows, 0)
+        win.clrtoeol()
+        win.addstr(rows, 0, text, curses.A_BOLD)
+        curses.echo()
+        curses.curs_set(CURSOR_NORMAL)
+        try:
+            s = win.getstr(rows, len(text), 60).decode()
+        except curses.error:
+            s = ''
+        curses.noecho()
+        curses.curs_set(CURSOR_INVISIBLE)
+        win.timeout(VIEW_TICK)
+        return s.strip()
+
+    def draw(self, win, rows, cols):
+        pos = self.top
+        for row in range(rows):
+            win.move(row, 0)
+            win.clrtoeol()
+            if pos is None or pos >= self.size:
+                pos = None
+                continue
+            text = self.display_line(pos)[self.col:]
+            win.addnstr(row, 0, text, cols)
+            end = self.line_end(pos)
+            if self.match and pos <= self.match[0] <= end:
+                # highlight the hit where tabs and ^X expansion moved it to
+                start = self.display_column(pos, self.match[0])
+                x = start - self.col
+                n = self.display_column(pos, min(self.match[1], end)) - start
+                if 0 <= x < cols and n > 0:
+                    win.chgat(row, x, min(n, cols - x), curses.A_REVERSE)
+            pos = self.next_line(pos)
+
+        line = self.line_number(self.top)
+        status = "%s  Line %s  Byte %d/%d  %d%%" % (
+            os.path.basename(self.filename), line if line else '?', self.top,
+            self.size, self.top * 100 // self.size if self.size else 100)
+        if self.follow:
+            status += "  [FOLLOW]"
+        if self.search_thread and self.search_thread.is_alive():
+            status += "  Searching %d%%..." % (self.search_pos * 100 // max(self.size, 1))
+        if self.message:
+            status += "  " + self.message
+        win.move(rows, 0)
+        win.clrtoeol()
+        win.addnstr(rows, 0, status, cols - 1, curses.A_REVERSE)
+        win.refresh()
+
+    # Run the pager in win until 'q'.  idle is called every tick while
+    # following so the caller can keep its own work going.
+    def run(self, win, idle=None):
+        lines, cols = win.getmaxyx()
+        rows = lines - 1
+        win.keypad(1)
+        win.timeout(VIEW_TICK)
+        while True:
+            self.draw(win, rows, cols)
+            c = win.getch()
+
+            if self.search_result is not None:
+                if self.search_result:
+                    self.match = self.search_result
+                    self.top = self.line_start(self.match[0])
+                    self.message = ''
+                else:
+                    self.message = "Pattern not found"
+                self.search_result = None
+
+            if c == NOCHAR:
+                if self.follow:
+                    if idle:
+                        idle()
+                    if self.remap():
+                        self.top = self.last_page(rows)
+                    win.touchwin()
+                self.index_more()
+                continue
+
+            if c != ord('f') and c != ord('F'):
+                self.follow = False
+            self.message = ''
+
+            if c in (ord('q'), ord('Q')):
+                if self.search_thread and self.search_thread.is_alive():
+                    self.search_cancel = True
+                    continue
+                break
+            elif c == curses.KEY_UP:
+                prev = self.prev_line(self.top)
+                if prev is not None:
+                    self.top = prev
+            elif c == curses.KEY_DOWN:
+                nxt = self.next_line(self.top)
+                if nxt is not None:
+                    self.top = nxt
+            elif c == curses.KEY_PPAGE:
+                for _ in range(rows):
+                    prev = self.prev_line(self.top)
+                    if prev is None:
+                        break
+                    self.top = prev
+            elif c == curses.KEY_NPAGE:
+                for _ in range(rows):
+                    nxt = self.next_line(self.top)
+                    if nxt is None:
+                        break
+                    self.top = nxt
+            elif c == curses.KEY_LEFT:
+                self.col = max(self.col - 8, 0)
+            elif c == curses.KEY_RIGHT:
+                self.col += 8
+            elif c == curses.KEY_HOME:
+                self.top = 0
+                self.col = 0
+            elif c == curses.KEY_END:
+                self.top = self.last_page(rows)
+            elif c in (ord('f'), ord('F')):
+                self.follow = not self.follow
+                if self.follow:
+                    self.remap()
+                    self.top = self.last_page(rows)
+            elif c in (ord('g'), ord('G')):
+                s = self.prompt(win, rows, "Go to byte offset, n% or :line > ")
+                try:
+                    if s.startswith(':'):
+                        self.top = self.goto_line(int(s[1:]))
+                        if self.line_number(self.top) != int(s[1:]):
+                            self.message = "Line index still building"
+                    elif s.endswith('%'):
+                        self.top = self.line_start(self.size * min(int(s[:-1]), 100) // 100)
+                    elif s:
+                        self.top = self.line_start(min(int(s, 0), self.size))
+                except ValueError:
+                    self.message = "Not a number"
+            elif c == ord('/'):
+                s = self.prompt(win, rows, "Search regex > ")
+                if s:
+                    self.start_search(s, self.top)
+            elif c in (ord('n'), ord('N')):
+                if self.regex is None:
+                    self.message = "No previous search"
+                else:
+                    pos = self.match[0] + 1 if self.match else self.top
+                    self.start_search(self.regex.pattern.decode(), pos)
+
+        curses.flushinp()
+        self.close()
+
+
+class Responder:
+    """ Watches received data for trigger patterns and answers them.
+
+        Literal patterns are compiled into one Aho-Corasick automaton with a
+        full transition table, so each received byte costs one table step
+        however many triggers there are.  Regular expression patterns are
+        searched for in the current line each time data arrives, behind one
+        combined regex that says whether any of them can match.  Responses
+        are str.format templates filled in when the trigger fires, {date:...}
+        is the current time and {0}, {1}... the match and its groups.
+    """
+
+    def __init__(self, triggers):
+        self.triggers = triggers
+        self.literals = [t for t in triggers if not t['regex']]
+        self.regexes = [t for t in triggers if t['regex']]
+
+        # Build the trie then turn it into a DFA, out[] holds the indexes of
+        # the literals that end in each state.
+        delta = [[0] * 128]
+        fail = [0]
+        self.out = [[]]
+        for i, t in enumerate(self.literals):
+            s = 0
+            for b in t['match'].encode('latin-1', 'replace'):
+                b &= 0x7F
+                if delta[s][b] == 0:
+                    delta.append([0] * 128)
+                    fail.append(0)
+                    self.out.append([])
+                    delta[s][b] = len(delta) - 1
+                s = delta[s][b]
+            self.out[s].append(i)
+        queue = [s for s in delta[0] if s]
+        while queue:
+            s = queue.pop(0)
+            self.out[s] = self.out[s] + self.out[fail[s]]
+            for b in range(128):
+                nxt = delta[s][b]
+                if nxt:
+                    fail[nxt] = delta[fail[s]][b]
+                    queue.append(nxt)
+                else:
+                    delta[s][b] = delta[fail[s]][b]
+        self.delta = delta
+
+        # Patterns with backreferences would point at the wrong groups once
+        # combined so they are always searched for on their own.
+        self.compiled = [re.compile(t['match']) for t in self.regexes]
+        simple = [i for i, t in enumerate(self.regexes)
+                  if not re.search(r'\\[1-9]|\(\?P=', t['match'])]
+        self.unfiltered = [i for i in range(len(self.regexes)) if i not in simple]
+        self.combined = None
+        if simple:
+            try:
+                self.combined = re.compile('|'.join('(?:%s)' % self._scoped(self.regexes[i]['match'])
+                                                    for i in simple))
+            except re.error:    # such as the same group name in two patterns
+                self.unfiltered = list(range(len(self.regexes)))
+        self.reset()
+
+    @staticmethod
+    def _scoped(pattern):
+        # (?i)abc becomes (?i:abc) so its flags don't leak into the others
+        m = re.match(r'\(\?([aiLmsux]+)\)', pattern)
+        if m is None:
+            return pattern
+        return '(?%s:%s%s)' % (m.group(1), pattern[m.end():], '\n' if 'x' in m.group(1) else '')
+
+    def reset(self):
+        self.state = 0
+        self.line = ''          # received text since the last LF
+        self.fired = set()      # regex triggers already answered on this line
+        self.lines = 0          # lines since boot
+
+    def _response(self, t, m):
+        groups = (m.group(0),) + m.groups() if hasattr(m, 'groups') else (m,)
+        try:
+            return t['send'].format(*groups, date=datetime.datetime.now())
+        except (IndexError, KeyError, ValueError):
+            return t['send']
+
+    # base is where self.line starts in the chunk being fed, it is negative
+    # when the line began in an earlier chunk
+    def _check_line(self, responses, base):
+        if self.combined and self.combined.search(self.line):
+            candidates = range(len(self.regexes))
+        else:
+            candidates = self.unfiltered
+        for i in candidates:
+            t = self.regexes[i]
+            if i in self.fired or (t['bootonly'] and self.lines >= TRIGGER_BOOT_LINES):
+                continue
+            m = self.compiled[i].search(self.line)
+            if m is None:
+                continue
+            self.fired.add(i)
+            responses.append((t, self._response(t, m)))
+            end = max(base + m.end(), 0)
+            if self.match_end is None or end < self.match_end:
+                self.match_end = end
+
+    def feed(self, data):
+        # data is a chunk of received bytes, returns (trigger, response) for
+        # each trigger that fired.  match_end is left at the offset in data
+        # just past the first match.
+        responses = []
+        self.match_end = None
+        data = data.translate(STRIP_HIGH_BIT)
+        if self.literals:
+            s = self.state
+            delta = self.delta
+            out = self.out
+            for pos, b in enumerate(data):
+                s = delta[s][b]
+                if out[s]:
+                    for i in out[s]:
+                        t = self.literals[i]
+                        if not t['bootonly'] or self.lines < TRIGGER_BOOT_LINES:
+                            responses.append((t, self._response(t, t['match'])))
+                            if self.match_end is None:
+                                self.match_end = pos + 1
+            self.state = s
+
+        if not self.regexes:
+            self.lines += data.count(b'\n')
+            return responses
+
+        pieces = data.decode('latin-1').split(LF)
+        start = 0
+        for piece in pieces[:-1]:
+            base = start - len(self.line)
+            self.line += piece
+            self._check_line(responses, base)
+            start += len(piece) + 1
+            self.line = ''
+            self.fired = set()
+            self.lines += 1
+        base = start - len(self.line)
+        self.line += pieces[-1]
+        if len(self.line) > TRIGGER_LINE_MAX:
+            base += len(self.line) - TRIGGER_LINE_MAX
+            self.line = self.line[-TRIGGER_LINE_MAX:]
+        if pieces[-1]:
+            self._check_line(responses, base)
+        return responses
+
+
+class Script:
+    """ Runs an expect style script against the session.
+
+        The script is stepped from the main loop and never blocks it, XMODEM
+        transfers run on a thread of their own.  Received data is pushed
+        into whatever the script is waiting for by H19Term.received() so the
+        incoming stream is never polled.  See the manual for the commands.
+    """
+
+    def __init__(self, term, filename):
+        self.term = term
+        self.filename = filename
+        self.commands = []      # (line number, command, arguments)
+        self.labels = {}
+        with open(filename) as fd:
+            for lineno, line in enumerate(fd, 1):
+                try:
+                    words = shlex.split(line, comments=True)
+                except ValueError as e:
+                    raise ValueError("line %d: %s" % (lineno, e))
+                if not words:
+                    continue
+                cmd = words[0].lower()
+                if cmd not in SCRIPT_COMMANDS:
+                    raise ValueError("line %d: unknown command %s" % (lineno, words[0]))
+                if cmd == 'label':
+                    self.labels[words[1]] = len(self.commands)
+                self.commands.append((lineno, cmd, words[1:]))
+        for lineno, cmd, args in self.commands:
+            if cmd in ('goto', 'ontimeout') and args and args[0] != 'abort' and \
+                    args[0] not in self.labels:
+                raise ValueError("line %d: no label %s" % (lineno, args[0]))
+
+        self.pc = 0
+        self.timeout = SCRIPT_TIMEOUT
+        self.ontimeout = None
+        self.pace = 0.0
+        self.sendq = ''
+        self.next_send = 0.0
+        self.matcher = None     # Responder for the patterns being expected
+        self.pending = b''      # received data no expect has matched yet
+        self.expecting = ''
+        self.waitline = 0
+        self.deadline = None
+        self.capture = None
+        self.transfer = None    # thread sending a file by XMODEM
+        self.transfer_ok = []   # the transfer appends True or False when done
+        self.done = False
+        self.status = 0
+        self.message = ''
+
+    def received(self, data):
+        if self.capture:
+            self.capture.write(data.translate(STRIP_HIGH_BIT))
+        # Hold on to what the current expect hasn't used so the next one
+        # sees anything that arrived in the same chunk.
+        self.pending = (self.pending + data)[-SCRIPT_BACKLOG:]
+        if self.matcher:
+            self.match(data)
+
+    def match(self, data):
+        if self.matcher.feed(data):
+            # pending ends where data ends, keep what came after the match
+            keep = len(data) - self.matcher.match_end
+            self.pending = self.pending[max(len(self.pending) - keep, 0):]
+            self.matcher = None
+            self.deadline = None
+
+    def finish(self, status, message):
+        self.done = True
+        self.status = status
+        self.message = message
+        self.matcher = None
+        if self.capture:
+            self.capture.close()
+            self.capture = None
+
+    def fail(self, lineno, message):
+        self.finish(1, "%s line %d: %s" % (os.path.basename(self.filename), lineno, message))
+
+    def wait_time(self):
+        # How long the caller can wait for input before stepping again
+        now = time.time()
+        if self.transfer:
+            return 0.1
+        if self.sendq:
+            return max(self.next_send - now, 0)
+        if self.deadline is not None:
+            return max(self.deadline - now, 0)
+        return SCRIPT_IDLE
+
+    def expect(self, lineno, triggers):
+        self.waitline = lineno
+        self.matcher = Responder(triggers)
+        self.expecting = ' or '.join(t['match'] for t in triggers)
+        self.deadline = time.time() + self.timeout
+        if self.pending:
+            self.match(self.pending)
+
+    # Run commands until one has to wait.  Returns False once finished.
+    def step(self, sio):
+        term = self.term
+        while not self.done:
+            now = time.time()
+            if self.sendq:
+                if now < self.next_send:
+                    return True
+                if self.pace:
+                    term.sio_write(sio, self.sendq[0])
+                    self.sendq = self.sendq[1:]
+                    self.next_send = now + self.pace
+                else:
+                    term.sio_write(sio, self.sendq)
+                    self.sendq = ''
+                continue
+            if self.matcher:
+                if now < self.deadline:
+                    return True
+                self.matcher = None
+                self.deadline = None
+                if self.ontimeout is None:
+                    self.fail(self.waitline, "timed out waiting for %s" % self.expecting)
+                    return False
+                self.pc = self.labels[self.ontimeout]
+                continue
+            if self.transfer:
+                if self.transfer.is_alive():
+                    return True
+                self.transfer = None
+                if not self.transfer_ok.pop():
+                    self.fail(self.waitline, "transfer of %s failed" % self.expecting)
+                    return False
+                continue
+            if self.deadline is not None:   # sleeping
+                if now < self.deadline:
+                    return True
+                self.deadline = None
+
+            if self.pc >= len(self.commands):
+                self.finish(0, "%s finished" % os.path.basename(self.filename))
+                return False
+            lineno, cmd, args = self.commands[self.pc]
+            self.pc += 1
+            try:
+                if cmd == 'send':
+                    self.sendq += codecs.decode(' '.join(args), 'unicode_escape')
+                elif cmd == 'sendline':
+                    self.sendq += codecs.decode(' '.join(args), 'unicode_escape') + CR
+                elif cmd == 'expect':
+                    self.expect(lineno, [{'match': codecs.decode(a, 'unicode_escape'),
+                                          'send': '', 'regex': False, 'bootonly': False}
+                                         for a in args])
+                elif cmd == 'expect-re':
+                    self.expect(lineno, [{'match': a, 'send': '', 'regex': True,
+                                          'bootonly': False} for a in args])
+                elif cmd == 'prompt':
+                    self.expect(lineno, [{'match': SCRIPT_PROMPT, 'send': '', 'regex': True,
+                                          'bootonly': False}])
+                elif cmd == 'timeout':
+                    self.timeout = float(args[0])
+                elif cmd == 'ontimeout':
+                    self.ontimeout = None if args[0] == 'abort' else args[0]
+                elif cmd == 'pace':
+                    self.pace = float(args[0]) / 1000.0
+                elif cmd == 'sleep':
+                    self.deadline = now + float(args[0])
+                elif cmd == 'goto':
+                    self.pc = self.labels[args[0]]
+                elif cmd == 'capture':
+                    if self.capture:
+                        self.capture.close()
+                        self.capture = None
+                    if args[0] != 'off':
+                        self.capture = open(os.path.expanduser(args[0]), 'ab')
+                elif cmd == 'xmodem':
+                    self.waitline = lineno
+                    self.expecting = args[0]
+                    self.transfer = term.script_xmodem(sio, os.path.expanduser(args[0]),
+                                                       args[1:] == ['auto'], self.transfer_ok)
+                elif cmd == 'echo':
+                    term.script_echo(' '.join(args))
+                elif cmd == 'exit':
+                    self.finish(int(args[0]) if args else 0, ' '.join(args[1:]))
+                    return False
+            except (IndexError, ValueError, OSError, re.error) as e:
+                self.fail(lineno, "%s: %s" % (cmd, e))
+                return False
+        return False
+
+
+class BaudProbe:
+    """ Finds which serial ports have an H8 on them and at what speed.
+
+        Each port is tried on its own thread, stepping through the baud
+        rates, sending a CR to get a prompt and scoring what comes back for
+        7 bit ASCII and H19 escape sequences.  At the wrong speed the
+        bytes are mostly framing errors, NULs and high bits.
+    """
+
+    def __init__(self, ports, rates, elicit=True):
+        self.ports = ports
+        self.rates = rates
+        self.elicit = elicit
+        self.results = {}   # port to (score, rate, bytes received)
+
+    @staticmethod
+    def score(data):
+        if len(data) < PROBE_MIN_BYTES:
+            return 0.0
+        good = 0.0
+        for i, b in enumerate(data):
+            c = b & 0x7F
+            if 31 < c < 127 or c in (7, 8, 9, 10, 13):
+                ok = True
+            elif c == 27:
+                ok = i + 1 < len(data) and (data[i + 1] & 0x7F) in PROBE_ESCAPES
+            else:
+                ok = False
+            if ok:
+                good += 1.0 if b < 0x80 else 0.5    # some hosts set the high bit
+        return good / len(data)
+
+    def probe_port(self, port):
+        try:
+            ser = serial.Serial(port, self.rates[0], timeout=PROBE_TIME)
+        except (OSError, ValueError):
+            return
+        try:
+            for rate in self.rates:
+                ser.baudrate = rate
+                ser.reset_input_buffer()
+                if self.elicit:
+                    ser.write(b'\r')
+                data = ser.read(PROBE_READ)
+                score = self.score(data)
+                if score > self.results.get(port, (0.0,))[0]:
+                    self.results[port] = (score, rate, data)
+                if score >= PROBE_GOOD:
+                    break
+        except (OSError, ValueError):
+            pass
+        finally:
+            ser.close()
+
+    def run(self):
+        threads = [threading.Thread(target=self.probe_port, args=(port,), daemon=True)
+                   for port in self.ports]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(PROBE_TIME * len(self.rates) + 1.0)
+        return self.results
+
+    # (port, rate, score) of the likeliest H8, None if nothing answered
+    def best(self):
+        results = self.run()
+        if not results:
+            return None
+        port = max(results, key=lambda p: (results[p][0], len(results[p][2])))
+        score, rate, data = results[port]
+        return port, rate, score
+
+
+class LatencyHistogram:
+    """ Histogram of latencies in the style of HdrHistogram.
+
+        Each power of two microseconds is split into 16 buckets, so every
+        value is kept to within about 6 percent however wide the range.
+    """
+
+    SUB_BUCKETS = 16
+
+    def __init__(self):
+        self.counts = {}    # lowest microseconds in the bucket to count
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        us = max(int(seconds * 1000000), 0)
+        low = us - us % self.width(us)
+        self.counts[low] = self.counts.get(low, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def width(self, us):
+        if us < self.SUB_BUCKETS:
+            return 1
+        return 1 << (us.bit_length() - self.SUB_BUCKETS.bit_length() + 1)
+
+    # Seconds that p percent of the values are no bigger than
+    def percentile(self, p):
+        if self.count == 0:
+            return 0.0
+        wanted = self.count * p / 100.0
+        seen = 0
+        for low in sorted(self.counts):
+            seen += self.counts[low]
+            if seen >= wanted:
+                return min(low + self.width(low) - 1, self.max * 1000000) / 1000000.0
+        return self.max
+
+    def as_dict(self):
+        ms = lambda seconds: round(seconds * 1000, 3)
+        return {'count': self.count,
+                'mean_ms': ms(self.total / self.count) if self.count else 0.0,
+                'p50_ms': ms(self.percentile(50)),
+                'p90_ms': ms(self.percentile(90)),
+                'p99_ms': ms(self.percentile(99)),
+                'max_ms': ms(self.max),
+                'buckets_us': {str(low): n for low, n in sorted(self.counts.items())}}
+
+
+class TokenBucket:
+    """ Lets rate items a second through on average, and up to burst at
+        once after a quiet spell.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.perf_counter()
+
+    def refill(self):
+        now = time.perf_counter()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    # How many of wanted can go now, they are used up
+    def take(self, wanted):
+        self.refill()
+        n = min(wanted, int(self.tokens))
+        self.tokens -= n
+        return n
+
+    # Seconds until the next one can go
+    def wait(self):
+        self.refill()
+        return max(1 - self.tokens, 0.0) / self.rate
+
+
+class LineEditor:
+    """ Local line editing for CP/M and HDOS prompts, CTRL-\\ toggles it.
+
+        Keys stay here until Enter and then the whole line goes to the host.
+        Sent lines are kept in a history file, Up and Down step through it
+        and CTRL-R searches back through it.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.history = None     # read on first use
+        self.width = 79
+        self.clear()
+
+    def clear(self):
+        self.line = ''
+        self.cursor = 0
+        self.browse = None      # where we are in the history with Up and Down
+        self.saved = ''         # the line as typed, before Up or CTRL-R
+        self.search = None      # text CTRL-R is looking for
+        self.found = 0
+
+    def load(self):
+        if self.history is None:
+            try:
+                with open(self.filename, encoding='utf-8', errors='replace') as f:
+                    lines = f.read().splitlines()
+            except OSError:
+                lines = []
+            self.history = lines[-HISTORY_SIZE:]
+            if len(lines) > 2 * HISTORY_SIZE:
+                self.rewrite()
+        return self.history
+
+    def rewrite(self):
+        try:
+            with open(self.filename, 'w', encoding='utf-8') as f:
+                f.writelines(line + '\n' for line in self.history)
+        except OSError:
+            pass
+
+    def remember(self, line):
+        history = self.load()
+        if not line.strip() or (history and history[-1] == line):
+            return
+        history.append(line)
+        del history[:-HISTORY_SIZE]
+        try:
+            with open(self.filename, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        except OSError:
+            pass    # still in the history until we exit
+
+    # The text to show and where the cursor goes in it
+    def display(self):
+        if self.search is None:
+            return self.line, self.cursor
+        prompt = "(search)'%s': " % self.search
+        return prompt + self.line, len(prompt) - 3
+
+    # Take a key.  Returns what to send to the host, '' for nothing yet, or
+    # None if the key isn't ours and should go to the host as usual.
+    def key(self, c):
+        if self.search is not None:
+            return self.search_key(c)
+        if c in (10, 13, curses.KEY_ENTER):
+            line = self.line
+            self.remember(line)
+            self.clear()
+            return line + '\r'
+        if 31 < c < 127:
+            if len(self.line) < self.width:
+                self.line = self.line[:self.cursor] + chr(c) + self.line[self.cursor:]
+                self.cursor += 1
+        elif c in (curses.KEY_BACKSPACE, 8, 127):
+            if self.cursor:
+                self.line = self.line[:self.cursor - 1] + self.line[self.cursor:]
+                self.cursor -= 1
+        elif c == curses.KEY_DC:
+            self.line = self.line[:self.cursor] + self.line[self.cursor + 1:]
+        elif c == curses.KEY_LEFT:
+            self.cursor = max(self.cursor - 1, 0)
+        elif c == curses.KEY_RIGHT:
+            self.cursor = min(self.cursor + 1, len(self.line))
+        elif c == curses.KEY_HOME:
+            self.cursor = 0
+        elif c == curses.KEY_END:
+            self.cursor = len(self.line)
+        elif c == 21:               # CTRL-U
+            self.line = ''
+            self.cursor = 0
+        elif c == curses.KEY_UP:
+            self.step(-1)
+        elif c == curses.KEY_DOWN:
+            self.step(1)
+        elif c == 18:               # CTRL-R
+            self.load()
+            self.saved = self.line
+            self.search = ''
+            self.found = len(self.history)
+        elif not self.line:         # CTRL-C and friends at an empty prompt
+            return None
+        return ''
+
+    def step(self, direction):
+        history = self.load()
+        if self.browse is None:
+            if direction > 0:
+                return
+            self.browse = len(history)
+            self.saved = self.line
+        self.browse = min(max(self.browse + direction, 0), len(history))
+        self.line = history[self.browse] if self.browse < len(history) else self.saved
+        self.line = self.line[:self.width]
+        self.cursor = len(self.line)
+
+    # Look back through the history from start for the search text
+    def find(self, start):
+        for i in range(min(start, len(self.history) - 1), -1, -1):
+            if self.search in self.history[i]:
+                self.found = i
+                self.line = self.history[i][:self.width]
+                self.cursor = len(self.line)
+                return True
+        return False
+
+    def search_key(self, c):
+        if c == 18:                 # CTRL-R again, the next one back
+            self.find(self.found - 1)
+        elif 31 < c < 127:
+            self.search += chr(c)
+            self.find(self.found)
+        elif c in (curses.KEY_BACKSPACE, 8, 127):
+            self.search = self.search[:-1]
+            self.find(len(self.history) - 1)
+        elif c in (7, 27):          # CTRL-G or ESC gives up
+            self.search = None
+            self.line = self.saved
+            self.cursor = len(self.line)
+        else:                       # keep what was found and use the key on it
+            self.search = None
+            return self.key(c)
+        return ''
+
+
+class SessionStats:
+    """ Counters kept for each session, shown with CTRL-A I.
+
+        They are plain increments so keeping them costs next to nothing
+        when no one is looking.  The main loop figures are only kept by
+        the first session.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.escapes = {}       # sequence, such as 'ESC Y', to count
+        self.dropped = 0        # escape sequences we didn't understand
+        self.refreshes = 0
+        self.xoff = 0           # received from the host
+        self.xon = 0
+        self.xoffSent = 0       # sent by our flow control
+        self.xonSent = 0
+        self.wakeups = 0
+        self.longestPass = 0.0  # seconds, slowest trip round the main loop
+        self.echo = LatencyHistogram()  # typed character to the host's echo
+        self.echoLost = 0       # typed characters that never came back
+
+    def escape(self, name):
+        self.escapes[name] = self.escapes.get(name, 0) + 1
+
+    def loop_pass(self, seconds):
+        self.wakeups += 1
+        if seconds > self.longestPass:
+            self.longestPass = seconds
+
+    def as_dict(self):
+        return {'seconds': round(time.time() - self.started, 3),
+                'bytes_in': self.bytesIn,
+                'bytes_out': self.bytesOut,
+                'escapes': dict(self.escapes),
+                'dropped': self.dropped,
+                'refreshes': self.refreshes,
+                'xoff': self.xoff,
+                'xon': self.xon,
+                'xoff_sent': self.xoffSent,
+                'xon_sent': self.xonSent,
+                'wakeups': self.wakeups,
+                'longest_pass_ms': round(self.longestPass * 1000, 3),
+                'echo_latency': self.echo.as_dict(),
+                'echo_lost': self.echoLost}
+
+
+class ScreenMirror:
+    """ Shows the sessions' screens to other programs and viewers.
+
+        A client connects to the Unix socket and sends one line, "screen"
+        for the screen and cursor as JSON or "watch" for a snapshot and then
+        the rows that change, followed by a session number for any session
+        but the first.  WebSocket clients ask for /screen or /watch/2 and
+        so on.  The screens are read on the main loop by tick(), each client
+        is written to by its own thread so a slow one only holds itself up.
+    """
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self.lock = threading.Lock()
+        self.viewers = []
+        self.last = {}          # session number to the rows it had last tick
+        self.lastTick = 0.0
+
+    def listen(self, path):
+        if os.path.lexists(path):
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                raise FileExistsError(errno.EEXIST, "not a socket, won't replace it", path)
+            os.unlink(path)     # left by an earlier run
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(5)
+        threading.Thread(target=self.accept, args=(server, False), daemon=True).start()
+
+    # Only on this machine, the viewers can't type but can see everything
+    def listen_websocket(self, port):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(('127.0.0.1', port))
+        server.listen(5)
+        threading.Thread(target=self.accept, args=(server, True), daemon=True).start()
+
+    def accept(self, server, websocket):
+        while True:
+            conn, addr = server.accept()
+            threading.Thread(target=self.serve, args=(conn, websocket), daemon=True).start()
+
+    def serve(self, conn, websocket):
+        viewer = {'queue': queue.Queue(MIRROR_BACKLOG), 'snapshot': True}
+        try:
+            conn.settimeout(5)
+            if websocket:
+                request = self.websocket_accept(conn).strip('/').replace('/', ' ')
+            else:
+                request = conn.makefile('rb').readline().decode('ascii', 'replace')
+            conn.settimeout(None)
+            words = request.split() or ['watch']
+            viewer['once'] = words[0] != 'watch'
+            viewer['session'] = int(words[1]) if len(words) > 1 else 1
+            if words[0] not in ('screen', 'watch') or not 0 < viewer['session'] <= len(self.sessions):
+                raise ValueError(request)
+            with self.lock:
+                self.viewers.append(viewer)
+            while True:
+                update = viewer['queue'].get()
+                data = json.dumps(update).encode()
+                conn.sendall(self.websocket_frame(data) if websocket else data + b'\n')
+                if viewer['once']:
+                    break
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self.lock:
+                if viewer in self.viewers:
+                    self.viewers.remove(viewer)
+            conn.close()
+
+    # Read the HTTP upgrade and answer it, returns the path asked for
+    def websocket_accept(self, conn):
+        request = b''
+        while b'\r\n\r\n' not in request:
+            chunk = conn.recv(1024)
+            if not chunk or len(request) > 8192:
+                raise ValueError('not a WebSocket request')
+            request += chunk
+        key = re.search(rb'Sec-WebSocket-Key: *(\S+)', request, re.I)
+        if not key:
+            raise ValueError('not a WebSocket request')
+        accept = base64.b64encode(hashlib.sha1(key.group(1) + WEBSOCKET_GUID).digest())
+        conn.sendall(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n'
+                     b'Connection: Upgrade\r\nSec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+        return request.split()[1].decode('ascii', 'replace')
+
+    @staticmethod
+    def websocket_frame(data):
+        if len(data) < 126:
+            return struct.pack('!BB', 0x81, len(data)) + data
+        if len(data) < 65536:
+            return struct.pack('!BBH', 0x81, 126, len(data)) + data
+        return struct.pack('!BBQ', 0x81, 127, len(data)) + data
+
+    @staticmethod
+    def screen_rows(term):
+        y, x = term.screen.getyx()
+        # instr() counts bytes, a graphics character takes several in the
+        # locale's encoding
+        rows = [term.screen.instr(row, 0, 80 * 4).decode(code, 'replace') for row in range(25)]
+        term.screen.move(y, x)
+        return rows, [y, x]
+
+    # On the main loop, curses is not for threads.  Costs nothing while no
+    # one is watching.
+    def tick(self):
+        if not self.viewers:
+            return
+        now = time.perf_counter()
+        with self.lock:
+            viewers = list(self.viewers)
+        waiting = any(v['snapshot'] for v in viewers)
+        if now - self.lastTick < MIRROR_TICK and not waiting:
+            return
+        self.lastTick = now
+        screens = {}
+        for number in set(v['session'] for v in viewers):
+            rows, cursor = self.screen_rows(self.sessions[number - 1])
+            last = self.last.get(number)
+            changed = {i: row for i, row in enumerate(rows) if not last or last[0][i] != row}
+            screens[number] = rows, cursor, changed, last is None or last[1] != cursor
+            self.last[number] = rows, cursor
+        for viewer in viewers:
+            rows, cursor, changed, moved = screens[viewer['session']]
+            if viewer['snapshot']:
+                update = {'type': 'screen' if viewer['once'] else 'snapshot',
+                          'session': viewer['session'], 'rows': rows, 'cursor': cursor}
+            elif changed or moved:
+                update = {'type': 'rows', 'session': viewer['session'],
+                          'rows': {str(i): row for i, row in changed.items()}, 'cursor': cursor}
+            else:
+                continue
+            try:
+                viewer['queue'].put_nowait(update)
+                viewer['snapshot'] = False
+            except queue.Full:      # too far behind, start it again
+                try:
+                    while True:
+                        viewer['queue'].get_nowait()
+                except queue.Empty:
+                    viewer['snapshot'] = True
+
+
+class FakeHost:
+    """ Stand in for an H8/H89 running CP/M, for testing without hardware.
+
+        The console and a second port for RX are either a pair of ptys or
+        connections to a TCP port, the first connection is the console and
+        the next one RX's port.  Lines typed at the A> prompt are echoed,
+        ^H is answered with ^H SPACE ^H like the H8 and XOFF/XON hold the
+        output.  See the manual for the commands it understands.
+    """
+
+    def __init__(self, directory='.', baud=0, nakRate=0.0, ackLoss=0.0, maxBaud=0):
+        self.directory = directory
+        self.cps = baud / 10.0      # 0 sends as fast as the port takes it
+        self.nakRate = nakRate      # chance a good block is NAKed anyway
+        self.ackLoss = ackLoss      # chance a good block gets no ACK
+        self.maxBaud = maxBaud      # XMODEM boosts above this garble, 0 is no limit
+        self.server = None
+        self.console = None
+        self.xmodem = None
+        self.typeahead = bytearray()
+
+    def open_ptys(self):
+        self.console, slave = os.openpty()
+        self.xmodem, xslave = os.openpty()
+        for fd in (slave, xslave):
+            mode = termios.tcgetattr(fd)
+            mode[0] = mode[1] = mode[3] = 0     # raw, no echo
+            termios.tcsetattr(fd, termios.TCSANOW, mode)
+        self.slaves = (slave, xslave)   # kept open so the masters never see EIO
+        return os.ttyname(slave), os.ttyname(xslave)
+
+    def listen(self, address):
+        host, sep, port = address.split('://')[-1].rpartition(':')
+        self.server = socket.create_server((host or 'localhost', int(port)))
+        return self.server.getsockname()
+
+    def run(self):
+        while True:
+            if self.server:
+                conn, addr = self.server.accept()
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self.console = conn.fileno()
+            try:
+                self.send(b'\r\n\r\n64K CP/M Version 2.2 (h19term fake host)\r\n')
+                while True:
+                    self.command(self.readline(b'\r\nA>'))
+            except EOFError:
+                if not self.server:
+                    return
+                conn.close()
+
+    def read(self, fd, timeout=None):
+        ready, w, x = select.select([fd], [], [], timeout)
+        if not ready:
+            return b''
+        try:
+            data = os.read(fd, 4096)
+        except OSError:
+            data = b''
+        if not data:
+            raise EOFError
+        return data
+
+    def getc(self):
+        while not self.typeahead:
+            self.typeahead += self.read(self.console)
+        c = self.typeahead[0] & 0x7F
+        del self.typeahead[0]
+        return c
+
+    # Write to the console at the configured baud rate, holding on XOFF
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode('latin-1')
+        chunk = max(int(self.cps / 100), 1) if self.cps else 4096
+        held = False
+        pos = 0
+        while pos < len(data) or held:
+            for c in self.read(self.console, None if held else 0):
+                if c & 0x7F == 0x13:
+                    held = True
+                elif c & 0x7F == 0x11:
+                    held = False
+                else:
+                    self.typeahead.append(c)
+            if held:
+                continue
+            pos += os.write(self.console, data[pos:pos + chunk])
+            if self.cps:
+                time.sleep(chunk / self.cps)
+
+    def readline(self, prompt):
+        self.send(prompt)
+        line = ''
+        while True:
+            c = self.getc()
+            if c == 13:
+                self.send('\r\n')
+                return line
+            elif c in (8, 127):
+                if line:
+                    line = line[:-1]
+                    self.send('\x08 \x08')
+            elif c in (3, 21, 24):      # ^C, ^U and ^X start over
+                self.send('#\r\n' if c != 3 else '^C\r\n')
+                if c == 3:
+                    return ''
+                line = ''
+            elif c >= 32 and len(line) < 127:
+                line += chr(c)
+                self.send(chr(c))
+
+    def path(self, name):
+        return os.path.join(self.directory, os.path.basename(name))
+
+    def command(self, line):
+        words = line.split()
+        if not words:
+            return
+        cmd = words[0].upper()
+        args = words[1:]
+        if cmd == 'DIR':
+            names = sorted(n for n in os.listdir(self.directory)
+                           if os.path.isfile(self.path(n)))
+            if not names:
+                self.send('NO FILE')
+            for i, name in enumerate(names):
+                base, ext = os.path.splitext(name.upper())
+                if i % 4:
+                    self.send(' : %-8.8s %-3.3s' % (base, ext[1:]))
+                else:
+                    self.send('%sA: %-8.8s %-3.3s' % ('\r\n' if i else '', base, ext[1:]))
+        elif cmd == 'TYPE' and args:
+            try:
+                with open(self.path(args[0]), 'rb') as fd:
+                    self.send(fd.read().split(b'\x1a')[0])
+            except OSError:
+                self.send('NO FILE')
+        elif cmd == 'REPLAY' and args:
+            self.replay(args[0])
+        elif cmd == 'BENCH':
+            self.bench(int(args[0]) if args and args[0].isdigit() else 1000)
+        elif cmd == 'DATE':
+            self.readline(b"Enter today's date (MM/DD/YY): ")
+            self.readline(b'Enter the time (HH:MM:SS): ')
+        elif cmd == 'RX':
+            names = [a for a in args if not a.startswith('-')]
+            if names:
+                self.rx(names[0], '-n' in args or '-N' in args)
+            else:
+                self.send('Usage: RX [-n] filename')
+        else:
+            self.send('%s?' % words[0].upper())
+
+    # Send what the H8 sent in a recording, on its original timing
+    def replay(self, name):
+        try:
+            fd = open(self.path(name), 'rb')
+        except OSError:
+            self.send('NO FILE')
+            return
+        with fd:
+            try:
+                SessionRecorder.check_magic(fd)
+            except ValueError:
+                self.send('NOT A RECORDING')
+                return
+            for delta, direction, data in SessionRecorder.read_records(fd):
+                if direction == RECEIVED:
+                    time.sleep(delta)
+                    self.send(data)
+
+    # Fill the screen with text and escape sequences to time the terminal
+    def bench(self, lines):
+        start = time.time()
+        count = 0
+        for n in range(lines):
+            text = '%05d %s' % (n, string.ascii_letters[n % 26:] + string.digits)
+            if n % 10 == 0:
+                text = '\x1bp' + text + '\x1bq'     # reverse video
+            elif n % 10 == 5:
+                text = '\x1bY%c%c%s\x1bK' % (32 + n % 24, 32 + n % 40, text[:30])
+            text += '\x1bK\r\n'
+            self.send(text)
+            count += len(text)
+        elapsed = max(time.time() - start, 0.000001)
+        self.send('%d bytes in %.3f seconds, %.0f bytes/second' % (count, elapsed, count / elapsed))
+
+    # XMODEM checksum receive like RX.COM, on the second port
+    def rx(self, name, rename):
+        path = self.path(name.upper())
+        if rename and os.path.exists(path):
+            path = os.path.splitext(path)[0] + '.RX'
+        if self.server:
+            self.server.settimeout(60)
+            try:
+                conn, addr = self.server.accept()
+            except socket.timeout:
+                self.send('RX: no XMODEM connection')
+                return
+            finally:
+                self.server.settimeout(None)
+            fd = conn.fileno()
+        else:
+            fd = self.xmodem
+        blocks = naks = 0
+        expected = 1
+        data = bytearray()
+        start = time.time()
+        reply = NAK
+        tries = 0
+        ok = False
+        rate = None     # set when the sender boosted the speed
+        buf = bytearray()
+
+        # Up to n bytes, waiting no more than a second for each read
+        def take(n):
+            while len(buf) < n:
+                more = self.read(fd, 1)
+                if not more:
+                    break
+                buf.extend(more)
+            got = bytes(buf[:n])
+            del buf[:n]
+            return got
+
+        while tries < 60:
+            if reply:
+                os.write(fd, reply)
+            try:
+                c = take(1)
+            except EOFError:
+                break
+            if c == EOT:
+                os.write(fd, ACK)
+                ok = True
+                break
+            if c == CAN:            # the sender gave up
+                break
+            if c == b'\x1b':        # ESC r, the sender wants another speed
+                cmd = take(2)
+                reply = None
+                if len(cmd) == 2 and cmd[0:1] == b'r' and 0 <= cmd[1] - 65 < len(H19_RATES):
+                    wanted = H19_RATES[cmd[1] - 65]
+                    os.write(fd, ACK)
+                    pattern = take(len(BOOST_PATTERN))
+                    if pattern == BOOST_PATTERN:
+                        if self.maxBaud and wanted > self.maxBaud:
+                            os.write(fd, bytes(b ^ 0x55 for b in pattern))  # too fast for the cable
+                        else:
+                            os.write(fd, pattern)
+                            rate = wanted
+                continue
+            if c != SOH:
+                tries += 1
+                reply = NAK if c == b'' else None
+                continue
+            try:
+                block = take(131)
+            except EOFError:
+                break
+            tries = 0
+            reply = NAK
+            if len(block) < 131 or block[0] != 0xFF - block[1] or \
+                    sum(block[2:130]) & 0xFF != block[130]:
+                naks += 1
+                continue
+            if block[0] == (expected - 1) & 0xFF:
+                reply = ACK     # sender missed our ACK, take it again
+                continue
+            if block[0] != expected & 0xFF:
+                break
+            if random.random() < self.nakRate:
+                naks += 1
+                continue
+            data += block[2:130]
+            blocks += 1
+            expected += 1
+            reply = None if random.random() < self.ackLoss else ACK
+        if self.server:
+            conn.close()
+        if not ok:
+            self.send('RX: transfer failed after %d blocks, %d NAKs' % (blocks, naks))
+            return
+        with open(path, 'wb') as out:
+            out.write(data)
+        elapsed = max(time.time() - start, 0.000001)
+        self.send('RX: %s %d blocks, %d NAKs, %.1f seconds, %.0f bytes/second%s' %
+                  (os.path.basename(path), blocks, naks, elapsed, len(data) / elapsed,
+                   ' at %d baud' % rate if rate else ''))
+
+
+class Z80:
+    """ Z80 processor for the built in CP/M machine, see CpmMachine.
+
+        B C D E H L F A live in a list so the 8 bit instructions index it
+        with the register number in the opcode, and every opcode has its
+        own handler in a table.  An instruction is one lookup and one call.
+        IX and IY borrow the HL handlers, see index_prefix().
+    """
+
+    def __init__(self):
+        self.mem = bytearray(65536)
+        self.reg = [0, 0, 0, 0, 0, 0, 0, 0xFF]  # B C D E H L F A
+        self.alt = [0] * 8                      # the primed set, same order
+        self.pc = 0
+        self.sp = 0xFFFF
+        self.ix = 0xFFFF
+        self.iy = 0xFFFF
+        self.i = 0
+        self.iff = False
+        self.im = 0
+        self.executed = 0       # instructions, counted a run() at a time
+        self.trap = None        # called with the address of an ED FE
+        self.halt = None        # called on HALT, there are no interrupts to end it
+        self.inport = lambda port: 0xFF
+        self.outport = lambda port, value: None
+        self.ops = self.main_ops()
+        self.cb = self.cb_ops()
+        self.ed = self.ed_ops()
+
+    def run(self, count):
+        mem = self.mem
+        ops = self.ops
+        for i in range(count):
+            pc = self.pc
+            self.pc = (pc + 1) & 0xFFFF
+            ops[mem[pc]]()
+        self.executed += count
+
+    def imm8(self):
+        pc = self.pc
+        self.pc = (pc + 1) & 0xFFFF
+        return self.mem[pc]
+
+    def imm16(self):
+        pc = self.pc
+        self.pc = (pc + 2) & 0xFFFF
+        return self.mem[pc] | self.mem[(pc + 1) & 0xFFFF] << 8
+
+    def read16(self, addr):
+        return self.mem[addr] | self.mem[(addr + 1) & 0xFFFF] << 8
+
+    def write16(self, addr, value):
+        self.mem[addr] = value & 0xFF
+        self.mem[(addr + 1) & 0xFFFF] = value >> 8
+
+    def push(self, value):
+        self.sp = (self.sp - 2) & 0xFFFF
+        self.write16(self.sp, value)
+
+    def pop(self):
+        value = self.read16(self.sp)
+        self.sp = (self.sp + 2) & 0xFFFF
+        return value
+
+    # Register pairs by their number in the opcode, 3 is SP
+    def get_rp(self, p):
+        if p == 3:
+            return self.sp
+        return self.reg[2 * p] << 8 | self.reg[2 * p + 1]
+
+    def set_rp(self, p, value):
+        if p == 3:
+            self.sp = value & 0xFFFF
+        else:
+            self.reg[2 * p] = (value >> 8) & 0xFF
+            self.reg[2 * p + 1] = value & 0xFF
+
+    def hl(self):
+        return self.reg[4] << 8 | self.reg[5]
+
+    def condition(self, cc):
+        # NZ Z NC C PO PE P M
+        return bool(self.reg[6] & Z80_CONDITIONS[cc >> 1]) == bool(cc & 1)
+
+    def jr(self, taken):
+        d = self.imm8()
+        if taken:
+            self.pc = (self.pc + d - (d & 0x80) * 2) & 0xFFFF
+
+    def main_ops(self):
+        reg = self.reg
+        mem = self.mem
+        SZ = Z80_SZ
+        SZP = Z80_SZP
+        ops = [None] * 256
+
+        def add(v):
+            a = reg[7]
+            r = a + v
+            reg[6] = SZ[r & 0xFF] | ((a ^ v ^ r) & 0x10) | (((a ^ ~v) & (a ^ r) & 0x80) >> 5) | (r >> 8)
+            reg[7] = r & 0xFF
+
+        def adc(v):
+            a = reg[7]
+            r = a + v + (reg[6] & 1)
+            reg[6] = SZ[r & 0xFF] | ((a ^ v ^ r) & 0x10) | (((a ^ ~v) & (a ^ r) & 0x80) >> 5) | (r >> 8)
+            reg[7] = r & 0xFF
+
+        def sub(v):
+            a = reg[7]
+            r = a - v
+            reg[6] = SZ[r & 0xFF] | ((a ^ v ^ r) & 0x10) | (((a ^ v) & (a ^ r) & 0x80) >> 5) | 2 | ((r >> 8) & 1)
+            reg[7] = r & 0xFF
+
+        def sbc(v):
+            a = reg[7]
+            r = a - v - (reg[6] & 1)
+            reg[6] = SZ[r & 0xFF] | ((a ^ v ^ r) & 0x10) | (((a ^ v) & (a ^ r) & 0x80) >> 5) | 2 | ((r >> 8) & 1)
+            reg[7] = r & 0xFF
+
+        def and_(v):
+            reg[7] &= v
+            reg[6] = SZP[reg[7]] | 0x10
+
+        def xor(v):
+            reg[7] ^= v
+            reg[6] = SZP[reg[7]]
+
+        def or_(v):
+            reg[7] |= v
+            reg[6] = SZP[reg[7]]
+
+        def cp(v):
+            a = reg[7]
+            r = a - v
+            reg[6] = ((SZ[r & 0xFF] & 0xD7) | (v & 0x28) | ((a ^ v ^ r) & 0x10) |
+                      (((a ^ v) & (a ^ r) & 0x80) >> 5) | 2 | ((r >> 8) & 1))
+
+        alu = self.alu = (add, adc, sub, sbc, and_, xor, or_, cp)
+
+        def inc(v):
+            r = (v + 1) & 0xFF
+            reg[6] = (reg[6] & 1) | SZ[r] | (0x10 if v & 0xF == 0xF else 0) | (4 if v == 0x7F else 0)
+            return r
+
+        def dec(v):
+            r = (v - 1) & 0xFF
+            reg[6] = (reg[6] & 1) | 2 | SZ[r] | (0x10 if v & 0xF == 0 else 0) | (4 if v == 0x80 else 0)
+            return r
+
+        self.inc8 = inc
+        self.dec8 = dec
+
+        # The instructions with an (HL) operand take the address, so IX+d
+        # and IY+d can use them too
+        def mem_op(op):
+            if op == 0x34:
+                def h(addr):
+                    mem[addr] = inc(mem[addr])
+            elif op == 0x35:
+                def h(addr):
+                    mem[addr] = dec(mem[addr])
+            elif op == 0x36:
+                def h(addr):
+                    mem[addr] = self.imm8()
+            elif op & 0xC7 == 0x46:
+                def h(addr, r=(op >> 3) & 7):
+                    reg[r] = mem[addr]
+            elif op & 0xF8 == 0x70:
+                def h(addr, r=op & 7):
+                    mem[addr] = reg[r]
+            else:
+                def h(addr, f=alu[(op >> 3) & 7]):
+                    f(mem[addr])
+            return h
+
+        self.mem_ops = {op: mem_op(op) for op in Z80_MEM_OPS}
+        for op, h in self.mem_ops.items():
+            ops[op] = lambda h=h: h(reg[4] << 8 | reg[5])
+
+        def nop():
+            pass
+        ops[0x00] = nop
+
+        for p in range(4):
+            def ld_rp_nn(p=p):
+                self.set_rp(p, self.imm16())
+            def inc_rp(p=p):
+                self.set_rp(p, self.get_rp(p) + 1 & 0xFFFF)
+            def dec_rp(p=p):
+                self.set_rp(p, self.get_rp(p) - 1 & 0xFFFF)
+            def add_hl(p=p):
+                hl = reg[4] << 8 | reg[5]
+                v = self.get_rp(p)
+                r = hl + v
+                reg[6] = (reg[6] & 0xC4) | (((hl ^ v ^ r) >> 8) & 0x10) | ((r >> 8) & 0x28) | (r >> 16)
+                reg[4] = (r >> 8) & 0xFF
+                reg[5] = r & 0xFF
+            ops[0x01 + 16 * p] = ld_rp_nn
+            ops[0x03 + 16 * p] = inc_rp
+            ops[0x0B + 16 * p] = dec_rp
+            ops[0x09 + 16 * p] = add_hl
+
+        def ld_bc_a():
+            mem[reg[0] << 8 | reg[1]] = reg[7]
+        def ld_de_a():
+            mem[reg[2] << 8 | reg[3]] = reg[7]
+        def ld_a_bc():
+            reg[7] = mem[reg[0] << 8 | reg[1]]
+        def ld_a_de():
+            reg[7] = mem[reg[2] << 8 | reg[3]]
+        def ld_nn_hl():
+            self.write16(self.imm16(), reg[4] << 8 | reg[5])
+        def ld_hl_nn():
+            v = self.read16(self.imm16())
+            reg[4] = v >> 8
+            reg[5] = v & 0xFF
+        def ld_nn_a():
+            mem[self.imm16()] = reg[7]
+        def ld_a_nn():
+            reg[7] = mem[self.imm16()]
+        ops[0x02] = ld_bc_a
+        ops[0x12] = ld_de_a
+        ops[0x0A] = ld_a_bc
+        ops[0x1A] = ld_a_de
+        ops[0x22] = ld_nn_hl
+        ops[0x2A] = ld_hl_nn
+        ops[0x32] = ld_nn_a
+        ops[0x3A] = ld_a_nn
+
+        for r in (0, 1, 2, 3, 4, 5, 7):
+            def inc_r(r=r):
+                reg[r] = inc(reg[r])
+            def dec_r(r=r):
+                reg[r] = dec(reg[r])
+            def ld_r_n(r=r):
+                pc = self.pc
+                self.pc = (pc + 1) & 0xFFFF
+                reg[r] = mem[pc]
+            ops[0x04 + 8 * r] = inc_r
+            ops[0x05 + 8 * r] = dec_r
+            ops[0x06 + 8 * r] = ld_r_n
+
+        def rlca():
+            a = reg[7]
+            c = a >> 7
+            a = ((a << 1) | c) & 0xFF
+            reg[7] = a
+            reg[6] = (reg[6] & 0xC4) | (a & 0x28) | c
+        def rrca():
+            a = reg[7]
+            c = a & 1
+            a = (a >> 1) | (c << 7)
+            reg[7] = a
+            reg[6] = (reg[6] & 0xC4) | (a & 0x28) | c
+        def rla():
+            a = reg[7]
+            c = a >> 7
+            a = ((a << 1) | (reg[6] & 1)) & 0xFF
+            reg[7] = a
+            reg[6] = (reg[6] & 0xC4) | (a & 0x28) | c
+        def rra():
+            a = reg[7]
+            c = a & 1
+            a = (a >> 1) | ((reg[6] & 1) << 7)
+            reg[7] = a
+            reg[6] = (reg[6] & 0xC4) | (a & 0x28) | c
+        def daa():
+            a = reg[7]
+            f = reg[6]
+            c = f & 1
+            diff = 0
+            if f & 0x10 or a & 0xF > 9:
+                diff = 6
+            if c or a > 0x99:
+                diff |= 0x60
+                c = 1
+            if f & 2:
+                h = f & 0x10 and a & 0xF < 6
+                a = (a - diff) & 0xFF
+            else:
+                h = a & 0xF > 9
+                a = (a + diff) & 0xFF
+            reg[7] = a
+            reg[6] = SZP[a] | (0x10 if h else 0) | (f & 2) | c
+        def cpl():
+            reg[7] ^= 0xFF
+            reg[6] = (reg[6] & 0xC5) | (reg[7] & 0x28) | 0x12
+        def scf():
+            reg[6] = (reg[6] & 0xC4) | (reg[7] & 0x28) | 1
+        def ccf():
+            f = reg[6]
+            reg[6] = ((f & 0xC5) | (reg[7] & 0x28) | ((f & 1) << 4)) ^ 1
+        ops[0x07] = rlca
+        ops[0x0F] = rrca
+        ops[0x17] = rla
+        ops[0x1F] = rra
+        ops[0x27] = daa
+        ops[0x2F] = cpl
+        ops[0x37] = scf
+        ops[0x3F] = ccf
+
+        def ex_af():
+            alt = self.alt
+            reg[6], alt[6] = alt[6], reg[6]
+            reg[7], alt[7] = alt[7], reg[7]
+        def exx():
+            alt = self.alt
+            reg[0:6], alt[0:6] = alt[0:6], reg[0:6]
+        def djnz():
+            b = (reg[0] - 1) & 0xFF
+            reg[0] = b
+            self.jr(b)
+        def jr():
+            self.jr(True)
+        ops[0x08] = ex_af
+        ops[0xD9] = exx
+        ops[0x10] = djnz
+        ops[0x18] = jr
+        for cc in range(4):
+            ops[0x20 + 8 * cc] = lambda cc=cc: self.jr(self.condition(cc))
+
+        for d in (0, 1, 2, 3, 4, 5, 7):
+            for s in (0, 1, 2, 3, 4, 5, 7):
+                def ld_r_r(d=d, s=s):
+                    reg[d] = reg[s]
+                ops[0x40 + 8 * d + s] = ld_r_r
+
+        def halt():
+            self.pc = (self.pc - 1) & 0xFFFF
+            if self.halt:
+                self.halt()
+        ops[0x76] = halt
+
+        for k in range(8):
+            f = alu[k]
+            for r in (0, 1, 2, 3, 4, 5, 7):
+                ops[0x80 + 8 * k + r] = lambda f=f, r=r: f(reg[r])
+            ops[0xC6 + 8 * k] = lambda f=f: f(self.imm8())
+
+        def ret():
+            self.pc = self.pop()
+        def jp():
+            self.pc = self.imm16()
+        def call():
+            addr = self.imm16()
+            self.push(self.pc)
+            self.pc = addr
+        ops[0xC9] = ret
+        ops[0xC3] = jp
+        ops[0xCD] = call
+        for cc in range(8):
+            def ret_cc(cc=cc):
+                if self.condition(cc):
+                    self.pc = self.pop()
+            def jp_cc(cc=cc):
+                addr = self.imm16()
+                if self.condition(cc):
+                    self.pc = addr
+            def call_cc(cc=cc):
+                addr = self.imm16()
+                if self.condition(cc):
+                    self.push(self.pc)
+                    self.pc = addr
+            def rst(cc=cc):
+                self.push(self.pc)
+                self.pc = cc * 8
+            ops[0xC0 + 8 * cc] = ret_cc
+            ops[0xC2 + 8 * cc] = jp_cc
+            ops[0xC4 + 8 * cc] = call_cc
+            ops[0xC7 + 8 * cc] = rst
+
+        for p in range(3):
+            def pop(p=p):
+                v = self.pop()
+                reg[2 * p] = v >> 8
+                reg[2 * p + 1] = v & 0xFF
+            def push(p=p):
+                self.push(reg[2 * p] << 8 | reg[2 * p + 1])
+            ops[0xC1 + 16 * p] = pop
+            ops[0xC5 + 16 * p] = push
+        def pop_af():
+            v = self.pop()
+            reg[7] = v >> 8
+            reg[6] = v & 0xFF
+        def push_af():
+            self.push(reg[7] << 8 | reg[6])
+        ops[0xF1] = pop_af
+        ops[0xF5] = push_af
+
+        def out_n():
+            self.outport(reg[7] << 8 | self.imm8(), reg[7])
+        def in_n():
+            reg[7] = self.inport(reg[7] << 8 | self.imm8())
+        def ex_sp_hl():
+            v = self.read16(self.sp)
+            self.write16(self.sp, reg[4] << 8 | reg[5])
+            reg[4] = v >> 8
+            reg[5] = v & 0xFF
+        def jp_hl():
+            self.pc = reg[4] << 8 | reg[5]
+        def ex_de_hl():
+            reg[2], reg[3], reg[4], reg[5] = reg[4], reg[5], reg[2], reg[3]
+        def di():
+            self.iff = False
+        def ei():
+            self.iff = True
+        def ld_sp_hl():
+            self.sp = reg[4] << 8 | reg[5]
+        ops[0xD3] = out_n
+        ops[0xDB] = in_n
+        ops[0xE3] = ex_sp_hl
+        ops[0xE9] = jp_hl
+        ops[0xEB] = ex_de_hl
+        ops[0xF3] = di
+        ops[0xFB] = ei
+        ops[0xF9] = ld_sp_hl
+
+        ops[0xCB] = lambda: self.cb[self.imm8()]()
+        ops[0xED] = lambda: self.ed[self.imm8()]()
+        ops[0xDD] = lambda: self.index_prefix('ix')
+        ops[0xFD] = lambda: self.index_prefix('iy')
+        return ops
+
+    # What CB op does to value v, None for BIT which only sets flags
+    def cb_op(self, op, v):
+        reg = self.reg
+        y = (op >> 3) & 7
+        x = op >> 6
+        if x == 0:
+            if y == 0:      # RLC
+                c = v >> 7
+                r = ((v << 1) | c) & 0xFF
+            elif y == 1:    # RRC
+                c = v & 1
+                r = (v >> 1) | (c << 7)
+            elif y == 2:    # RL
+                c = v >> 7
+                r = ((v << 1) | (reg[6] & 1)) & 0xFF
+            elif y == 3:    # RR
+                c = v & 1
+                r = (v >> 1) | ((reg[6] & 1) << 7)
+            elif y == 4:    # SLA
+                c = v >> 7
+                r = (v << 1) & 0xFF
+            elif y == 5:    # SRA
+                c = v & 1
+                r = (v >> 1) | (v & 0x80)
+            elif y == 6:    # SLL, undocumented
+                c = v >> 7
+                r = ((v << 1) | 1) & 0xFF
+            else:           # SRL
+                c = v & 1
+                r = v >> 1
+            reg[6] = Z80_SZP[r] | c
+            return r
+        if x == 1:          # BIT
+            bit = v & (1 << y)
+            reg[6] = (reg[6] & 1) | 0x10 | (v & 0x28) | (0x44 if not bit else 0) | (bit & 0x80)
+            return None
+        if x == 2:          # RES
+            return v & ~(1 << y)
+        return v | (1 << y)  # SET
+
+    def cb_ops(self):
+        reg = self.reg
+        mem = self.mem
+        ops = []
+        for op in range(256):
+            r = op & 7
+            if r == 6:
+                def h(op=op):
+                    addr = reg[4] << 8 | reg[5]
+                    v = self.cb_op(op, mem[addr])
+                    if v is not None:
+                        mem[addr] = v
+            else:
+                def h(op=op, r=r):
+                    v = self.cb_op(op, reg[r])
+                    if v is not None:
+                        reg[r] = v
+            ops.append(h)
+        return ops
+
+    def ed_ops(self):
+        reg = self.reg
+        mem = self.mem
+        SZ = Z80_SZ
+        SZP = Z80_SZP
+        ops = [lambda: None] * 256      # the rest are two byte NOPs
+
+        for r in range(8):
+            def in_r_c(r=r):
+                v = self.inport(reg[0] << 8 | reg[1])
+                reg[6] = (reg[6] & 1) | SZP[v]
+                if r != 6:
+                    reg[r] = v
+            def out_c_r(r=r):
+                self.outport(reg[0] << 8 | reg[1], reg[r] if r != 6 else 0)
+            ops[0x40 + 8 * r] = in_r_c
+            ops[0x41 + 8 * r] = out_c_r
+
+        for p in range(4):
+            def sbc_hl(p=p):
+                hl = reg[4] << 8 | reg[5]
+                v = self.get_rp(p)
+                r = hl - v - (reg[6] & 1)
+                w = r & 0xFFFF
+                reg[6] = (((w >> 8) & 0xA8) | (0x40 if w == 0 else 0) | (((hl ^ v ^ r) >> 8) & 0x10) |
+                          (((hl ^ v) & (hl ^ r) & 0x8000) >> 13) | 2 | ((r >> 16) & 1))
+                reg[4] = w >> 8
+                reg[5] = w & 0xFF
+            def adc_hl(p=p):
+                hl = reg[4] << 8 | reg[5]
+                v = self.get_rp(p)
+                r = hl + v + (reg[6] & 1)
+                w = r & 0xFFFF
+                reg[6] = (((w >> 8) & 0xA8) | (0x40 if w == 0 else 0) | (((hl ^ v ^ r) >> 8) & 0x10) |
+                          (((hl ^ ~v) & (hl ^ r) & 0x8000) >> 13) | (r >> 16))
+                reg[4] = w >> 8
+                reg[5] = w & 0xFF
+            def ld_nn_rp(p=p):
+                self.write16(self.imm16(), self.get_rp(p))
+            def ld_rp_nn(p=p):
+                self.set_rp(p, self.read16(self.imm16()))
+            ops[0x42 + 16 * p] = sbc_hl
+            ops[0x4A + 16 * p] = adc_hl
+            ops[0x43 + 16 * p] = ld_nn_rp
+            ops[0x4B + 16 * p] = ld_rp_nn
+
+        def neg():
+            a = reg[7]
+            reg[7] = 0
+            self.alu[2](a)
+        def retn():
+            self.pc = self.pop()
+        def ld_i_a():
+            self.i = reg[7]
+        def ld_a_i():
+            reg[7] = self.i
+            reg[6] = (reg[6] & 1) | SZ[self.i] | (4 if self.iff else 0)
+        def ld_a_r():
+            r = (self.executed + self.pc) & 0x7F     # good enough for seeding random numbers
+            reg[7] = r
+            reg[6] = (reg[6] & 1) | SZ[r] | (4 if self.iff else 0)
+        def rrd():
+            addr = reg[4] << 8 | reg[5]
+            v = mem[addr]
+            a = reg[7]
+            mem[addr] = ((a << 4) | (v >> 4)) & 0xFF
+            reg[7] = (a & 0xF0) | (v & 0x0F)
+            reg[6] = (reg[6] & 1) | SZP[reg[7]]
+        def rld():
+            addr = reg[4] << 8 | reg[5]
+            v = mem[addr]
+            a = reg[7]
+            mem[addr] = ((v << 4) | (a & 0x0F)) & 0xFF
+            reg[7] = (a & 0xF0) | (v >> 4)
+            reg[6] = (reg[6] & 1) | SZP[reg[7]]
+        for op in (0x44, 0x4C, 0x54, 0x5C, 0x64, 0x6C, 0x74, 0x7C):
+            ops[op] = neg
+        for op in (0x45, 0x4D, 0x55, 0x5D, 0x65, 0x6D, 0x75, 0x7D):
+            ops[op] = retn
+        for op, mode in ((0x46, 0), (0x4E, 0), (0x56, 1), (0x5E, 2),
+                         (0x66, 0), (0x6E, 0), (0x76, 1), (0x7E, 2)):
+            ops[op] = lambda mode=mode: setattr(self, 'im', mode)
+        ops[0x47] = ld_i_a
+        ops[0x4F] = lambda: None        # LD R,A
+        ops[0x57] = ld_a_i
+        ops[0x5F] = ld_a_r
+        ops[0x67] = rrd
+        ops[0x6F] = rld
+
+        ops[0xA0] = lambda: self.block_load(1, False)
+        ops[0xA8] = lambda: self.block_load(-1, False)
+        ops[0xB0] = lambda: self.block_load(1, True)
+        ops[0xB8] = lambda: self.block_load(-1, True)
+        ops[0xA1] = lambda: self.block_compare(1, False)
+        ops[0xA9] = lambda: self.block_compare(-1, False)
+        ops[0xB1] = lambda: self.block_compare(1, True)
+        ops[0xB9] = lambda: self.block_compare(-1, True)
+        ops[0xA2] = lambda: self.block_io(1, False, True)
+        ops[0xAA] = lambda: self.block_io(-1, False, True)
+        ops[0xB2] = lambda: self.block_io(1, True, True)
+        ops[0xBA] = lambda: self.block_io(-1, True, True)
+        ops[0xA3] = lambda: self.block_io(1, False, False)
+        ops[0xAB] = lambda: self.block_io(-1, False, False)
+        ops[0xB3] = lambda: self.block_io(1, True, False)
+        ops[0xBB] = lambda: self.block_io(-1, True, False)
+
+        def trap():
+            if self.trap:
+                self.trap((self.pc - 2) & 0xFFFF)
+        ops[0xFE] = trap
+        return ops
+
+    # LDI LDD LDIR LDDR.  A repeated forward copy that doesn't run into
+    # itself is done as one slice.
+    def block_load(self, step, repeat):
+        reg = self.reg
+        mem = self.mem
+        hl = reg[4] << 8 | reg[5]
+        de = reg[2] << 8 | reg[3]
+        bc = reg[0] << 8 | reg[1]
+        n = (bc or 0x10000) if repeat else 1
+        if (step == 1 and n > 1 and hl + n <= 0x10000 and de + n <= 0x10000 and
+                (de <= hl or de >= hl + n)):
+            mem[de:de + n] = mem[hl:hl + n]
+            v = mem[hl + n - 1]
+            hl += n
+            de += n
+        else:
+            for i in range(n):
+                v = mem[hl]
+                mem[de] = v
+                hl = (hl + step) & 0xFFFF
+                de = (de + step) & 0xFFFF
+        bc = (bc - n) & 0xFFFF
+        v += reg[7]
+        reg[6] = (reg[6] & 0xC1) | (v & 8) | ((v << 4) & 0x20) | (4 if bc else 0)
+        reg[4], reg[5] = (hl >> 8) & 0xFF, hl & 0xFF
+        reg[2], reg[3] = (de >> 8) & 0xFF, de & 0xFF
+        reg[0], reg[1] = bc >> 8, bc & 0xFF
+
+    # CPI CPD CPIR CPDR, repeats stop at a match
+    def block_compare(self, step, repeat):
+        reg = self.reg
+        mem = self.mem
+        hl = reg[4] << 8 | reg[5]
+        bc = reg[0] << 8 | reg[1]
+        a = reg[7]
+        while True:
+            v = mem[hl]
+            hl = (hl + step) & 0xFFFF
+            bc = (bc - 1) & 0xFFFF
+            r = (a - v) & 0xFF
+            if not repeat or r == 0 or bc == 0:
+                break
+        h = (a ^ v ^ r) & 0x10
+        n = (r - 1) & 0xFF if h else r
+        reg[6] = ((reg[6] & 1) | (Z80_SZ[r] & 0xC0) | h | (n & 8) | ((n << 4) & 0x20) |
+                  (4 if bc else 0) | 2)
+        reg[4], reg[5] = hl >> 8, hl & 0xFF
+        reg[0], reg[1] = bc >> 8, bc & 0xFF
+
+    # INI IND INIR INDR and OUTI OUTD OTIR OTDR
+    def block_io(self, step, repeat, into):
+        reg = self.reg
+        mem = self.mem
+        while True:
+            hl = reg[4] << 8 | reg[5]
+            if into:
+                mem[hl] = self.inport(reg[0] << 8 | reg[1])
+                reg[0] = (reg[0] - 1) & 0xFF
+            else:
+                reg[0] = (reg[0] - 1) & 0xFF
+                self.outport(reg[0] << 8 | reg[1], mem[hl])
+            hl = (hl + step) & 0xFFFF
+            reg[4], reg[5] = hl >> 8, hl & 0xFF
+            if not repeat or reg[0] == 0:
+                break
+        reg[6] = (reg[6] & 1) | Z80_SZ[reg[0]] | 2
+
+    # DD and FD.  Instructions with an (HL) operand use IX+d or IY+d, the
+    # rest run the HL instruction with the index register standing in for
+    # HL, which also gives the undocumented IXH, IXL, IYH and IYL.
+    def index_prefix(self, name):
+        reg = self.reg
+        op = self.imm8()
+        if op == 0xCB:
+            addr = self.index_address(name)
+            op = self.imm8()
+            v = self.cb_op(op, self.mem[addr])
+            if v is not None:
+                self.mem[addr] = v
+                if op & 7 != 6:
+                    reg[op & 7] = v
+        elif op in self.mem_ops:
+            self.mem_ops[op](self.index_address(name))
+        elif op in (0xDD, 0xFD, 0xED, 0xEB, 0xD9):
+            self.ops[op]()      # not affected by the prefix
+        else:
+            h, l = reg[4], reg[5]
+            index = getattr(self, name)
+            reg[4] = index >> 8
+            reg[5] = index & 0xFF
+            self.ops[op]()
+            setattr(self, name, reg[4] << 8 | reg[5])
+            reg[4], reg[5] = h, l
+
+    def index_address(self, name):
+        d = self.imm8()
+        return (getattr(self, name) + d - (d & 0x80) * 2) & 0xFFFF
+
+
+class CpmDirectory:
+    """ A host directory as a CP/M drive.
+
+        Files are found by their 8.3 name whatever its case and names CP/M
+        can't have are left out.  New files get lower case names.  There
+        are no user areas, every file is in all of them.
+    """
+
+    dpb = CPM_DPB
+    dph = CPM_DPH
+
+    def __init__(self, path):
+        if not os.path.isdir(path):
+            raise ValueError("%s is not a directory" % path)
+        self.path = path
+        self.readonly = not os.access(path, os.W_OK)
+        self.mtime = None
+        self.names = {}
+        self.cache = None       # (host file, mtime, size), first record, the records read ahead
+
+    @staticmethod
+    def cpm_name(name):
+        base, dot, ext = name.upper().rpartition('.')
+        if not dot:
+            base, ext = ext, ''
+        if not 0 < len(base) <= 8 or len(ext) > 3:
+            return None
+        if any(c not in CPM_NAME_CHARS for c in base + ext):
+            return None
+        return '%-8s%-3s' % (base, ext)
+
+    # CP/M names to host names, read again whenever the directory changes
+    def files(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime != self.mtime:
+            self.mtime = mtime
+            self.names = {}
+            for entry in sorted(os.scandir(self.path), key=lambda e: e.name):
+                name = self.cpm_name(entry.name)
+                if name and name not in self.names and entry.is_file():
+                    self.names[name] = entry.name
+        return self.names
+
+    def host(self, name):
+        return os.path.join(self.path, self.files()[name])
+
+    def records(self, name):
+        return (os.path.getsize(self.host(name)) + CPM_RECORD - 1) // CPM_RECORD
+
+    # Records come from a cache read CPM_READ_AHEAD at a time, it is good
+    # until the file changes
+    def read(self, name, record):
+        host = self.host(name)
+        st = os.stat(host)
+        key = (host, st.st_mtime_ns, st.st_size)
+        offset = 0
+        if self.cache and self.cache[0] == key:
+            offset = (record - self.cache[1]) * CPM_RECORD
+        if not self.cache or self.cache[0] != key or not 0 <= offset < len(self.cache[2]):
+            with open(host, 'rb') as f:
+                f.seek(record * CPM_RECORD)
+                self.cache = (key, record, f.read(CPM_READ_AHEAD * CPM_RECORD))
+            offset = 0
+        data = self.cache[2][offset:offset + CPM_RECORD]
+        return data.ljust(CPM_RECORD, b'\x1a') if data else None
+
+    def write(self, name, record, data):
+        self.cache = None
+        with open(self.host(name), 'r+b') as f:
+            f.seek(record * CPM_RECORD)
+            f.write(data)
+
+    def create(self, name):
+        host = self.files().get(name)
+        if host is None:
+            base, ext = name[:8].rstrip(), name[8:].rstrip()
+            host = (base + '.' + ext if ext else base).lower()
+        open(os.path.join(self.path, host), 'wb').close()
+        self.mtime = None
+        self.cache = None
+
+    def delete(self, name):
+        os.remove(self.host(name))
+        self.mtime = None
+        self.cache = None
+
+    def rename(self, name, new):
+        base, ext = new[:8].rstrip(), new[8:].rstrip()
+        os.rename(self.host(name), os.path.join(self.path, (base + '.' + ext if ext else base).lower()))
+        self.mtime = None
+        self.cache = None
+
+    def sector(self, track, sector):
+        return None
+
+    # Directory entries made up from the file sizes, 16K and eight 2K
+    # blocks each, numbered after the 16 blocks of the directory
+    def entries(self):
+        block = 16
+        found = []
+        for name in sorted(self.files()):
+            records = self.records(name)
+            for extent in range(max(1, (records + 127) // 128)):
+                rc = min(records - extent * 128, 128)
+                count = (rc + 15) // 16
+                blocks = [min(b, 2047) for b in range(block, block + count)] + [0] * (8 - count)
+                block += count
+                found.append(b'\0' + name.encode('ascii') +
+                             bytes((extent & 31, 0, extent >> 5, rc)) + struct.pack('<8H', *blocks))
+        return found
+
+    def blocks(self):
+        used = list(range(16))
+        for entry in self.entries():
+            used += [b for b in struct.unpack('<8H', entry[16:]) if b]
+        return used
+
+
+class CpmImage:
+    """ An 8 inch single density disk image as a read only drive.
+
+        77 tracks of 26 128 byte sectors in the order they are on the
+        disk, the IBM 3740 layout CP/M 2.2 was shipped on.  Files are read
+        through the skew table the way the BIOS would.
+    """
+
+    dpb = CPM_IMAGE_DPB
+    dph = CPM_DPH + 16
+    readonly = True
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        if len(self.data) != CPM_IMAGE_SIZE:
+            raise ValueError("%s is not an 8 inch disk image" % path)
+        self.path = path
+
+    # Physical sector, counted from 1
+    def sector(self, track, sector):
+        if track >= 77 or not 1 <= sector <= 26:
+            return None
+        offset = (track * 26 + sector - 1) * CPM_RECORD
+        return self.data[offset:offset + CPM_RECORD]
+
+    # A record of a 1K block, blocks start on the third track
+    def block(self, block, record):
+        track, sector = divmod(52 + block * 8 + record, 26)
+        return self.sector(track, CPM_IMAGE_SKEW[sector])
+
+    def entries(self):
+        directory = b''.join(self.block(b, r) for b in (0, 1) for r in range(8))
+        return [directory[i:i + 32] for i in range(0, len(directory), 32) if directory[i] < 16]
+
+    def files(self):
+        return {bytes(c & 0x7F for c in e[1:12]).decode('latin-1'): e for e in self.entries()}
+
+    def extents(self, name):
+        return {e[12] & 31 | e[14] << 5: e for e in self.entries()
+                if bytes(c & 0x7F for c in e[1:12]).decode('latin-1') == name}
+
+    def records(self, name):
+        extents = self.extents(name)
+        if not extents:
+            return 0
+        last = max(extents)
+        return last * 128 + extents[last][15]
+
+    def read(self, name, record):
+        entry = self.extents(name).get(record >> 7)
+        if entry is None or record & 127 >= entry[15]:
+            return None
+        return self.block(entry[16 + (record & 127) // 8], record & 7)
+
+    def blocks(self):
+        return [0, 1] + [b for e in self.entries() for b in e[16:] if b]
+
+
+class CpmReset(Exception):
+    """ Warm boots the CP/M machine from wherever it is raised. """
+
+
+class CpmMachine:
+    """ CP/M 2.2 on the built in Z80, behind cpm: ports.
+
+        The BDOS and the CCP are Python and work a file at a time, so a
+        host directory is a drive as it is.  The BDOS entry and the BIOS
+        jump table lead to ED FE traps that end up here, programs that
+        drive the H8's console port at E8 work too.  Typed keys arrive on
+        a queue and the console output goes down a pipe to the terminal.
+    """
+
+    def __init__(self, drives, output):
+        self.drives = drives    # CpmDirectory or CpmImage for A:, B: ...
+        self.output = output    # pipe the console output is written to
+        self.keys = queue.Queue()
+        self.typed = bytearray()
+        self.out = bytearray()
+        self.running = True
+        self.resetPending = False
+        self.held = False       # XOFF from the terminal
+        self.idle = 0           # console polls in a row with nothing typed
+        self.dma = 0x80
+        self.search = []        # directory entries left for search next
+        self.readonly = 0       # drives write protected by BDOS 28
+        self.disk = 0           # BIOS disk, track, sector and DMA
+        self.track = 0
+        self.sector = 1
+        self.biosDma = 0x80
+        self.cpu = Z80()
+        self.cpu.trap = self.trap
+        self.cpu.halt = self.halted
+        self.cpu.inport = self.inport
+        self.cpu.outport = self.outport
+        self.bdosCalls = {
+            0: self.halted, 1: self.console_input, 2: self.console_output,
+            3: lambda: CPM_EOF, 4: lambda: 0, 5: lambda: 0, 6: self.direct_io,
+            7: lambda: self.cpu.mem[3], 8: self.set_iobyte, 9: self.print_string,
+            10: self.read_buffer, 11: lambda: 0xFF if self.status() else 0,
+            12: lambda: 0x22, 13: self.reset_disks, 14: self.select_disk,
+            15: self.open_file, 16: self.close_file, 17: self.search_first,
+            18: self.search_next, 19: self.delete_file, 20: self.read_sequential,
+            21: self.write_sequential, 22: self.make_file, 23: self.rename_file,
+            24: lambda: (1 << len(self.drives)) - 1, 25: lambda: self.cpu.mem[4] & 15,
+            26: self.set_dma, 27: self.allocation, 28: self.write_protect,
+            29: self.readonly_vector, 30: self.close_file,
+            31: lambda: self.current()[1].dpb, 32: self.user_code,
+            33: self.read_random, 34: self.write_random, 35: self.file_size,
+            36: self.set_random, 37: lambda: 0, 40: self.write_random,
+        }
+        self.setup_memory()
+
+    # Drives from DIR[,DIR...], directories or 8 inch disk images
+    @staticmethod
+    def open_drives(spec):
+        paths = [os.path.expanduser(p.strip()) for p in spec.split(',') if p.strip()] or ['.']
+        if len(paths) > 16:
+            raise ValueError("CP/M has at most 16 drives")
+        return [CpmImage(p) if os.path.isfile(p) else CpmDirectory(p) for p in paths]
+
+    def setup_memory(self):
+        mem = self.cpu.mem
+        mem[CPM_BDOS:CPM_BDOS + 3] = CPM_TRAP
+        for i in range(17):
+            stub = CPM_BIOS + 0x40 + 3 * i
+            mem[CPM_BIOS + 3 * i:CPM_BIOS + 3 * i + 3] = b'\xc3' + struct.pack('<H', stub)
+            mem[stub:stub + 3] = CPM_TRAP
+        mem[CPM_DPB:CPM_DPB + 15] = struct.pack('<HBBBHHBBHH', 64, 4, 15, 0, 2047, 1023,
+                                                0xFF, 0xFF, 0, 0)
+        mem[CPM_IMAGE_DPB:CPM_IMAGE_DPB + 15] = struct.pack('<HBBBHHBBHH', 26, 3, 7, 0, 242, 63,
+                                                            0xC0, 0, 0, 2)
+        mem[CPM_XLT:CPM_XLT + 26] = bytes(CPM_IMAGE_SKEW)
+        for dph, xlt, dpb in ((CPM_DPH, 0, CPM_DPB), (CPM_DPH + 16, CPM_XLT, CPM_IMAGE_DPB)):
+            mem[dph:dph + 16] = struct.pack('<4H4H', xlt, 0, 0, 0, CPM_DIRBUF, dpb, 0, CPM_ALV)
+
+    def run(self):
+        try:
+            self.print('\r\n64K CP/M Version 2.2 (h19term)\r\n')
+            booting = True
+            while self.running:
+                try:
+                    if booting:
+                        booting = False
+                        self.boot()
+                    self.cpu.run(CPM_SLICE)
+                    self.flush()
+                    self.poll()
+                except CpmReset:
+                    booting = True
+        except EOFError:
+            pass
+        except Exception as e:      # keep the terminal going whatever the machine did
+            self.print('\r\nCP/M stopped: %s\r\n' % e)
+            try:
+                self.flush()
+            except EOFError:
+                pass
+        finally:
+            os.close(self.output)
+
+    def stop(self):
+        self.running = False
+        self.keys.put(None)
+
+    def reset(self):
+        self.resetPending = True
+
+    def type(self, data):
+        self.keys.put(bytes(data))
+
+    # Warm boot, page zero and the CCP, which returns once a program is loaded
+    def boot(self):
+        mem = self.cpu.mem
+        mem[0:3] = b'\xc3' + struct.pack('<H', CPM_BIOS + 3)
+        mem[5:8] = b'\xc3' + struct.pack('<H', CPM_BDOS)
+        if mem[4] & 15 >= len(self.drives):
+            mem[4] &= 0xF0
+        self.dma = 0x80
+        self.search = []
+        self.ccp()
+
+    # Console
+
+    def print(self, text):
+        self.out += text.encode('latin-1')
+
+    def conout(self, c):
+        self.out.append(c)
+        if len(self.out) >= TRANSPORT_READ:
+            self.flush()
+
+    def flush(self):
+        while self.held:
+            self.take(CPM_IDLE)
+        try:
+            while self.out:
+                del self.out[:os.write(self.output, self.out)]
+        except OSError:         # the terminal has gone
+            raise EOFError
+
+    # Moves keys from the queue, False when nothing came in wait seconds
+    def take(self, wait):
+        try:
+            data = self.keys.get(timeout=wait) if wait else self.keys.get_nowait()
+        except queue.Empty:
+            return False
+        if data is None:
+            raise EOFError
+        for c in data:
+            if c == XOFF[0]:
+                self.held = True
+            elif c == XON[0]:
+                self.held = False
+            else:
+                self.typed.append(c)
+        return True
+
+    # True when a key is waiting, waits up to wait seconds for one
+    def poll(self, wait=0):
+        if self.resetPending:
+            self.resetPending = False
+            self.typed.clear()
+            raise CpmReset
+        while not self.typed and self.take(wait):
+            pass
+        return bool(self.typed)
+
+    def getkey(self):
+        self.flush()
+        while not self.poll(TRANSPORT_IDLE):
+            pass
+        self.idle = 0
+        c = self.typed[0]
+        del self.typed[0]
+        return c
+
+    # Console status, a program that keeps asking with nothing typed gets
+    # slowed down so it doesn't spin a core
+    def status(self):
+        if self.poll():
+            self.idle = 0
+            return True
+        self.idle += 1
+        if self.idle < CPM_IDLE_POLLS:
+            return False
+        self.flush()
+        return self.poll(CPM_IDLE)
+
+    def readline(self, maximum):
+        line = bytearray()
+        while True:
+            c = self.getkey() & 0x7F
+            if c in (10, 13):
+                self.conout(13)
+                return line
+            elif c in (8, 127):
+                if line:
+                    del line[-1]
+                    self.print('\x08 \x08')
+            elif c == 3 and not line:
+                self.print('^C')
+                raise CpmReset
+            elif c in (21, 24):         # ^U and ^X start over
+                self.print('#\r\n')
+                line.clear()
+            elif c == 5:                # ^E, a new line on the screen only
+                self.print('\r\n')
+            elif c >= 32 and len(line) < maximum:
+                line.append(c)
+                self.conout(c)
+
+    # Traps and ports
+
+    def trap(self, addr):
+        reg = self.cpu.reg
+        if addr != CPM_BDOS:
+            self.bios((addr - CPM_BIOS - 0x40) // 3)
+            return
+        call = self.bdosCalls.get(reg[1])
+        try:
+            value = call() if call else 0
+        except OSError:
+            self.bdos_error(self.cpu.mem[4] & 15, 'Bad Sector')
+        value = value or 0
+        reg[7] = reg[5] = value & 0xFF
+        reg[0] = reg[4] = value >> 8 & 0xFF
+
+    def bios(self, n):
+        reg = self.cpu.reg
+        mem = self.cpu.mem
+        bc = reg[0] << 8 | reg[1]
+        if n <= 1:
+            raise CpmReset
+        elif n == 2:
+            reg[7] = 0xFF if self.status() else 0
+        elif n == 3:
+            reg[7] = self.getkey()
+        elif n == 4:
+            self.conout(reg[1])
+        elif n == 7:
+            reg[7] = CPM_EOF
+        elif n == 8:
+            self.track = 0
+        elif n == 9:
+            dph = self.drives[reg[1]].dph if reg[1] < len(self.drives) else 0
+            self.disk = reg[1] if dph else self.disk
+            reg[4], reg[5] = dph >> 8, dph & 0xFF
+        elif n == 10:
+            self.track = bc
+        elif n == 11:
+            self.sector = bc
+        elif n == 12:
+            self.biosDma = bc
+        elif n == 13:
+            data = self.drives[self.disk].sector(self.track, self.sector)
+            if data:
+                self.store(self.biosDma, data)
+            reg[7] = 0 if data else 1
+        elif n == 14:
+            reg[7] = 1          # no writable sectors, images are read only
+        elif n == 15:
+            reg[7] = 0xFF
+        elif n == 16:
+            de = reg[2] << 8 | reg[3]
+            sector = mem[(de + bc) & 0xFFFF] if de else bc
+            reg[4], reg[5] = sector >> 8, sector & 0xFF
+
+    def halted(self):
+        raise CpmReset
+
+    def inport(self, port):
+        port &= 0xFF
+        if port == CPM_UART_STATUS:
+            return 0x60 | (1 if self.status() else 0)
+        if port == CPM_UART_DATA:
+            return self.getkey() if self.poll() else 0
+        return 0xFF
+
+    def outport(self, port, value):
+        if port & 0xFF == CPM_UART_DATA:
+            self.conout(value)
+
+    def store(self, addr, data):
+        mem = self.cpu.mem
+        end = addr + len(data)
+        mem[addr:min(end, 0x10000)] = data[:0x10000 - addr]
+        if end > 0x10000:
+            mem[:end - 0x10000] = data[0x10000 - addr:]
+
+    def bdos_error(self, drive, kind):
+        self.print('\r\nBdos Err On %c: %s' % (65 + drive, kind))
+        raise CpmReset
+
+    # BDOS console and system calls, each returns what goes in HL
+
+    def de(self):
+        return self.cpu.reg[2] << 8 | self.cpu.reg[3]
+
+    def console_input(self):
+        c = self.getkey()
+        if c >= 32 or c in (8, 9, 10, 13):
+            self.conout(c)
+        return c
+
+    def console_output(self):
+        self.conout(self.cpu.reg[3])
+
+    def direct_io(self):
+        e = self.cpu.reg[3]
+        if e == 0xFF:
+            return self.getkey() if self.status() else 0
+        if e == 0xFE:
+            return 0xFF if self.status() else 0
+        self.conout(e)
+
+    def set_iobyte(self):
+        self.cpu.mem[3] = self.cpu.reg[3]
+
+    def print_string(self):
+        mem = self.cpu.mem
+        start = self.de()
+        end = mem.find(b'$', start)
+        self.out += mem[start:end if end >= 0 else 0x10000]
+        if len(self.out) >= TRANSPORT_READ:
+            self.flush()
+
+    def read_buffer(self):
+        mem = self.cpu.mem
+        buf = self.de()
+        line = self.readline(mem[buf])
+        mem[(buf + 1) & 0xFFFF] = len(line)
+        self.store((buf + 2) & 0xFFFF, line)
+
+    def reset_disks(self):
+        self.cpu.mem[4] &= 0xF0
+        self.dma = 0x80
+        self.readonly = 0
+
+    def select_disk(self):
+        drive = self.cpu.reg[3] & 15
+        if drive >= len(self.drives):
+            self.bdos_error(drive, 'Select')
+        self.cpu.mem[4] = self.cpu.mem[4] & 0xF0 | drive
+
+    def set_dma(self):
+        self.dma = self.de()
+
+    def allocation(self):
+        vector = bytearray(256)
+        for block in self.current()[1].blocks():
+            vector[block >> 3] |= 0x80 >> (block & 7)
+        self.cpu.mem[CPM_ALV:CPM_ALV + 256] = vector
+        return CPM_ALV
+
+    def write_protect(self):
+        self.readonly |= 1 << (self.cpu.mem[4] & 15)
+
+    def readonly_vector(self):
+        return self.readonly | sum(1 << i for i, d in enumerate(self.drives) if d.readonly)
+
+    def user_code(self):
+        mem = self.cpu.mem
+        if self.cpu.reg[3] == 0xFF:
+            return mem[4] >> 4
+        mem[4] = (self.cpu.reg[3] & 15) << 4 | mem[4] & 15
+
+    # BDOS file calls
+
+    def current(self):
+        drive = self.cpu.mem[4] & 15
+        return drive, self.drives[drive]
+
+    # The drive and name in an FCB, 0 is the current drive
+    def fcb(self, addr):
+        mem = self.cpu.mem
+        code = mem[addr] & 0x1F
+        drive = code - 1 if code and mem[addr] != 0x3F else mem[4] & 15
+        if drive >= len(self.drives):
+            self.bdos_error(drive, 'Select')
+        name = bytes(c & 0x7F for c in mem[addr + 1:addr + 12]).decode('latin-1').upper()
+        return drive, self.drives[drive], name
+
+    @staticmethod
+    def matches(pattern, name):
+        return all(p == '?' or p == n for p, n in zip(pattern, name))
+
+    def writable(self, drive):
+        if self.drives[drive].readonly or self.readonly >> drive & 1:
+            self.bdos_error(drive, 'R/O')
+
+    def set_extent(self, addr, extent, records):
+        mem = self.cpu.mem
+        mem[addr + 12] = extent & 31
+        mem[addr + 14] = extent >> 5
+        mem[addr + 15] = max(0, min(records - extent * 128, 128))
+
+    def extent(self, addr):
+        mem = self.cpu.mem
+        return mem[addr + 12] & 31 | (mem[addr + 14] & 0x3F) << 5
+
+    def open_file(self):
+        addr = self.de()
+        drive, disk, pattern = self.fcb(addr)
+        names = [n for n in disk.files() if self.matches(pattern, n)]
+        if not names:
+            return 0xFF
+        records = disk.records(names[0])
+        extent = self.extent(addr)
+        if extent and extent * 128 >= records:
+            return 0xFF
+        self.cpu.mem[addr + 1:addr + 12] = names[0].encode('latin-1')
+        self.set_extent(addr, extent, records)
+        return 0
+
+    def close_file(self):
+        drive, disk, name = self.fcb(self.de())
+        return 0 if name in disk.files() else 0xFF
+
+    def search_first(self):
+        addr = self.de()
+        mem = self.cpu.mem
+        drive, disk, pattern = self.fcb(addr)
+        every = mem[addr] == 0x3F
+        ext = mem[addr + 12]
+        self.search = [e for e in disk.entries() if every or (
+            self.matches(pattern, bytes(c & 0x7F for c in e[1:12]).decode('latin-1')) and
+            (ext == 0x3F or e[12] & 31 == ext & 31 and e[14] == mem[addr + 14]))]
+        return self.search_next()
+
+    def search_next(self):
+        if not self.search:
+            return 0xFF
+        entry = self.search.pop(0)
+        self.store(self.dma, bytes((self.cpu.mem[4] >> 4,)) + entry[1:] + b'\xe5' * 96)
+        return 0
+
+    def delete_file(self):
+        drive, disk, pattern = self.fcb(self.de())
+        names = [n for n in disk.files() if self.matches(pattern, n)]
+        if not names:
+            return 0xFF
+        self.writable(drive)
+        for name in names:
+            disk.delete(name)
+        return 0
+
+    def make_file(self):
+        addr = self.de()
+        drive, disk, name = self.fcb(addr)
+        self.writable(drive)
+        if '?' in name:
+            return 0xFF
+        extent = self.extent(addr)
+        if extent == 0 or name not in disk.files():
+            disk.create(name)
+        self.set_extent(addr, extent, disk.records(name))
+        return 0
+
+    def rename_file(self):
+        addr = self.de()
+        drive, disk, name = self.fcb(addr)
+        new = self.fcb(addr + 16)[2]
+        files = disk.files()
+        if name not in files or new in files:
+            return 0xFF
+        self.writable(drive)
+        disk.rename(name, new)
+        return 0
+
+    # A record to or from the DMA buffer, 1 is reading past the end
+    def transfer(self, addr, record, write):
+        drive, disk, name = self.fcb(addr)
+        if name not in disk.files():
+            return 1
+        if write:
+            self.writable(drive)
+            mem = self.cpu.mem
+            disk.write(name, record, bytes(mem[self.dma:self.dma + CPM_RECORD]))
+        else:
+            data = disk.read(name, record)
+            if data is None:
+                return 1
+            self.store(self.dma, data)
+        self.set_extent(addr, record >> 7, disk.records(name))
+        return 0
+
+    def sequential(self, write):
+        addr = self.de()
+        mem = self.cpu.mem
+        extent, cr = self.extent(addr), mem[addr + 32]
+        if cr >= 128:
+            extent, cr = extent + 1, 0
+        result = self.transfer(addr, extent * 128 + cr, write)
+        if not result:
+            mem[addr + 32] = cr + 1
+        return result
+
+    def read_sequential(self):
+        return self.sequential(False)
+
+    def write_sequential(self):
+        return self.sequential(True)
+
+    def random(self, write):
+        addr = self.de()
+        mem = self.cpu.mem
+        if mem[addr + 35]:
+            return 6
+        record = mem[addr + 33] | mem[addr + 34] << 8
+        result = self.transfer(addr, record, write)
+        if not result:
+            mem[addr + 32] = record & 127
+        return result
+
+    def read_random(self):
+        return self.random(False)
+
+    def write_random(self):
+        return self.random(True)
+
+    def file_size(self):
+        addr = self.de()
+        drive, disk, name = self.fcb(addr)
+        records = disk.records(name) if name in disk.files() else 0
+        self.cpu.mem[addr + 33:addr + 36] = struct.pack('<I', records)[:3]
+
+    def set_random(self):
+        addr = self.de()
+        record = self.extent(addr) * 128 + self.cpu.mem[addr + 32]
+        self.cpu.mem[addr + 33:addr + 36] = struct.pack('<I', record)[:3]
+
+    # CCP
+
+    # Drive and 11 character name from d:name.ext, * fills with ?
+    @staticmethod
+    def parse_name(text):
+        drive = 0
+        if len(text) > 1 and text[1] == ':':
+            drive = ord(text[0]) - 64
+            text = text[2:]
+        base, dot, ext = text.partition('.')
+        name = ''
+        for field, size in ((base, 8), (ext, 3)):
+            if '*' in field:
+                field = field[:field.index('*')].ljust(size, '?')
+            name += field[:size].ljust(size)
+        return drive, name
+
+    def ccp_files(self, text, every=False):
+        drive, name = self.parse_name(text)
+        drive = drive - 1 if drive else self.cpu.mem[4] & 15
+        if not 0 <= drive < len(self.drives):
+            self.bdos_error(max(drive, 0), 'Select')
+        if every and not name.strip():
+            name = '?' * 11
+        disk = self.drives[drive]
+        return drive, disk, name, [n for n in disk.files() if self.matches(name, n)]
+
+    def ccp(self):
+        mem = self.cpu.mem
+        while True:
+            self.print('\r\n%c>' % (65 + (mem[4] & 15)))
+            line = self.readline(127).decode('latin-1').upper()
+            self.print('\n')
+            try:
+                if self.command(line):
+                    return
+            except OSError:
+                self.bdos_error(mem[4] & 15, 'Bad Sector')
+
+    # Runs a built in command, or loads a program and returns True
+    def command(self, line):
+        mem = self.cpu.mem
+        word, sep, tail = line.strip().partition(' ')
+        args = tail.split()
+        if not word:
+            return False
+        if len(word) == 2 and word[1] == ':':
+            drive = ord(word[0]) - 65
+            if not 0 <= drive < len(self.drives):
+                self.bdos_error(max(drive, 0), 'Select')
+            mem[4] = mem[4] & 0xF0 | drive
+        elif word == 'DIR':
+            drive, disk, name, names = self.ccp_files(args[0] if args else '', True)
+            if not names:
+                self.print('NO FILE')
+            for i, name in enumerate(sorted(names)):
+                if i % 4:
+                    self.print(' : %s %s' % (name[:8], name[8:]))
+                else:
+                    self.print('%s%c: %s %s' % ('\r\n' if i else '', 65 + drive, name[:8], name[8:]))
+        elif word == 'ERA' and args:
+            drive, disk, name, names = self.ccp_files(args[0])
+            if name == '?' * 11:
+                self.print('ALL (Y/N)?')
+                answer = self.readline(1)
+                self.print('\n')
+                if answer.upper() != b'Y':
+                    return False
+            if not names:
+                self.print('NO FILE')
+                return False
+            self.writable(drive)
+            for name in names:
+                disk.delete(name)
+        elif word == 'TYPE' and args:
+            drive, disk, name, names = self.ccp_files(args[0])
+            if '?' in name or not names:
+                self.print('NO FILE')
+                return False
+            record = 0
+            while not self.poll():
+                data = disk.read(name, record)
+                if data is None:
+                    break
+                end = data.find(b'\x1a')
+                self.out += data[:end] if end >= 0 else data
+                if end >= 0:
+                    break
+                record += 1
+                if len(self.out) >= TRANSPORT_READ:
+                    self.flush()
+        elif word == 'REN' and args and '=' in args[0]:
+            new, sep, old = args[0].partition('=')
+            drive, disk, name, names = self.ccp_files(old)
+            target = self.parse_name(new)[1]
+            if '?' in name + target:
+                self.print('REN?')
+            elif not names:
+                self.print('NO FILE')
+            elif target in disk.files():
+                self.print('FILE EXISTS')
+            else:
+                self.writable(drive)
+                disk.rename(name, target)
+        elif word == 'SAVE' and len(args) == 2 and args[0].isdigit() and int(args[0]) < 256:
+            drive, disk, name, names = self.ccp_files(args[1])
+            if '?' in name or not name.strip():
+                self.print('SAVE?')
+                return False
+            self.writable(drive)
+            disk.create(name)
+            for record in range(int(args[0]) * 2):
+                start = CPM_TPA + record * CPM_RECORD
+                disk.write(name, record, bytes(mem[start:start + CPM_RECORD]))
+        elif word == 'USER' and len(args) == 1 and args[0].isdigit() and int(args[0]) < 16:
+            mem[4] = int(args[0]) << 4 | mem[4] & 15
+        else:
+            return self.load(word, tail)
+        return False
+
+    def load(self, word, tail):
+        mem = self.cpu.mem
+        drive, name = self.parse_name(word)
+        drive = drive - 1 if drive else mem[4] & 15
+        if '?' in name or name[8:].strip() or not 0 <= drive < len(self.drives):
+            self.print(word + '?')
+            return False
+        disk = self.drives[drive]
+        name = name[:8] + 'COM'
+        if name not in disk.files():
+            self.print(word + '?')
+            return False
+        if disk.records(name) * CPM_RECORD > CPM_BDOS - 6 - CPM_TPA:
+            self.print('BAD LOAD')
+            return False
+        record = 0
+        while True:
+            data = disk.read(name, record)
+            if data is None:
+                break
+            start = CPM_TPA + record * CPM_RECORD
+            mem[start:start + CPM_RECORD] = data
+            record += 1
+        mem[0x5C:0x80] = bytes(0x24)
+        args = tail.split()
+        for addr, arg in zip((0x5C, 0x6C), args + ['', '']):
+            drive, name = self.parse_name(arg)
+            mem[addr] = drive
+            mem[addr + 1:addr + 12] = name.encode('latin-1')
+        text = (' ' + tail.strip() if tail.strip() else '').encode('latin-1')[:126]
+        mem[0x80] = len(text)
+        mem[0x81:0x82 + len(text)] = text + b'\0'
+        self.dma = 0x80
+        cpu = self.cpu
+        cpu.sp = CPM_BDOS - 6
+        cpu.push(0)             # a RET from the program warm boots
+        cpu.pc = CPM_TPA
+        return True
+
+
+class DriveServer:
+    """ Host directories as drives for the H8, over the XMODEM port.
+
+        A driver on the H8 sends the BDOS file calls for its remote drives
+        as frames, STX, the call, a length, the FCB, the record for
+        writes and a checksum of everything after STX.  The answer is STX,
+        what the BDOS returned in A, a length, the FCB as the call left it,
+        the record for reads and searches and a checksum.  A damaged frame
+        is answered with NAK.  The calls run on the built in CP/M machine's
+        BDOS, so the drives behave like cpm: ones, and the H8's drive byte
+        picks the directory, 0 and 1 are the first.  There is no driver
+        for the H8 yet, this is only the host's half.
+    """
+
+    def __init__(self, port, drives, opener):
+        self.port = port
+        self.opener = opener    # opens the port, again after a pause
+        self.bdos = CpmMachine(drives, None)
+        self.bdos.cpu.reg[2:4] = [DRIVE_FCB >> 8, DRIVE_FCB & 0xFF]     # DE
+        self.ser = None
+        self.thread = None
+        self.running = False
+        self.paused = 0
+        self.calls = 0
+        self.naks = 0
+
+    def start(self):
+        self.ser = self.opener()
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, name='drive server', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        if self.ser:
+            self.ser.close()
+            self.ser = None
+
+    # XMODEM transfers on the same port stop the server until they are done
+    def pause(self):
+        self.paused += 1
+        if self.paused == 1:
+            self.stop()
+
+    def resume(self):
+        self.paused -= 1
+        if self.paused == 0:
+            try:
+                self.start()
+            except (OSError, ValueError):
+                self.ser = None     # stays off, the port has gone away
+
+    def serve(self):
+        try:
+            while self.running:
+                frame = self.read_frame()
+                if frame:
+                    status, data = self.answer(*frame)
+                    body = bytes((status, len(data))) + data
+                    self.ser.write(bytes((DRIVE_STX,)) + body + bytes((sum(body) & 0xFF,)))
+                    self.ser.flush()
+        except OSError:         # the port has gone
+            self.running = False
+
+    # Up to n bytes, fewer if the deadline passes first
+    def take(self, n, deadline):
+        data = b''
+        while len(data) < n:
+            self.ser.timeout = max(deadline - time.time(), 0)
+            more = self.ser.read(n - len(data))
+            if not more and time.time() >= deadline:
+                break
+            data += more
+        return data
+
+    # The call and payload of the next good frame, None if none came
+    def read_frame(self):
+        self.ser.timeout = TRANSPORT_IDLE
+        if self.ser.read(1) != bytes((DRIVE_STX,)):
+            return None
+        deadline = time.time() + DRIVE_FRAME_TIMEOUT
+        head = self.take(2, deadline)
+        body = self.take(head[1] + 1, deadline) if len(head) == 2 else b''
+        if len(head) < 2 or len(body) < head[1] + 1 or (sum(head) + sum(body[:-1])) & 0xFF != body[-1]:
+            self.naks += 1
+            self.ser.write(NAK)
+            return None
+        return head[0], body[:-1]
+
+    def answer(self, call, payload):
+        bdos = self.bdos
+        mem = bdos.cpu.mem
+        self.calls += 1
+        if call == 0:           # hello, answers with the number of drives
+            return 0, bytes((len(bdos.drives),))
+        if call not in DRIVE_CALLS or len(payload) < 36 + CPM_RECORD * (call in DRIVE_WRITES):
+            return 0xFF, b''
+        mem[DRIVE_FCB:DRIVE_FCB + 36] = payload[:36]
+        mem[DRIVE_DMA:DRIVE_DMA + CPM_RECORD] = payload[36:36 + CPM_RECORD].ljust(CPM_RECORD, b'\0')
+        mem[4] = 0
+        bdos.dma = DRIVE_DMA
+        try:
+            status = bdos.bdosCalls[call]() or 0
+        except CpmReset:        # R/O or no such drive
+            status = 0xFF
+            bdos.out.clear()
+        except OSError:
+            status = 0xFF
+        data = bytes(mem[DRIVE_FCB:DRIVE_FCB + 36])
+        if call in DRIVE_READS and status == 0:
+            data += bytes(mem[DRIVE_DMA:DRIVE_DMA + CPM_RECORD])
+        return status, data
+
+
+class FanoutTarget:
+    """ One machine a fan-out send goes to and how it is getting on. """
+
+    def __init__(self, port):
+        self.port = port
+        self.state = 'waiting'      # then sending, done or failed
+        self.percent = 0
+        self.retries = 0            # blocks sent again after a NAK
+        self.error = ''
+        self.start = None
+        self.end = None
+
+    def elapsed(self):
+        if self.start is None:
+            return 0.0
+        return (self.end or time.time()) - self.start
+
+
+class MappedReader:
+    """ A read position of its own in a mapping shared with other readers. """
+
+    def __init__(self, mm, fd):
+        self.mm = mm
+        self.fd = fd
+        self.pos = 0
+
+    def read(self, n):
+        data = self.mm[self.pos:self.pos + n]
+        self.pos += len(data)
+        return data
+
+    def fileno(self):
+        return self.fd.fileno()
+
+
+class FanoutSend:
+    """ One file to several machines at once over XMODEM.
+
+        Every target port gets its own sender thread, they all read the
+        same mapping of the file and each keeps its own progress, retries
+        and result in a FanoutTarget, so the slowest machine sets how long
+        it takes.  term opens and closes the ports and does the transfers.
+    """
+
+    def __init__(self, term, filename, ports):
+        self.term = term
+        self.filename = filename
+        self.targets = [FanoutTarget(p) for p in dict.fromkeys(ports)]
+        self.threads = []
+        self.fd = open(filename, 'rb')
+        size = os.fstat(self.fd.fileno()).st_size
+        self.mm = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def start(self):
+        for target in self.targets:
+            thread = threading.Thread(target=self.send, args=(target,),
+                                      name='fan-out %s' % target.port, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def send(self, target):
+        target.start = time.time()
+        try:
+            ser = self.term.xmodem_open(target.port)
+        except (OSError, ValueError) as e:
+            target.error = str(e)
+            target.state = 'failed'
+            target.end = time.time()
+            return
+        target.state = 'sending'
+
+        def progress(percent):
+            target.percent = percent
+
+        def retry():
+            target.retries += 1
+        try:
+            ok = self.term.xmodem_transfer(ser, MappedReader(self.mm, self.fd), progress, retry)
+            if not ok:
+                target.error = 'receiver gave up, stopped answering or NAKed a block too often'
+        except OSError as e:
+            ok = False
+            target.error = str(e)
+        finally:
+            self.term.xmodem_close(ser)
+        target.end = time.time()
+        if ok:
+            target.percent = 100
+        target.state = 'done' if ok else 'failed'
+
+    def running(self):
+        return any(t.is_alive() for t in self.threads)
+
+    def wait(self):
+        for thread in self.threads:
+            thread.join()
+        self.close()
+
+    def close(self):
+        if isinstance(self.mm, mmap.mmap):
+            self.mm.close()
+        self.fd.close()
+
+    def failed(self):
+        return [t for t in self.targets if t.state == 'failed']
+
+    # A line for each target, for the summary popup and --fanout
+    def summary(self, width=64):
+        lines = []
+        for t in self.targets:
+            line = '%-16s %-7s %3d%% %4d retries %6.1fs' % (
+                t.port[-16:], t.state, t.percent, t.retries, t.elapsed())
+            if t.error:
+                line += '  ' + t.error
+            lines.append(line[:width])
+        return lines
+
+
+class H19Term(H19Keys, H19Screen):
+    """ H19 terminal.
+
+        Supports I/O using a serial port.
+    """
+
+    def __init__(self):
+        self.screen = None
+        self.status = None
+        self.logio = False
+        self.showbox = True
+        self.cursorMode = CURSOR_NORMAL
+        self.headless = False
+        self.offline = False
+        self.firstChar = True
+        self.recorder = None
+        self.recordFile = None
+        self.trace = None           # TraceWriter for --trace
+        self.traceSent = None       # what an escape sequence answered, while tracing
+        self.traceFile = None
+        self.traceOps = TRACE_OPS
+        self.responder = None
+        self.script = None
+        self.rxbuf = bytearray()    # bulk read from the port, see sio_fill()
+        self.rxpos = 0
+        self.sio = None
+        self.sessions = [self]      # shared by every session, see add_session()
+        self.number = 1
+        self.visible = True
+        self.switchTo = None
+        self.logFile = LOG_FILE
+        self.stats = SessionStats()
+        self.profiler = None        # only the first session's is used
+        self.echoWait = []          # (byte, time sent) of typed characters
+        self.txbuf = ''             # typed, waiting for send_typed()
+        self.txEchoed = []          # where in txbuf the host should echo
+        self.lineEdit = None        # LineEditor while CTRL-\ line editing is on
+        self.editOrigin = None      # where the line being edited is drawn
+        self.editUnder = []         # what the host had there, put back after
+        self.predicting = False     # CTRL-A T, draw typing before the echo
+        self.predictions = []       # [y, x, char, cell underneath, time typed]
+        self.predictQuiet = 0.0     # no predictions until this perf_counter()
+        self.backspaceWait = []     # times backspace was typed, see backspace_echo()
+        self.backspacePartial = None    # when part of BS_ECHO arrived
+        self.keyBucket = None       # paces txbuf, made once the config is read
+        self.flowStopped = False    # we have sent XOFF or dropped RTS
+        self.held = False           # hold screen has a full page up
+        self.holdLines = HOLD_PAGE
+        self.sinewave = None        # only the first session's is used, see bell()
+        self.portProbe = None       # thread running comports(), see probe_ports()
+        self.ports = []
+        self.startupBench = None    # [(step, seconds since start)] for --startup-bench
+        self.mirror = None          # ScreenMirror, only the first session's is used
+        self.driveServer = None     # DriveServer on the XMODEM port
+        self.baudrate = H19_RATES   # ESC r A is the first
+
+        H19Screen.__init__(self, self.screen, self.status)
+
+    def get_h19config(self):
+        global SERIAL_PORT, XMODEM_PORT, BAUD_RATE, PRELOAD_FONT, FONT, BEEP
+        global AUTO_CPM_DATE, CPM_DATE_FORMAT, CPM_TIME_FORMAT, XMODEM_RATE
+        global AUTO_HDOS_DATE, HDOS_DATE_FORMAT, INSTALL_PATH, AUTORUN_MODE
+        global KEY_REPEAT_RATE, DEFAULT_COLOUR, RUN_PATH
+        global LC_WHITE, LC_GREEN, LC_YELLOW
+        global LC_BLUE, LC_CYAN, LC_MAGENTA, LC_RED, TRIGGERS, SESSION_PORTS
+        global XMODEM_BOOST, FLOW_CONTROL, PREDICT_ECHO, DRIVE_SERVER, FANOUT_PORTS
+        Config = configparser.ConfigParser(allow_no_value = True, interpolation = None)
+
+        updateFile = True
+        # If it exists get the settings otherwise write them to a file
+        if os.path.isfile(CONFIG_FILE):
+            updateFile = False
+
+            try:
+                Config.read(CONFIG_FILE)
+                if Config.has_option('General', 'RunPath'):
+                    RUN_PATH = Config.get('General', 'RunPath')
+                else: updateFile = True
+                if Config.has_option('General','KeyRepeatRate'):
+                    KEY_REPEAT_RATE = Config.getfloat('General','KeyRepeatRate')
+                else: updateFile = True
+                if Config.has_option('General','SoundFile'):
+                    BEEP = Config.get('General','SoundFile')
+                else: updateFile = True
+                PREDICT_ECHO = Config.getboolean('General', 'predictecho', fallback=False)
+
+                if Config.has_option('SerialComms', 'port'):
+                    SERIAL_PORT = Config.get('SerialComms', 'port')
+                else: updateFile = True
+                if Config.has_option('SerialComms', 'baudRate'):
+                    BAUD_RATE = Config.getint('SerialComms', 'baudRate')
+                else: updateFile = True
+
+                if Config.has_option('SerialComms', 'xmodemport'):
+                    XMODEM_PORT = Config.get('SerialComms', 'xmodemport')
+                else: updateFile = True
+                if Config.has_option('SerialComms', 'xmodembaudrate'):
+                    XMODEM_RATE = Config.getint('SerialComms', 'xmodembaudrate')
+                else: updateFile = True
+                SESSION_PORTS = Config.get('SerialComms', 'sessionports', fallback='')
+                XMODEM_BOOST = Config.getint('SerialComms', 'xmodemboost', fallback=0)
+                DRIVE_SERVER = Config.get('SerialComms', 'driveserver', fallback='')
+                FANOUT_PORTS = Config.get('SerialComms', 'fanoutports', fallback='')
+                FLOW_CONTROL = Config.get('SerialComms', 'flowcontrol', fallback='xonxoff').lower()
+
+                if Config.has_option('AutoRun', 'autorunmode'):
+                    AUTORUN_MODE = Config.get('AutoRun', 'autorunmode')
+                else: updateFile = True
+
+                if Config.has_option('Fonts','Preload'):
+                    PRELOAD_FONT = Config.getboolean('Fonts','Preload')
+                else: updateFile = True
+                if Config.has_option('Fonts','Font'):
+                    FONT = Config.get('Fonts','Font')
+                else: updateFile = True
+
+                if Config.has_option('Colours','DefaultColour'):
+                    DEFAULT_COLOUR = Config.getint('Colours','DefaultColour')
+                else: updateFile = True
+                if Config.has_option('Colours','White'):
+                    LC_WHITE = Config.get('Colours','White')
+                else: updateFile = True
+                if Config.has_option('Colours','Green'):
+                    LC_GREEN = Config.get('Colours','Green')
+                else: updateFile = True
+                if Config.has_option('Colours','Yellow'):
+                    LC_YELLOW = Config.get('Colours','Yellow')
+                else: updateFile = True
+                if Config.has_option('Colours','Blue'):
+                    LC_BLUE = Config.get('Colours','Blue')
+                else: updateFile = True
+                if Config.has_option('Colours','Cyan'):
+                    LC_CYAN = Config.get('Colours','Cyan')
+                else: updateFile = True
+                if Config.has_option('Colours','Magenta'):
+                    LC_MAGENTA = Config.get('Colours','Magenta')
+                else: updateFile = True
+                if Config.has_option('Colours','Red'):
+                    LC_RED = Config.get('Colours','Red')
+                else: updateFile = True
+
+                if Config.has_option('Date','AutoCpmDate'):
+                    AUTO_CPM_DATE = Config.getboolean('Date','AutoCpmDate')
+                else: updateFile = True
+                if Config.has_option('Date','CpmDate'):
+                    CPM_DATE_FORMAT = Config.get('Date','CpmDate')
+                else: updateFile = True
+                if Config.has_option('Date','CpmTime'):
+                    CPM_TIME_FORMAT = Config.get('Date','CpmTime')
+                else: updateFile = True
+                if Config.has_option('Date','AutoHdosDate'):
+                    AUTO_HDOS_DATE = Config.getboolean('Date','AutoHdosDate')
+                else: updateFile = True
+                if Config.has_option('Date','HdosDate'):
+                    HDOS_DATE_FORMAT = Config.get('Date','HdosDate')
+                else: updateFile = True
+
+                TRIGGERS = []
+                for section in Config.sections():
+                    if section.startswith('Trigger ') and Config.has_option(section, 'Match'):
+                        TRIGGERS.append({
+                            'name': section[8:],
+                            'match': Config.get(section, 'Match'),
+                            'send': codecs.decode(Config.get(section, 'Send', fallback=''),
+                                                  'unicode_escape'),
+                            'regex': Config.getboolean(section, 'Regex', fallback=False),
+                            'bootonly': Config.getboolean(section, 'BootOnly', fallback=False)})
+
+            except:
+                print("Problem reading configuration file .h19termrc, skipping...")
+
+        if updateFile:
+            print("\nConfiguration file ~/.h19termrc not found:")
+            print("    A new one will be created after serial port selection...")
+            print("    You may edit this file to set your defaults...\n")
+            print("\nChecking serial ports...")
+
+            enterOne = -1
+            availablePorts = []
+            try:
+                ports = self.serial_ports()
+                print("    These are a list of ports found on this system, there may be others")
+                print("    but they didn't show up in the probe...\n")
+
+                i = 0
+                for port, desc, hwid in ports:
+                    if hwid != 'n/a':
+                        i += 1
+                        availablePorts.append(port)
+                        print('%s.  %-15s %s' % (i,port, desc))
+                print('%s.  %-15s %s' % (i+1,'Enter one', ''))
+                enterOne = i+1
+            except:
+                print("Your python serial package doesn't have the serial port probe")
+                print("We'll have to work around it and just offer a couple of standard")
+                print("ports without knowing if they actually exist...\n")
+                print('%s.  %-15s %s' % ('1','/dev/ttyS0', 'Builtin port '))
+                print('%s.  %-15s %s' % ('2','/dev/ttyUSB0', 'USB to RS232 cable'))
+                print('%s.  %-15s %s' % ('3','Enter one', ''))
+                enetrOne = 3
+                availablePorts.append('/dev/ttyS0')
+                availablePorts.append('/dev/ttyUSB0')
+
+            print("\n   Please select one of these, or press <Enter> if you would")
+            print("   like to enter your own by editing your ~/.h19termrc configuration file.")
+            print("\n   Python doesn't always find all available ports on your computer.")
+            print("   A default baud rate of 9600 will be choosen.")
+            print("   Or enter A to look for your H8 on these ports and find its baud rate.\n")
+
+            portno = input("Enter number: ")
+
+            if portno.strip() in ('a', 'A'):
+                print("Looking for the H8...")
+                found = BaudProbe(availablePorts, BAUD_RATES).best()
+                if found:
+                    SERIAL_PORT, BAUD_RATE = found[0], found[1]
+                    print("Found it on %s at %d baud" % (SERIAL_PORT, BAUD_RATE))
+                else:
+                    print("Nothing answered, using default port -> %s" % SERIAL_PORT)
+            elif len(portno) > 0:
+                if int(portno) == enterOne:
+                    while True:
+                        print('\nEnter a port in the form of /dev/<devicename> or <enter> to quit')
+                        s = input('Enter port: ')
+                        if s == '':
+                            print("Using default port -> %s" % SERIAL_PORT)
+                            break
+                        if not os.path.exists(s):
+                            print('That port device doesn\'t exist...')
+                        else:
+                            SERIAL_PORT = s
+                            print("Setting port to -> %s" % SERIAL_PORT)
+                            break
+                else:
+                    SERIAL_PORT = availablePorts[int(portno)-1]
+                    print("Setting port to -> %s" % SERIAL_PORT)
+            else:
+                print("Using default port -> %s" % SERIAL_PORT)
+            print("Writing new ~/.h19termrc file...")
+
+            self.write_h19config(True)  # True if it's a new file not a rewrite
+
+    def write_h19config(self, new=False):
+        cfgfile = ''
+        Config = configparser.ConfigParser(allow_no_value = True, interpolation = None)
+        try:
+            cfgfile = open(CONFIG_FILE, 'w')
+        except:
+            print("Problem opening configuration file .h19term, skipping...")
+
+        # add the settings to the structure of the file, and lets write it out...
+        Config.add_section('General')
+        Config.add_section('SerialComms')
+        Config.add_section('AutoRun')
+        Config.add_section('Fonts')
+        Config.add_section('Colours')
+        Config.add_section('Date')
+        Config.set('General','SoundFile', BEEP)
+        Config.set('General','RunPath', str(RUN_PATH))
+        Config.set('General','# Use caution when increasing repeat rate to avoid overruns')
+        Config.set('General','KeyRepeatRate', str(KEY_REPEAT_RATE))
+        Config.set('General','PredictEcho', str(PREDICT_ECHO))
+        Config.set('SerialComms','Port', SERIAL_PORT)
+        Config.set('SerialComms','BaudRate', str(BAUD_RATE))
+        Config.set('SerialComms','XmodemPort', XMODEM_PORT)
+        Config.set('SerialComms','XmodemBaudRate', str(XMODEM_RATE))
+        Config.set('SerialComms','SessionPorts', SESSION_PORTS)
+        Config.set('SerialComms','XmodemBoost', str(XMODEM_BOOST))
+        Config.set('SerialComms','# DriveServer directories are drives for the H8 on the XMODEM port')
+        Config.set('SerialComms','DriveServer', DRIVE_SERVER)
+        Config.set('SerialComms','# FanoutPorts XMODEM ports a fan-out send goes to, in session order')
+        Config.set('SerialComms','FanoutPorts', FANOUT_PORTS)
+        Config.set('SerialComms','# FlowControl is xonxoff, rtscts or none')
+        Config.set('SerialComms','FlowControl', FLOW_CONTROL)
+
+        Config.set('AutoRun', 'AutoRunMode', str(AUTORUN_MODE))
+
+        Config.set('Fonts','Preload',str(PRELOAD_FONT))
+        Config.set('Fonts','Font',FONT)
+
+        Config.set('Colours','# Custom colours used only for Linux console, see manual')
+        Config.set('Colours', 'White', LC_WHITE)
+        Config.set('Colours', 'Green', LC_GREEN)
+        Config.set('Colours', 'Yellow', LC_YELLOW)
+        Config.set('Colours', 'Blue', LC_BLUE)
+        Config.set('Colours', 'Cyan', LC_CYAN)
+        Config.set('Colours', 'Magenta', LC_MAGENTA)
+        Config.set('Colours', 'Red', LC_RED)
+        Config.set('Colours','# Default colour of H19term on console or Xterm, see manual')
+        Config.set('Colours','DefaultColour', str(DEFAULT_COLOUR))
+
+        Config.set('Date','AutoCpmDate',str(AUTO_CPM_DATE))
+        Config.set('Date','CpmDate',CPM_DATE_FORMAT)
+        Config.set('Date','CpmTime',CPM_TIME_FORMAT)
+        Config.set('Date','AutoHdosDate',str(AUTO_HDOS_DATE))
+        Config.set('Date','HdosDate',HDOS_DATE_FORMAT)
+
+        for t in TRIGGERS:
+            section = 'Trigger ' + t['name']
+            Config.add_section(section)
+            Config.set(section, 'Match', t['match'])
+            Config.set(section, 'Send', t['send'].encode('unicode_escape').decode())
+            Config.set(section, 'Regex', str(t['regex']))
+            Config.set(section, 'BootOnly', str(t['bootonly']))
+        Config.write(cfgfile)
+        cfgfile.close()
+        if new:
+            sys.exit()
+
+    def setup_screen(self):
+        self.cur = curses.initscr()  # Initialize curses.
+        curses.start_color()
+
+        if curses.termname() == b'linux':
+            if PRELOAD_FONT and not self.font_loaded():
+                os.system("setfont %s" % os.path.join(INSTALL_PATH, FONT))
+
+            # setup colours for console only, X11 colours are set in the
+            # terminal application such as gnome-terminal
+            #
             # a hex colour number such as FFA400 is converted as follows
             # curses uses 0-1000 so hex 0xAA = 170 dec which then converts to
             # roughly to int(170*3.92) = 666
@@ -836,6 +5256,61 @@ class H19Term(H19Keys, H19Screen):
         curses.noecho()
         curses.nonl()
         self.cur.refresh()
+        return self.make_windows()
+
+    # True if the console already has FONT's glyphs, so setfont only has
+    # to run once rather than every time h19term starts.  Another font the
+    # same size, Terminus 16x32 say, hasn't got the H19 graphics.
+    def font_loaded(self):
+        try:
+            glyphs, count, width, height = self.read_font(os.path.join(INSTALL_PATH, FONT))
+        except (OSError, ValueError, struct.error):
+            return False
+        data = ctypes.create_string_buffer(FONT_MAX_CHARS * FONT_VPITCH * 4)
+        op = CONSOLE_FONT_OP.pack(KD_FONT_OP_GET, 0, 32, FONT_VPITCH, FONT_MAX_CHARS,
+                                  ctypes.addressof(data))
+        try:
+            op = fcntl.ioctl(sys.stdout.fileno(), KDFONTOP, op)
+        except OSError:
+            return False
+        loadedWidth, loadedHeight, loadedCount = CONSOLE_FONT_OP.unpack(op)[2:5]
+        if (loadedWidth, loadedHeight) != (width, height) or loadedCount < count:
+            return False
+        size = (width + 7) // 8 * height
+        pitch = (width + 7) // 8 * FONT_VPITCH
+        loaded = data.raw
+        return all(loaded[i * pitch:i * pitch + size] == glyphs[i * size:(i + 1) * size]
+                   for i in range(count))
+
+    # (glyph bitmaps, count, width, height) of a PSF1 or PSF2 console font
+    @staticmethod
+    def read_font(path):
+        with (gzip.open if path.endswith('.gz') else open)(path, 'rb') as f:
+            font = f.read()
+        if font[:2] == b'\x36\x04':
+            count = 512 if font[2] & 1 else 256
+            height = font[3]
+            return font[4:4 + count * height], count, 8, height
+        if font[:4] == b'\x72\xb5\x4a\x86':
+            header, flags, count, size, height, width = struct.unpack('<6I', font[8:32])
+            return font[header:header + count * size], count, width, height
+        raise ValueError("%s is not a PSF font" % path)
+
+    # Seconds since the process started, for --startup-bench
+    def uptime(self):
+        try:
+            with open('/proc/self/stat') as fd:
+                started = int(fd.read().rsplit(')', 1)[1].split()[19])
+            with open('/proc/uptime') as fd:
+                return float(fd.read().split()[0]) - started / os.sysconf('SC_CLK_TCK')
+        except (OSError, ValueError, IndexError):
+            return 0.0
+
+    def startup_step(self, name):
+        if self.startupBench is not None:
+            self.startupBench.append((name, self.uptime()))
+
+    def make_windows(self):
         self.screen = curses.newwin(25,80,self.X0, self.Y0)
         self.status = curses.newwin(4,80,26,self.Y0)
         self.screen.attrset(curses.color_pair(1))
@@ -858,7 +5333,7 @@ class H19Term(H19Keys, H19Screen):
         self.enable25thLine = False
         self.noKeyClick = False
         self.insertMode = False
-        self.holdScreenMode = False
+        self.exit_hold_screen_mode()
         self.reverseVideoMode = False
         self.graphicsMode = False
         self.keypadShiftedMode = False
@@ -872,45 +5347,169 @@ class H19Term(H19Keys, H19Screen):
         self.autoLineFeedMode = False
         self.keyboardDisabled = False
         self.wrapAtEndOfLine = False
-        self.linesSinceBoot = 0 # used to auto set date
+        if self.responder:
+            self.responder.reset()  # triggers count lines from here
         self.clear_display(True)
         self.cursor_home()
 
     def terminate(self):
         curses.endwin() # End screen (ready to draw new one, but instead we exit)
 
-    def open_port(self):
+    # Open a serial device or one of the other kinds of port, see StreamPort
+    def open_transport(self, port, baudrate, xonxoff, rtscts=False):
+        if port.startswith(('tcp://', 'telnet://')):
+            return NetworkPort(port)
+        if port.startswith('pty:'):
+            return PtyPort(port)
+        if port.startswith('cpm:'):
+            return CpmPort(port)
+        return serial.Serial(port, baudrate, xonxoff=xonxoff, rtscts=rtscts, timeout=0)
+
+    # Short name of a port for the status line and port popup
+    def port_label(self, port, width):
+        if port.startswith('/dev/'):
+            port = port[5:]
+        elif port.startswith(('pty:', 'cpm:')):
+            port = port[4:]
+        else:
+            port = port.split('://')[-1]
+        return port[:width]
+
+    def open_port(self, port=None):
+        port = port or SERIAL_PORT
         try:
-            sp = serial.Serial(SERIAL_PORT, BAUD_RATE, xonxoff=True, timeout=0)
+            sp = self.open_transport(port, BAUD_RATE, FLOW_CONTROL == 'xonxoff',
+                                     FLOW_CONTROL == 'rtscts')
             return sp
-        except:
-            print("\nATTENTION!! - Could not open serial port...\n\n")
+        except (OSError, ValueError) as e:
+            print("\nATTENTION!! - Could not open %s: %s\n\n" % (port, e))
             print("Please edit the ~/.h19termrc configuration file in your home directory")
             print("and set your serial port.  Most Linux installations will use either")
             print("/dev/ttyS0 or /dev/ttyS1 for the built in motherboard ports or ")
-            print("/dev/ttyUSB0 if you have a USB to RS232 converter.\n")
+            print("/dev/ttyUSB0 if you have a USB to RS232 converter.  Emulators can")
+            print("be reached with tcp://host:port, telnet://host:port or pty:command, and")
+            print("cpm:directory runs CP/M on the built in Z80.\n")
             sys.exit(1)
 
     def sio_write(self,sio, c):
         if self.offline:
             return
+        self.stats.bytesOut += len(c)
         if self.logio:
             self.log("\n{{%s}}" % c)
             #pass
+        if self.recorder:
+            self.recorder.record(SENT, str.encode(c))
+        if self.traceSent is not None:
+            self.traceSent += c
         while sio.out_waiting > 0:
             pass
         sio.write(str.encode(c))
         #sio.write(c)
 
+    # Typed keys wait in txbuf so a pass's worth go out in one write,
+    # send_typed() paces them
+    def key_write(self, sio, c, echoed=False):
+        if not self.offline:
+            if echoed:
+                self.txEchoed.append(len(self.txbuf))
+            if echoed and self.predicting and c != '\b':
+                self.predict(c)
+            elif self.predictions and c != '\r':
+                self.predict_undo()     # we can't guess what the host does with it
+            self.txbuf += c
+
+    # Send as much typing as the rate allows.  Returns the characters sent.
+    def send_typed(self, sio):
+        if not self.txbuf:
+            return 0
+        if self.keyBucket is None:
+            self.keyBucket = TokenBucket(1 / max(KEY_REPEAT_RATE, 0.001), KEY_BURST)
+        n = self.keyBucket.take(len(self.txbuf))
+        if n:
+            self.sio_write(sio, self.txbuf[:n])
+            now = time.perf_counter()   # echo latency is timed from here
+            while self.txEchoed and self.txEchoed[0] < n:
+                self.echoWait.append((ord(self.txbuf[self.txEchoed.pop(0)]), now))
+            self.txEchoed = [i - n for i in self.txEchoed]
+            self.txbuf = self.txbuf[n:]
+        return n
+
+    # Seconds until some session can send more of its typing
+    def typing_wait(self):
+        wait = TRANSPORT_IDLE
+        for term in self.sessions:
+            if term.txbuf and term.keyBucket:
+                wait = min(wait, term.keyBucket.wait())
+        return wait
+
+    # Read everything the port has waiting in one go, sio_read() hands it
+    # out a character at a time.  With a timeout it waits that long for the
+    # first byte when nothing is waiting.
+    def sio_fill(self, sio, timeout=SIO_NO_WAIT):
+        if self.offline:
+            return 0
+        if self.rxpos >= len(self.rxbuf):
+            self.rxbuf = bytearray()
+            self.rxpos = 0
+        n = sio.in_waiting
+        if n > 0:
+            data = sio.read(n)
+        elif timeout:
+            sio.timeout = timeout
+            data = sio.read(1)
+            sio.timeout = SIO_NO_WAIT
+        else:
+            return 0
+        if len(data) == 0:
+            return 0
+        self.received(sio, data)
+        self.rxbuf += data
+        return len(data)
+
+    # Everything read from the port passes through here
+    def received(self, sio, data):
+        self.stats.bytesIn += len(data)
+        if XOFF in data or XON in data:
+            self.stats.xoff += data.count(XOFF)
+            self.stats.xon += data.count(XON)
+        if self.echoWait:
+            self.match_echo(data)
+        if self.recorder:
+            self.recorder.record(RECEIVED, data)
+        if self.responder:
+            for trigger, response in self.responder.feed(data):
+                self.sio_write(sio, response)
+        if self.script:
+            self.script.received(data)
+
+    # Time how long the host took to echo what was typed, see process_key()
+    def match_echo(self, data):
+        now = time.perf_counter()
+        while self.echoWait and now - self.echoWait[0][1] > ECHO_TIMEOUT:
+            self.echoWait.pop(0)
+            self.stats.echoLost += 1
+        for b in data:
+            if not self.echoWait:
+                break
+            if b & 0x7F == self.echoWait[0][0]:
+                self.stats.echo.record(now - self.echoWait.pop(0)[1])
+
     # Sometimes we need to wait for a character so we use this function
     def sio_read(self, sio, TIMEOUT=SIO_WAIT):
         if not self.offline:
-            if TIMEOUT == 0:
-                c = sio.read(1)
+            if self.rxpos < len(self.rxbuf):
+                c = self.rxbuf[self.rxpos:self.rxpos + 1]
+                self.rxpos += 1
             else:
-                sio.timeout = TIMEOUT
-                c = sio.read(1)
-                sio.timeout = SIO_NO_WAIT
+                if TIMEOUT == 0:
+                    c = sio.read(1)
+                else:
+                    sio.timeout = TIMEOUT
+                    c = sio.read(1)
+                    sio.timeout = SIO_NO_WAIT
+                if len(c) > 0:
+                    self.received(sio, c)
             if len(c) > 0:
                 c = chr(ord(c) & 0x7F)
                 if self.logio:
@@ -921,18 +5520,99 @@ class H19Term(H19Keys, H19Screen):
         else:
             return('')
 
+    # Sleep until the port or the keyboard has something, False if the
+    # port can't be waited on and the caller has to poll.
+    def sio_wait(self, timeout):
+        ports = [sys.stdin]
+        for term in self.sessions:
+            if term.offline:
+                continue
+            if not hasattr(term.sio, 'fileno'):
+                return False
+            if term.sio.in_waiting:
+                return True
+            ports.append(term.sio)
+        select.select(ports, [], [], timeout)
+        return True
+
     def log(self, s):
         try:
-            log = open(LOG_FILE, 'a')
+            log = open(self.logFile, 'a')
         except:
             self.bell()
-            self.popup_error("Can't open %s for writing" % LOG_FILE)
+            self.popup_error("Can't open %s for writing" % self.logFile)
             return
 
         log.write(s)
         log.close()
 
+    # True if the whole escape sequence starting at rxpos has arrived
+    def escape_complete(self):
+        rest = self.rxbuf[self.rxpos + 1:self.rxpos + 1 + ANSI_MAX_SEQ]
+        rest = ''.join(chr(b & 0x7F) for b in rest)
+        if self.ansiMode:
+            for ch in rest:
+                if ch in ANSI_ILLEGAL or ch in ANSI_CMDS:
+                    return True
+            return len(rest) >= ANSI_MAX_SEQ
+        if len(rest) == 0:
+            return False
+        if rest[0] == 'Y':
+            return len(rest) >= 3
+        if rest[0] in 'rxy':
+            return len(rest) >= 2
+        return True
+
+    # Run what has arrived through the terminal.  An escape sequence that
+    # is only partly here stays in rxbuf until the rest turns up, so the
+    # parser never has to wait on the port.
+    def process_buffered(self, sio, limit=None):
+        count = 0
+        while self.rxpos < len(self.rxbuf) and not self.held:
+            if self.rxbuf[self.rxpos] & 0x7F == 0x1B and not self.escape_complete():
+                break
+            if limit is not None and count >= limit:
+                break
+            if self.backspaceWait and self.rxbuf[self.rxpos] & 0x7F == 8:
+                echo = self.backspace_echo(sio)
+                if echo is None:
+                    break       # the rest of it is on its way
+                if echo:
+                    count += len(BS_ECHO)
+                    continue
+            if self.predictions:
+                self.predict_check(self.rxbuf[self.rxpos])
+            self.process_char(self.sio_read(sio, TIMEOUT=SIO_NO_WAIT), sio)
+            count += 1
+        return count
+
+    # A ^H has come while we wait on the echo of a backspace.  Returns True
+    # if it was the H8's ^H <SPACE> ^H and has been dealt with, False if it
+    # is to be drawn as usual, None to wait for the rest.  Nothing is read
+    # from the port, other bytes stay in order behind it.
+    def backspace_echo(self, sio):
+        now = time.perf_counter()
+        while self.backspaceWait and now - self.backspaceWait[0] > ECHO_TIMEOUT:
+            self.backspaceWait.pop(0)       # the host didn't echo those
+        if not self.backspaceWait:
+            return False
+        rest = bytes(b & 0x7F for b in self.rxbuf[self.rxpos:self.rxpos + len(BS_ECHO)])
+        if len(rest) < len(BS_ECHO) and BS_ECHO.startswith(rest):
+            if self.backspacePartial is None:
+                self.backspacePartial = now
+            if now - self.backspacePartial < BS_ECHO_WAIT:
+                return None
+        self.backspacePartial = None
+        self.backspaceWait.pop(0)
+        if rest != BS_ECHO:
+            return False
+        for _ in BS_ECHO:
+            self.sio_read(sio, TIMEOUT=SIO_NO_WAIT)
+        self.erase_echo()
+        return True
+
     def process_escape_seq(self, sio):
+        self.predictQuiet = time.perf_counter() + PREDICT_QUIET  # likely a full screen program
         if self.ansiMode:
             self.ansi_escape_seq(sio)
         else:
@@ -940,6 +5620,7 @@ class H19Term(H19Keys, H19Screen):
 
     def heath_escape_seq(self, sio):
         c = self.sio_read(sio)
+        self.stats.escape('ESC ' + c)
 
         if c == 'A':
             self.cursor_up()
@@ -997,8 +5678,9 @@ class H19Term(H19Keys, H19Screen):
         elif c == 'q':
             self.exit_reverse_video_mode()
         elif c == 'r':
-            rate = ord(self.sio_read(sio))
-            self.modify_baudrate(sio, self.baudrate[rate - 65]) #'A' - 65 = 0
+            rate = ord(self.sio_read(sio)) - 65     # 'A' - 65 = 0
+            if 0 <= rate < len(self.baudrate):
+                self.modify_baudrate(sio, self.baudrate[rate])
         elif c == 't':
             self.enter_keypad_shifted_mode()
         elif c == 'u':
@@ -1035,19 +5717,21 @@ class H19Term(H19Keys, H19Screen):
             self.exit_alternate_keypad_mode()
         elif c == '\\':
             self.exit_hold_screen_mode()
+        else:
+            self.stats.dropped += 1
+        self.stats.refreshes += 1
         self.screen.refresh()
 
     def ansi_escape_seq(self, sio):
-        ansi_cmds = "ABCDHJKLMNPfhlmnpqrsuz"
-        illegal_chars = "<@!$%^&*+-"
         seq = ""
 
         while True:
             ch = self.sio_read(sio)
-            if ch in illegal_chars:
+            if ch in ANSI_ILLEGAL or len(seq) >= ANSI_MAX_SEQ:
+                self.stats.dropped += 1
                 return
             seq += ch
-            if ch in ansi_cmds:  # we're out if it's an ansi code
+            if ch in ANSI_CMDS:  # we're out if it's an ansi code
                 break
 
         # now seq will hold a code such as
@@ -1057,151 +5741,96 @@ class H19Term(H19Keys, H19Screen):
         # len(seq) = 8  ESC[>1;3;5l  rest - disable 25th line, exit hold screen,cursor on
 
         c = seq[len(seq) -1]    # get command (last char in seq)
-        if len(seq) == 2:
-            seq += '1'
+        self.stats.escape('ESC [' + c if seq[0] == '[' else 'ESC ' + c)
+
+        # The numbers between the [ and the command, missing ones are 0
+        params = [int(p) if p.isdigit() else 0 for p in seq[1:-1].lstrip('>?').split(';')]
+        n = max(params[0], 1)   # repeat counts of 0 mean 1
 
         if c == 'A':    # ESC [ Pn A
-            self.cursor_up(int(seq[2]))
+            self.cursor_up(n)
 
         elif c == 'B':  # ESC [ Pn B
-            self.cursor_down(int(seq[2]))
+            self.cursor_down(n)
 
         elif c == 'C':  # ESC [ Pn C
-            self.cursor_forward(int(seq[2]))
+            self.cursor_forward(n)
 
         elif c == 'D':  # ESC [ Pn D
-            self.cursor_backward(int(seq[2]))
-            return
+            self.cursor_backward(n)
 
-        elif c == 'H':  # ESC [ H or ESC [ Pn;Pn H
-            #time.sleep(.5)
+        elif c == 'H' or c == 'f':  # ESC [ H or ESC [ Pn;Pn H, f is the same
             if len(seq) == 2:
                 self.cursor_home()
             else:
-                idx1 = seq.find('[')
-                idx2 = seq.find(';')
-                idx3 = seq.find('H')
-                line = int(seq[idx1+1:idx2])
-                col = int(seq[idx2+1:idx3])
-                if line > 0:
-                    line -= 1
-                if col > 0:
-                    col -= 1
-                self.set_cursor_position(line,col)
-
-        elif c == 'J':
-            if len(seq) == 3:   #valid
-                if seq[1] == '0':
-                    self.erase_to_end_of_page()
-                elif seq[1] == '1':
-                    self.erase_to_beginning_of_display()
-                elif seq[1] == '2':
-                    self.clear_display()
+                line = params[0]
+                col = params[1] if len(params) > 1 else 1
+                self.set_cursor_position(max(line, 1) - 1, max(col, 1) - 1)
 
-        elif c == 'K':
-            if len(seq) == 3:   #valid
-                if seq[1] == '0':
-                    self.erase_to_end_of_line()
-                elif seq[1] == '1':
-                    self.erase_beginning_of_line()
-                elif seq[1] == '2':
-                    self.erase_line()
+        elif c == 'J':  # ESC [ Ps J
+            if params[0] == 0:
+                self.erase_to_end_of_page()
+            elif params[0] == 1:
+                self.erase_to_beginning_of_display()
+            elif params[0] == 2:
+                self.clear_display()
 
-        elif c == 'L':
-            if len(seq) == 3:
-                idx1 = string.find(seq, '[')
-                idx2 = string.find(seq, 'L')
-                lines = string.atoi(seq[idx1+1:idx2])
+        elif c == 'K':  # ESC [ Ps K
+            if params[0] == 0:
+                self.erase_to_end_of_line()
+            elif params[0] == 1:
+                self.erase_beginning_of_line()
+            elif params[0] == 2:
+                self.erase_line()
 
-                while lines > 0:
-                    self.insert_line()
-                    lines -= 1
-                self.carriage_return()
-                self.linefeed()
+        elif c == 'L':  # ESC [ Pn L
+            for i in range(n):
+                self.insert_line()
 
         elif c == 'M':
-            if len(seq) == 1:
+            if len(seq) == 1:   # ESC M
                 self.reverse_linefeed()
-            elif len(seq) == 3:
-                idx1 = string.find(seq, '[')
-                idx2 = string.find(seq, 'M')
-                lines = string.atoi(seq[idx1+1:idx2])
-
-                while lines > 0:
+            else:               # ESC [ Pn M
+                for i in range(n):
                     self.delete_line()
-                    lines -= 1
-
-                self.carriage_return()
-                self.linefeed()
-
-        elif c == 'P':
-            if len(seq) == 3:
-                idx1 = string.find(seq, '[')
-                idx2 = string.find(seq, 'P')
-                chars = string.atoi(seq[idx1+1:idx2])
-
-                while chars > 0:
-                    self.delete_character()
-                    chars -= 1
 
-        elif c == 'f':  # ESC [ f or ESC [ Pn;Pn f
-            if len(seq) == 2:
-                self.cursor_home()
-            else:
-                idx1 = string.find(seq, '[')
-                idx2 = string.find(seq, ';')
-                idx3 = string.find(seq, 'f')
-                line = string.atoi(seq[idx1+1:idx2])
-                col = string.atoi(seq[idx2+1:idx3])
-                if line > 0:
-                    line -= 1
-                if col > 0:
-                    col -= 1
-                self.set_cursor_position(line,col)
-
-        elif c == 'h':
-            if seq[1] == '>':   # Set modes
-                for i in seq:
-                    if i == 'h':
-                        break
-                    self.set_mode('set', i)
-
-            elif seq[1] == '2':
-                self.keyboard_disabled()
-            elif seq[1] == '4':
-                self.enter_insert_mode()
-            elif seq[1] == '?':
-                if seq[2] == '7':
-                    self.wrap_at_end_of_line()
-
-        elif c == 'l':
-            if seq[1] == '>':   # Reset modes
-                for i in seq:
-                    if i == 'l':
-                        break
-                    self.set_mode('reset', i)
-
-            elif seq[1] == '2':
-                self.keyboard_enabled()
-            elif seq[1] == '4':
-                self.exit_insert_mode()
-            elif seq[1] == '?':
-                if seq[2] == '2':
+        elif c == 'P':  # ESC [ Pn P
+            for i in range(n):
+                self.delete_character()
+
+        elif c == 'h' or c == 'l':
+            on = c == 'h'
+            if seq[1:2] == '>':     # ESC [ > Ps;...;Ps h sets modes, l resets them
+                for p in params:
+                    self.set_mode('set' if on else 'reset', str(p))
+            elif seq[1:2] == '?':
+                if params[0] == 7:
+                    if on:
+                        self.wrap_at_end_of_line()
+                    else:
+                        self.discard_at_end_of_line()
+                elif params[0] == 2 and not on:
                     self.enter_heath_mode()
-                elif seq[2] == '7':
-                    self.discard_at_end_of_line()
+            elif params[0] == 2:
+                if on:
+                    self.keyboard_disabled()
+                else:
+                    self.keyboard_enabled()
+            elif params[0] == 4:
+                if on:
+                    self.enter_insert_mode()
+                else:
+                    self.exit_insert_mode()
 
-        elif c == 'm':
-            if len(seq) == 2:
-                self.exit_reverse_video_mode()
-            if len(seq) >= 3:
-                if seq[1] == '0':
+        elif c == 'm':  # ESC [ Ps;...;Ps m
+            for p in params:
+                if p == 0:
                     self.exit_reverse_video_mode()
-                elif seq[1] == '7':
+                elif p == 7:
                     self.enter_reverse_video_mode()
-                elif seq[1] == '1' and seq[2] == '0':
+                elif p == 10:
                     self.enter_graphics_mode()
-                elif seq[1] == '1' and seq[2] == '1':
+                elif p == 11:
                     self.exit_graphics_mode()
 
         elif c == 'n':
@@ -1213,13 +5842,10 @@ class H19Term(H19Keys, H19Screen):
         elif c == 'q':
             self.transmit_25th_line()
 
-        elif c == 'r':
-            rate = 12   # default to 9600
-            if len(seq) == 3:  #len(seq) = 3, ex: ESC[8r  2400 baud
-                rate = int(seq[1])
-            elif len(seq) == 4: # ex: ESC[12r  9600 baud
-                rate = int(seq[1:3])
-            self.modify_baudrate(sio, self.baudrate[rate - 1])
+        elif c == 'r':  # ESC [ Pn r, 1 is 110 baud up to 12 for 9600
+            rate = params[0] or 12
+            if rate <= len(self.baudrate):
+                self.modify_baudrate(sio, self.baudrate[rate - 1])
 
         elif c == 's':
             self.save_cursor_position()
@@ -1254,19 +5880,22 @@ class H19Term(H19Keys, H19Screen):
         elif mode == '2':
             self.noKeyClick = set_mode
         elif mode == '3':
-            self.holdScreenMode = set_mode
+            if set_mode:
+                self.enter_hold_screen_mode()
+            else:
+                self.exit_hold_screen_mode()
         elif mode == '4':
             self.blockCursor = set_mode
             if set_mode:
-                curses.curs_set(CURSOR_BLOCK)
+                self.set_cursor(CURSOR_BLOCK)
             else:
-                curses.curs_set(CURSOR_NORMAL)
+                self.set_cursor(CURSOR_NORMAL)
         elif mode == '5':
             self.cursorOff = set_mode
             if set_mode:
-                curses.curs_set(CURSOR_INVISIBLE)
+                self.set_cursor(CURSOR_INVISIBLE)
             else:
-                curses.curs_set(CURSOR_NORMAL)
+                self.set_cursor(CURSOR_NORMAL)
         elif mode == '6':
             self.keypadShiftedMode = set_mode
             if set_mode:
@@ -1285,6 +5914,11 @@ class H19Term(H19Keys, H19Screen):
             self.autoCarriageReturnMode = set_mode
 
 
+    def set_cursor(self, mode):
+        self.cursorMode = mode
+        if not self.headless and self.visible:
+            curses.curs_set(mode)
+
     def enter_ansi_mode(self):
         y,x = self.screen.getyx()
         self.ansiMode = True
@@ -1302,10 +5936,17 @@ class H19Term(H19Keys, H19Screen):
 	# Modes of operation
 
     def enter_hold_screen_mode(self):
-        pass
+        self.holdScreenMode = True
+        self.holdLines = HOLD_PAGE
 
     def exit_hold_screen_mode(self):
-        pass
+        self.holdScreenMode = False
+        self.set_held(False)
+
+    def set_held(self, held):
+        if held != self.held:
+            self.held = held
+            self.show_hold()
 
     def enter_reverse_video_mode(self):
         self.screen.attron(curses.A_REVERSE)
@@ -1475,7 +6116,6 @@ class H19Term(H19Keys, H19Screen):
     def popup_help(self):
         helptext = """
           Commands can be called by CTRL-A <key>
-        
     Exit H19 Terminal..............X  |  F1........F1 
     Erase screen...................E  |  F2........F2
     Toggle serial I/O logging......L  |  F3........F3
@@ -1491,13 +6131,18 @@ class H19Term(H19Keys, H19Screen):
     Set H19term colours............C  |  IL.......KP_1
     Set Baud Rate and Port.........P  |  DL.......KP_3
     Send file by XMODEM............S  |  HOME.... KP_5
+    Fan-out send by XMODEM.........F  |
     Toggle window box char.........N  |  IC.......KP_7
-                                      |  DC.......KP_9
+    Toggle session recording.......W  |  DC.......KP_9
+    Session statistics.............I  |  SCROLL....S-DN
+    Toggle profiler................O  |  SH SCROLL.S-PGDN
+    Toggle predictive echo.........T  |
+    Switch session, TAB next.....1-9  |  LINE EDIT.CTRL-\\
         Press command key or <Enter> to close help.
         """
         try:
             self.background_clear()
-            popup = curses.newwin(22, 64, 2, 6)
+            popup = curses.newwin(27, 64, 1, 6)
             popup.addstr(1, 1, helptext)
             popup.border('|','|','-','-','+','+','+','+')
             popup.addstr(0,18, "[ H19term Command Summary ]")
@@ -1520,8 +6165,26 @@ class H19Term(H19Keys, H19Screen):
         while True:
 
             if s == 'x' or s == 'X':    # Exit
+                for term in self.sessions:
+                    term.stop_recording()
+                    term.stop_trace()
+                try:
+                    self.stop_profiler()
+                except OSError:
+                    pass
                 sys.exit(0)
 
+            elif s in '123456789':      # Switch to session 1 to 9
+                if int(s) <= len(self.sessions):
+                    self.switchTo = self.sessions[int(s) - 1]
+                else:
+                    self.bell()
+                break
+
+            elif s == '\t':             # Next session
+                self.switchTo = self.sessions[self.number % len(self.sessions)]
+                break
+
             elif s == '^A':             # Send Ctrl-A through, HDOS debug uses this
                 self.sio_write(sio, '\x01')
                 break
@@ -1553,6 +6216,10 @@ class H19Term(H19Keys, H19Screen):
                     self.enter_ansi_mode()
                 break
 
+            elif s == 'i' or s == 'I':  # Session statistics
+                self.popup_stats()
+                break
+
             elif s == 'k' or s == 'K':  # Toggle Alternate Keypad mode
                 if self.keypadAlternateMode:
                     self.exit_alternate_keypad_mode()
@@ -1593,6 +6260,10 @@ class H19Term(H19Keys, H19Screen):
                 self.screen.refresh()
                 break
 
+            elif s == 'o' or s == 'O':  # Toggle the profiler
+                self.toggle_profiler()
+                break
+
             elif s == 'p' or s == 'P':  # Set baud rate
                 self.popup_baud_rate(sio)
                 break
@@ -1616,12 +6287,122 @@ class H19Term(H19Keys, H19Screen):
             elif s == 's' or s == 'S':  # Reset terminal
                 self.xmodem_send(sio)
                 break
+            elif s == 'f' or s == 'F':  # Send a file to every fan-out port
+                self.xmodem_fanout(sio)
+                break
+            elif s == 'v' or s == 'V':  # View the serial log
+                self.show_file(self.logFile, self.service_sessions)
+                break
+            elif s == 't' or s == 'T':  # Toggle predictive echo
+                self.toggle_predicting()
+                break
+            elif s == 'w' or s == 'W':  # Toggle session recording
+                if self.recorder:
+                    self.stop_recording()
+                else:
+                    self.start_recording()
+                break
             elif s == 'z' or s == 'Z':
                 s = self.popup_help()
 
             else:
                 break  # get out on ^M or any non command key
 
+    def stats_snapshot(self):
+        sessions = []
+        for term in self.sessions:
+            stats = term.stats.as_dict()
+            stats['session'] = term.number
+            stats['port'] = 'offline' if term.offline or not term.sio else term.sio.port
+            sessions.append(stats)
+        return {'version': VERSION, 'time': time.time(), 'sessions': sessions}
+
+    # Machine readable copy of the counters next to the log file
+    def dump_stats(self):
+        filename = os.path.join(os.path.dirname(LOG_FILE), STATS_FILE)
+        with open(filename, 'w') as fd:
+            json.dump(self.stats_snapshot(), fd, indent=1)
+        return filename
+
+    # Anything that connects to the socket gets a JSON snapshot of every
+    # session's counters, e.g. socat - UNIX-CONNECT:/tmp/h19term.sock
+    def serve_stats(self, path):
+        if os.path.lexists(path):
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                raise FileExistsError(errno.EEXIST, "not a socket, won't replace it", path)
+            os.unlink(path)     # left by an earlier run
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(5)
+
+        def serve():
+            while True:
+                conn, addr = server.accept()
+                try:
+                    conn.sendall(json.dumps(self.stats_snapshot()).encode() + b'\n')
+                except OSError:
+                    pass
+                conn.close()
+
+        threading.Thread(target=serve, daemon=True).start()
+
+    def stats_lines(self):
+        st = self.stats
+        loop = self.sessions[0].stats
+        seconds = max(time.time() - st.started, 0.001)
+        lines = []
+        lines.append("Bytes in ........... %10d  %8.0f/s" % (st.bytesIn, st.bytesIn / seconds))
+        lines.append("Bytes out .......... %10d  %8.0f/s" % (st.bytesOut, st.bytesOut / seconds))
+        lines.append("Screen refreshes ... %10d" % st.refreshes)
+        lines.append("XOFF / XON in ...... %10d / %d" % (st.xoff, st.xon))
+        lines.append("XOFF / XON sent .... %10d / %d" % (st.xoffSent, st.xonSent))
+        lines.append("Dropped sequences .. %10d" % st.dropped)
+        lines.append("Loop wakeups ....... %10d" % loop.wakeups)
+        lines.append("Longest pass ....... %10.1f ms" % (loop.longestPass * 1000))
+        echo = st.echo
+        lines.append("Echo latency ....... %10d typed, %d not echoed" % (echo.count, st.echoLost))
+        lines.append("   p50 %.1f  p90 %.1f  p99 %.1f  max %.1f ms" %
+                     (echo.percentile(50) * 1000, echo.percentile(90) * 1000,
+                      echo.percentile(99) * 1000, echo.max * 1000))
+        lines.append("")
+        escapes = sorted(st.escapes.items(), key=lambda e: -e[1])
+        lines.append("Escape sequences, %d kinds:" % len(escapes))
+        for i in range(0, min(len(escapes), 12), 3):
+            lines.append("".join("%-7s %8d  " % e for e in escapes[i:i + 3]))
+        return lines
+
+    # Live view of the counters, the sessions keep running underneath
+    def popup_stats(self):
+        self.background_clear()
+        popup = curses.newwin(20, 64, 3, 8)
+        popup.timeout(STATS_TICK)
+        curses.curs_set(CURSOR_INVISIBLE)
+        message = "D dump to file, R reset, <Enter> to close"
+        while True:
+            popup.erase()
+            popup.border('|','|','-','-','+','+','+','+')
+            popup.addstr(0, 18, "[ Session %d Statistics ]" % self.number)
+            for i, line in enumerate(self.stats_lines()):
+                popup.addstr(2 + i, 3, line)
+            popup.addnstr(18, 3, message, 58)
+            popup.refresh()
+            c = popup.getch()
+            if c == NOCHAR:
+                self.service_sessions()
+            elif c in (ord('d'), ord('D')):
+                try:
+                    message = "Written to %s" % self.dump_stats()
+                except OSError as e:
+                    message = "Can't write the stats: %s" % e.strerror
+            elif c in (ord('r'), ord('R')):
+                for term in self.sessions:
+                    term.stats.reset()
+            else:
+                break
+        curses.curs_set(CURSOR_NORMAL)
+        self.screen.touchwin()
+        self.screen.refresh()
+
     def popup_autorun(self, mode):
         self.background_clear()
         popup = curses.newwin(12, 65, 8, 8)
@@ -1807,10 +6588,10 @@ class H19Term(H19Keys, H19Screen):
             popup.attrset(curses.color_pair(0))
             popup.addstr(2, 6, "Console Port")
             popup.addstr(3, 6, "[          ]")
-            popup.addstr(3, int((11 - len(str(SERIAL_PORT)))/2+10), str(SERIAL_PORT)[5:], curses.A_BOLD)
+            popup.addstr(3, int((6 - len(self.port_label(SERIAL_PORT, 10)))/2+10), self.port_label(SERIAL_PORT, 10), curses.A_BOLD)
             popup.addstr(2, 26, "Xmodem  Port")
             popup.addstr(3, 26, "[          ]")
-            popup.addstr(3, int((11 - len(str(XMODEM_PORT)))/2+30), str(XMODEM_PORT)[5:], curses.A_BOLD)
+            popup.addstr(3, int((6 - len(self.port_label(XMODEM_PORT, 10)))/2+30), self.port_label(XMODEM_PORT, 10), curses.A_BOLD)
 
 
             for i in range(len(cl)):
@@ -1818,7 +6599,7 @@ class H19Term(H19Keys, H19Screen):
                 popup.addstr(i + 5, c_column, cl[i], curses.color_pair(0))
                 popup.addstr(i + 5, 26, '[          ]')
                 popup.addstr(i + 5, x_column, cl[i], curses.color_pair(0))
-                popup.addstr(13, 7, "<Enter> to select, Q to quit")
+                popup.addstr(13, 4, "<Enter> select, A auto detect, Q quit")
 
             popup.border('|', '|', '-', '-', '+', '+', '+', '+')
             popup.addstr(0, 7, '[Baud Rate and Port Selection]')
@@ -1928,8 +6709,8 @@ class H19Term(H19Keys, H19Screen):
                     # Reload port
                     popup.addstr(3, 8, "         ", curses.color_pair(0) | curses.A_NORMAL)
                     popup.addstr(3, 28, "         ", curses.color_pair(0) | curses.A_NORMAL)
-                    popup.addstr(3, int((11 - len(str(SERIAL_PORT))) / 2 + 10), str(SERIAL_PORT)[5:], curses.A_BOLD)
-                    popup.addstr(3, int((11 - len(str(XMODEM_PORT))) / 2 + 30), str(XMODEM_PORT)[5:], curses.A_BOLD)
+                    popup.addstr(3, int((6 - len(self.port_label(SERIAL_PORT, 10))) / 2 + 10), self.port_label(SERIAL_PORT, 10), curses.A_BOLD)
+                    popup.addstr(3, int((6 - len(self.port_label(XMODEM_PORT, 10))) / 2 + 30), self.port_label(XMODEM_PORT, 10), curses.A_BOLD)
                     if idx == c_column:
                         idy = BAUD_RATES.index(BAUD_RATE)
                         selected_c = idy
@@ -1957,12 +6738,112 @@ class H19Term(H19Keys, H19Screen):
                         selected_x = idy
                         XMODEM_RATE = BAUD_RATES[idy]
                         self.screen.refresh()
+            elif chr(c) == 'a' or chr(c) == 'A':
+                if not isinstance(sio, serial.Serial):
+                    self.bell()
+                    self.popup_error("Auto detect only works on serial ports")
+                    return self.popup_baud_rate(sio)
+                popup.addstr(13, 4, "    Looking for the H8...            ")
+                popup.refresh()
+                try:
+                    found = self.auto_baud(sio)
+                except OSError as e:
+                    self.bell()
+                    self.popup_error("Can't open %s: %s" % (self.port_label(SERIAL_PORT, 15),
+                                                            e.strerror or e))
+                    return self.popup_baud_rate(sio)
+                if found:
+                    self.write_h19config()
+                    self.show_status_line()
+                else:
+                    self.bell()
+                    self.popup_error("No H8 answered on any port")
+                return self.popup_baud_rate(sio)   # draw it again with what was found
             elif chr(c) == 'q' or chr(c) == 'Q':
                 self.screen.touchwin()
                 self.screen.refresh()
                 curses.curs_set(1)
                 return
 
+    # comports() can take seconds so it runs in the background, started as
+    # early as we can, and the answer is saved in PORTS_FILE so the next
+    # start can skip it.  refresh probes again whatever was saved.
+    def probe_ports(self, refresh=False):
+        first = self.sessions[0]
+        if first.portProbe and not refresh:
+            return
+
+        def probe():
+            ports = None if refresh else self.saved_ports()
+            if ports is None:
+                try:
+                    from serial.tools.list_ports import comports
+                    ports = [(p.device, p.description, p.hwid) for p in sorted(comports())]
+                except Exception as e:
+                    first.ports = e     # this pyserial has no probe
+                    return
+                self.save_ports(ports)
+            first.ports = ports
+
+        thread = threading.Thread(target=probe, daemon=True)
+        thread.start()
+        if first.portProbe is None:
+            first.portProbe = thread
+
+    # Look for the H8 on every serial port no other session is using.  The
+    # console port is closed while it is tried and reopened on whichever
+    # port and rate were found.  Returns (port, rate, score) or None.
+    def auto_baud(self, sio):
+        global SERIAL_PORT, BAUD_RATE
+        try:
+            ports = [port for port, desc, hwid in self.serial_ports()]
+        except Exception:
+            ports = []
+        if sio.port not in ports:
+            ports.insert(0, sio.port)
+        busy = [term.sio.port for term in self.sessions if term is not self and term.sio]
+        ports = [p for p in ports if p not in busy]
+        rates = [BAUD_RATE] + [r for r in BAUD_RATES if r != BAUD_RATE]
+        found = None
+        sio.close()
+        try:
+            found = BaudProbe(ports, rates).best()
+        finally:
+            if found:
+                SERIAL_PORT, BAUD_RATE = found[0], found[1]
+                sio.port = SERIAL_PORT
+                sio.baudrate = BAUD_RATE
+            sio.open()
+        return found
+
+    # The ports the last probe found if it wasn't too long ago, less any
+    # that have gone since, None if the probe has to run again
+    def saved_ports(self):
+        try:
+            with open(PORTS_FILE) as f:
+                saved = json.load(f)
+            if not 0 <= time.time() - saved['time'] < PORTS_MAX_AGE:
+                return None
+            return [tuple(p) for p in saved['ports'] if os.path.exists(p[0])]
+        except (OSError, ValueError, KeyError, TypeError, IndexError):
+            return None
+
+    def save_ports(self, ports):
+        try:
+            with open(PORTS_FILE, 'w') as f:
+                json.dump({'time': time.time(), 'ports': ports}, f)
+        except OSError:
+            pass
+
+    # [(port, description, hwid)] from the last probe to finish
+    def serial_ports(self):
+        first = self.sessions[0]
+        self.probe_ports()
+        first.portProbe.join()
+        if isinstance(first.ports, Exception):
+            raise first.ports
+        return first.ports
+
     def popup_port_select(self, sio, idx):
         global SERIAL_PORT, XMODEM_PORT
         c_column = 8
@@ -1970,11 +6851,11 @@ class H19Term(H19Keys, H19Screen):
         cl = []
 
         try:
-            from serial.tools.list_ports import comports
-            for port, desc, hwid in sorted(comports()):
+            for port, desc, hwid in self.serial_ports():
                 cl.append(port)
         except:
             pass
+        self.probe_ports(refresh=True)  # in case an adapter is plugged in for next time
 
         self.background_clear()
         popup = curses.newwin(14, 36, 6, 20)
@@ -2029,91 +6910,366 @@ class H19Term(H19Keys, H19Screen):
                 return
 
     def show_ascii_file(self, filename):
+        self.show_file(os.path.join(INSTALL_PATH, filename))
+
+    def show_file(self, filename, idle=None):
         curses.curs_set(CURSOR_INVISIBLE)
         try:
-            fd = open(os.path.join(INSTALL_PATH, filename), 'r')
-        except:
+            viewer = FileViewer(filename)
+        except OSError:
             self.bell()
-            self.popup_error("Can't find file \"%s\"" % filename)
-
+            self.popup_error("Can't find file \"%s\"" % os.path.basename(filename))
+            curses.curs_set(CURSOR_NORMAL)
             return
-        data = fd.readlines()
-        fd.close()
         self.show_help_status()
-        self.show_data(data)
+        wy,wx = self.screen.getmaxyx()
+        win = curses.newwin(wy, wx, self.Y0, self.X0)
+        win.attrset(curses.color_pair(1))
+        viewer.run(win, idle)
         self.show_status_line()
+        self.screen.touchwin()
+        self.screen.refresh()
         curses.curs_set(CURSOR_NORMAL)
-        # self.cur.box()
-        # self.cur.refresh()
-        # self.screen.refresh()
-        # self.status.refresh()
 
-    def show_data(self,data):
-        wy,wx=self.screen.getmaxyx()
+    # Work through everything that arrived on every session's port.  The
+    # log viewer calls this too so sessions keep running underneath it.
+    def service_sessions(self):
+        busy = False
+        for term in self.sessions:
+            term.send_typed(term.sio)
+            if term.sio_fill(term.sio):
+                busy = True
+                if term.firstChar:
+                    term.clear_display(reset=True)
+                    term.firstChar = False
+            editing = term.editOrigin is not None and term.rxpos < len(term.rxbuf)
+            if editing:
+                term.line_edit_hide()   # the host draws where it left the cursor
+            predicted = bool(term.predictions)
+            if predicted:
+                y, x = term.predictions[0][:2]
+                term.screen.move(y, x)  # the host's cursor, not the one we show
+            if term.process_buffered(term.sio, RX_SLICE) >= RX_SLICE:
+                busy = True     # more waiting, come straight back for it
+            if editing:
+                term.line_edit_draw()
+            if term.predictions:
+                y, x, c, under, t = term.predictions[-1]
+                if time.perf_counter() - term.predictions[0][4] > PREDICT_TIMEOUT:
+                    term.predict_undo(quiet=True)   # not echoed, a password perhaps
+                else:
+                    term.screen.move(y, x + 1)
+            elif predicted:
+                term.screen.refresh()
+            term.flow_check(term.sio)
+
+            if term.script and not term.script.step(term.sio):
+                term.script_echo(term.script.message)
+                term.script = None
+        if self.sessions[0].mirror:
+            self.sessions[0].mirror.tick()
+        return busy
+
+    def show_intro(self, scn):
+        helptext = """
+          Welcome to:
+
+           _   _  _   ___   _          
+          | | | |/ | / _ \ | |_  ___  _ __  _ __ ___  
+          | |_| || || (_) || __|/ _ \| '__|| '_ ` _ \ 
+          |  _  || | \__, || |_|  __/| |   | | | | | |
+          |_| |_||_|   /_/  \__|\___||_|   |_| |_| |_|     """
 
-        if type(data) == str:
-            data = data.split('\n')
 
-        pady = max(len(data)+1,wy)
-        padx = wx
 
-        max_x = wx
-        max_y = pady-wy
+        self.clear_display()
+        scn.addstr(2, 2, helptext)
+        scn.addstr(12,27, VERSION)
+        scn.addstr(13,27, VERSION_DATE)
+        scn.addstr(14,27,"By George Farris - farrisg@gmsys.com")
+        scn.addstr(18,10, "A Heathkit H19 Terminal emulator for Linux...")
+        scn.addstr(20,10, "Press CTRL-A Z for help on special keys...")
+        scn.refresh()
 
-        pad = curses.newpad(pady,padx)
 
-        for i,line in enumerate(data):
-            pad.addstr(i,0,str(line))
+    def show_recording(self):
+        if self.headless:
+            return
+        y,x = self.screen.getyx()
+        if self.recorder:
+            self.status.addstr(2, 72, "[ REC ]", curses.A_BOLD)
+        else:
+            self.status.hline(2, 72, curses.ACS_HLINE, 7)
+        self.screen.move(y,x)
+        self.status.refresh()
 
-        x=0
-        y=0
+    # Recordings go next to the log file unless we are given a name
+    def start_recording(self, filename=None):
+        if filename is None:
+            name = time.strftime('h19term-%Y%m%d-%H%M%S')
+            if self.number > 1:
+                name += '-%d' % self.number
+            filename = os.path.join(os.path.dirname(LOG_FILE), name + '.h19rec')
+        try:
+            self.recorder = SessionRecorder(filename)
+        except OSError:
+            if self.headless:
+                raise
+            self.bell()
+            self.popup_error("Can't open %s for writing" % os.path.basename(filename))
+            return
+        self.show_recording()
 
-        inkey=0
-        self.screen.nodelay(0)
-        while inkey != 'q':
-            pad.refresh(y,x,self.X0,self.Y0,wy-1,wx)
-            inkey = self.screen.getkey()
+    def stop_recording(self):
+        if self.recorder:
+            self.recorder.close()
+            self.recorder = None
+            self.show_recording()
 
-            if inkey=='KEY_UP':y=max(y-1,0)
-            elif inkey=='KEY_DOWN':y=min(y+1,max_y)
-            elif inkey=='KEY_LEFT':x=max(x-1,0)
-            elif inkey=='KEY_RIGHT':x=min(x+1,max_x)
-            elif inkey=='KEY_NPAGE':y=min(y+wy,max_y)
-            elif inkey=='KEY_PPAGE':y=max(y-wy,0)
-            elif inkey=='KEY_HOME':y=0
-            elif inkey=='KEY_END':y=max_y
+    # Tracing swaps traced_char() in for process_char() so it costs nothing
+    # until it is turned on
+    def start_trace(self, filename, ops=TRACE_OPS):
+        try:
+            self.trace = TraceWriter(filename, ops)
+        except OSError:
+            if self.headless:
+                raise
+            self.bell()
+            self.popup_error("Can't open %s for writing" % os.path.basename(filename))
+            return
+        self.process_char = self.traced_char
+
+    def stop_trace(self):
+        if self.trace:
+            del self.process_char
+            self.trace.close()
+            self.trace = None
+
+    def traced_char(self, sc, sio):
+        if 31 < ord(sc) < 127 or sc == TAB:
+            y, x = self.screen.getyx()
+            self.trace.text(sc, y, x)
+            H19Term.process_char(self, sc, sio)
+            return
+        start = self.rxpos
+        ansi = self.ansiMode
+        self.traceSent = ''
+        H19Term.process_char(self, sc, sio)
+        sent, self.traceSent = self.traceSent, None
+        y, x = self.screen.getyx()
+        if sc == ESC:
+            seq = sc + ''.join(chr(b & 0x7F) for b in self.rxbuf[start:self.rxpos])
+            if ansi:
+                op = TRACE_ANSI.get(seq[-1], 'other')
+            else:
+                op = TRACE_HEATH.get(seq[1:2], 'other')
+        elif sc in TRACE_CONTROLS:
+            seq = sc
+            op = TRACE_CONTROLS[sc]
+        else:
+            return
+        fields = {'seq': seq, 'y': y, 'x': x}
+        if sent:
+            op = 'report'
+            fields['sent'] = sent
+        self.trace.op(op, fields)
+
+    def show_hold(self):
+        if self.headless:
+            return
+        y,x = self.screen.getyx()
+        if self.held:
+            self.status.addstr(2, 52, "[ HOLD ]", curses.A_BOLD)
+        else:
+            self.status.hline(2, 52, curses.ACS_HLINE, 8)
+        self.screen.move(y,x)
+        self.status.refresh()
 
-        curses.flushinp()
-        pad.clear()
-        self.screen.nodelay(1)
-        self.screen.touchwin()
-        self.screen.refresh()
+    # Stop the host while we are behind or the screen is held, start it
+    # again once we have caught up
+    def flow_check(self, sio):
+        if FLOW_CONTROL == 'none':
+            return
+        backlog = len(self.rxbuf) - self.rxpos
+        if not self.flowStopped and (self.held or backlog > FLOW_HIGH):
+            self.flow_stop(sio, True)
+        elif self.flowStopped and not self.held and backlog < FLOW_LOW:
+            self.flow_stop(sio, False)
+
+    def flow_stop(self, sio, stop):
+        self.flowStopped = stop
+        if FLOW_CONTROL == 'rtscts':
+            sio.rts = not stop
+        else:
+            sio.write(XOFF if stop else XON)
+            self.stats.bytesOut += 1
+            if self.recorder:
+                self.recorder.record(SENT, XOFF if stop else XON)
+        if stop:
+            self.stats.xoffSent += 1
+        else:
+            self.stats.xonSent += 1
 
+    def show_line_edit(self):
+        if self.headless:
+            return
+        y,x = self.screen.getyx()
+        if self.lineEdit:
+            self.status.addstr(2, 42, "[ EDIT ]", curses.A_BOLD)
+        else:
+            self.status.hline(2, 42, curses.ACS_HLINE, 8)
+        self.screen.move(y,x)
+        self.status.refresh()
 
-    def getmax(self,lines):
-        return max([len(str(l)) for l in lines])
+    def toggle_line_edit(self):
+        if self.lineEdit:
+            self.line_edit_hide()
+            self.lineEdit = None
+        else:
+            self.lineEdit = LineEditor(HISTORY_FILE)
+        self.show_line_edit()
+
+    # Draw the line being edited over the screen at the cursor, keeping
+    # what was there so line_edit_hide() can put it back
+    def line_edit_draw(self):
+        text, cursor = self.lineEdit.display()
+        if not text:
+            self.line_edit_hide()
+            return
+        if self.editOrigin is None:
+            y, x = self.screen.getyx()
+            self.editOrigin = (y, x)
+            self.editUnder = [self.screen.inch(y, i) for i in range(x, 80)]
+            self.lineEdit.width = 79 - x
+        y, x = self.editOrigin
+        for i, under in enumerate(self.editUnder):
+            self.put_cell(y, x + i, ord(text[i]) if i < len(text) else under)
+        self.screen.move(y, min(x + cursor, 79))
+        self.screen.refresh()
 
-    def show_intro(self, scn):
-        helptext = """
-          Welcome to:
+    def line_edit_hide(self):
+        if self.editOrigin is None:
+            return
+        y, x = self.editOrigin
+        for i, under in enumerate(self.editUnder):
+            self.put_cell(y, x + i, under)
+        self.screen.move(y, x)
+        self.editOrigin = None
+        self.editUnder = []
+
+    # The last column takes insch() so the screen doesn't scroll
+    def put_cell(self, y, x, cell):
+        if x == 79:
+            self.screen.insch(y, x, cell)
+        else:
+            self.screen.addch(y, x, cell)
 
-           _   _  _   ___   _          
-          | | | |/ | / _ \ | |_  ___  _ __  _ __ ___  
-          | |_| || || (_) || __|/ _ \| '__|| '_ ` _ \ 
-          |  _  || | \__, || |_|  __/| |   | | | | | |
-          |_| |_||_|   /_/  \__|\___||_|   |_| |_| |_|     """
+    def show_predicting(self):
+        if self.headless:
+            return
+        y,x = self.screen.getyx()
+        if self.predicting:
+            self.status.addstr(2, 32, "[ ECHO ]", curses.A_BOLD)
+        else:
+            self.status.hline(2, 32, curses.ACS_HLINE, 8)
+        self.screen.move(y,x)
+        self.status.refresh()
 
+    def toggle_predicting(self):
+        self.predict_undo()
+        self.predicting = not self.predicting
+        self.show_predicting()
+
+    # Draw a typed character where the host's echo should put it, underlined
+    # until the echo comes back.  Not while the host is drawing a full
+    # screen program or after a guess went wrong.
+    def predict(self, c):
+        now = time.perf_counter()
+        if now < self.predictQuiet or self.held:
+            return
+        if self.predictions:
+            y, x = self.predictions[-1][0], self.predictions[-1][1] + 1
+        else:
+            y, x = self.screen.getyx()
+        if x >= 79 or self.editOrigin is not None:
+            return
+        self.predictions.append([y, x, c, self.screen.inch(y, x), now])
+        self.put_cell(y, x, ord(c) | curses.A_UNDERLINE)
+        self.screen.refresh()
 
+    # Take the guesses off the screen, the host's cursor is where the first was
+    def predict_undo(self, quiet=False):
+        if self.predictions:
+            for y, x, c, under, t in reversed(self.predictions):
+                self.put_cell(y, x, under)
+            self.screen.move(self.predictions[0][0], self.predictions[0][1])
+            self.predictions = []
+        if quiet:
+            self.predictQuiet = time.perf_counter() + PREDICT_QUIET
+
+    # Called with each byte from the host before it is drawn.  The echo we
+    # expected takes the guess off so the real one goes in its place.
+    def predict_check(self, b):
+        y, x, c, under, t = self.predictions[0]
+        if b & 0x7F == ord(c):
+            self.predictions.pop(0)
+            self.put_cell(y, x, under)
+            self.screen.move(y, x)
+        else:
+            self.predict_undo(quiet=True)
 
-        self.clear_display()
-        scn.addstr(2, 2, helptext)
-        scn.addstr(12,27, VERSION)
-        scn.addstr(13,27, VERSION_DATE)
-        scn.addstr(14,27,"By George Farris - farrisg@gmsys.com")
-        scn.addstr(18,10, "A Heathkit H19 Terminal emulator for Linux...")
-        scn.addstr(20,10, "Press CTRL-A Z for help on special keys...")
-        scn.refresh()
+    def show_profiling(self):
+        if self.headless:
+            return
+        y,x = self.screen.getyx()
+        if self.sessions[0].profiler:
+            self.status.addstr(2, 62, "[ PROF ]", curses.A_BOLD)
+        else:
+            self.status.hline(2, 62, curses.ACS_HLINE, 8)
+        self.screen.move(y,x)
+        self.status.refresh()
 
+    # Profile the whole process, every session runs in the one loop
+    def toggle_profiler(self):
+        first = self.sessions[0]
+        if first.profiler:
+            try:
+                self.stop_profiler()
+            except OSError as e:
+                self.bell()
+                self.popup_error("Can't write the profile: %s" % e.strerror)
+        else:
+            import cProfile
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:      # python -m cProfile is already running
+                self.bell()
+                self.popup_error("Another profiler is already running")
+                return
+            first.profiler = profiler
+        for term in self.sessions:
+            term.show_profiling()
+
+    # Profiles go next to the log file, a .prof for pstats and snakeviz
+    # and a .txt of the busiest functions.  Returns the name without the
+    # extension.
+    def stop_profiler(self):
+        first = self.sessions[0]
+        if not first.profiler:
+            return None
+        profiler = first.profiler
+        profiler.disable()
+        first.profiler = None
+        name = time.strftime('h19term-%Y%m%d-%H%M%S')
+        base = os.path.join(os.path.dirname(LOG_FILE), name)
+        profiler.dump_stats(base + '.prof')
+        import pstats
+        with open(base + '.txt', 'w') as fd:
+            stats = pstats.Stats(profiler, stream=fd)
+            stats.sort_stats('cumulative').print_stats(40)
+            stats.sort_stats('tottime').print_stats(40)
+        return base
 
     def show_help_status(self):
         self.status.hline(0, 0, curses.ACS_HLINE, 79)
@@ -2121,6 +7277,18 @@ class H19Term(H19Keys, H19Screen):
         self.status.clrtoeol()
         self.status.addstr(1, 0, "Usable keys: ", curses.A_BOLD)
         self.status.addstr(1, 13, "UP - DOWN - PAGE-UP - PAGE-DOWN - HOME - END - 'q' to quit")
+        self.status.move(3,0)
+        self.status.clrtoeol()
+        self.status.addstr(3, 0, "/ ", curses.A_BOLD)
+        self.status.addstr("search  ")
+        self.status.addstr("n ", curses.A_BOLD)
+        self.status.addstr("next  ")
+        self.status.addstr("g ", curses.A_BOLD)
+        self.status.addstr("go to offset, n% or :line  ")
+        self.status.addstr("f ", curses.A_BOLD)
+        self.status.addstr("follow  ")
+        self.status.addstr("LEFT RIGHT ", curses.A_BOLD)
+        self.status.addstr("scroll")
         self.status.refresh()
 
 
@@ -2135,7 +7303,7 @@ class H19Term(H19Keys, H19Screen):
         if self.offline:
             self.status.addstr(1, 6, "Offline      ")
         else:
-            self.status.addstr(1, 6, SERIAL_PORT)
+            self.status.addstr(1, 6, self.port_label(self.sio.port if self.sio else SERIAL_PORT, 13))
         self.status.addstr(1, 20, "|")
         self.status.addstr(" B", curses.A_BOLD)
         self.status.addstr(1,23, str(BAUD_RATE))
@@ -2150,7 +7318,12 @@ class H19Term(H19Keys, H19Screen):
         self.status.addstr("HELP")
         self.status.addstr(1, 69, "| ")
         self.status.addstr("LOG: ", curses.A_BOLD)
-        self.status.addstr(1, 76, "off")
+        self.status.addstr(1, 76, "On " if self.logio else "off")
+        if len(self.sessions) > 1:
+            self.status.addstr(0, 2, "[ Session %d of %d ]" % (self.number, len(self.sessions)),
+                               curses.A_BOLD)
+        self.show_recording()
+        self.show_profiling()
 
         # F keys
         self.status.addstr(3, 0, "F1-F5 = F1-F5")
@@ -2183,22 +7356,25 @@ class H19Term(H19Keys, H19Screen):
             if self.wrapAtEndOfLine:
                 if x == 79:
                     self.screen.insstr(self.h19_graphics[cn - 94])
-                    self.screen.move(y+1, 0)
+                    self.screen.move(y, 0)
+                    self.linefeed()     # scrolls at the bottom, not on the 25th line
                 else:
                     self.screen.addstr(self.h19_graphics[cn - 94])
             else:
                 if x == 79:
                     self.screen.insstr(self.h19_graphics[cn - 94])
                 else:
-                   if self.insertMode:
+                   if self.insertMode:     # insstr leaves the cursor where it was
                        self.screen.insstr(self.h19_graphics[cn - 94])
+                       self.screen.move(y, x+1)
                    else:
                        self.screen.addstr(self.h19_graphics[cn - 94])
         else:
             if self.wrapAtEndOfLine:
                 if x == 79:
                     self.screen.insstr(ch)
-                    self.screen.move(y+1, 0)
+                    self.screen.move(y, 0)
+                    self.linefeed()
                 else:
                     self.screen.addch(ch)
             else:   # discard at end of line
@@ -2207,29 +7383,22 @@ class H19Term(H19Keys, H19Screen):
                 else:
                     if self.insertMode:
                         self.screen.insch(ch)
+                        self.screen.move(y, x+1)
                     else:
                         self.screen.addch(ch)
 
-    def check_command_history(self, ch):
-        history = ['','era a:help.txt', 'dir', 'pip a:g.com=c:h.com', 'ren help.txt=doit.txt']
-        y,x = self.screen.getyx()
-        self.screen.move(y,x)
-        self.screen.clrtoeol()
-
-        if ch == curses.KEY_SR:
-            self.idx += 1
-            self.screen.move(y,x-self.mycp)
-            self.screen.clrtoeol()
-            self.screen.addstr("%s" % (history[self.idx]))
-            self.mycp = len(history[self.idx])
-        elif ch == curses.KEY_SF:
-            self.idx -= 1
-            self.screen.move(y,x-self.mycp)
-            self.screen.clrtoeol()
-            self.screen.addstr("%s" % (history[self.idx]))
-            self.mycp = len(history[self.idx])
-
     def process_key(self, c, sio, scr, scn, st):
+        if self.lineEdit and c not in (1, 28):    # CTRL-A and CTRL-\ are still ours
+            text = self.lineEdit.key(c)
+            if text:        # Enter, the whole line goes at once
+                self.line_edit_hide()
+                for ch in text:
+                    self.key_write(sio, ch, echoed=ch != '\r')
+                return
+            elif text == '':
+                self.line_edit_draw()
+                return
+
         if c in self.fnkeys:
             if c == OFFLINE_FKEY:
                 if self.offline:
@@ -2246,62 +7415,205 @@ class H19Term(H19Keys, H19Screen):
                 else:
                     self.enter_keypad_shifted_mode()
             else:
-                self.sio_write(sio, ESC)
+                self.key_write(sio, ESC)
                 if self.ansiMode:
-                    self.sio_write(sio, 'O')
-                self.sio_write(sio, self.fnkeys[c])
+                    self.key_write(sio, 'O')
+                self.key_write(sio, self.fnkeys[c])
             return
 
         elif c in self.numkeys:
             if self.keypadShiftedMode:
                 if self.ansiMode:
-                    self.sio_write(sio, self.numkeys[c][ASHIFT])
+                    self.key_write(sio, self.numkeys[c][ASHIFT])
                 else:
-                    self.sio_write(sio, self.numkeys[c][SHIFT])
+                    self.key_write(sio, self.numkeys[c][SHIFT])
                 return
             elif self.keypadAlternateMode and not self.keypadShiftedMode:
                 if self.ansiMode:
-                    self.sio_write(sio, self.numkeys[c][A_ALT])
+                    self.key_write(sio, self.numkeys[c][A_ALT])
                 else:
-                    self.sio_write(sio, self.numkeys[c][H_ALT])
+                    self.key_write(sio, self.numkeys[c][H_ALT])
                 return
-
-            # elif self.commandHistory:
-            #     self.check_command_history(c)
             else:
-                self.sio_write(sio, self.numkeys[c][NORM])
+                self.key_write(sio, self.numkeys[c][NORM])
+
+        elif c == curses.KEY_SF:        # SHIFT-DOWN is the SCROLL key
+            self.scroll_key()
+        elif c == curses.KEY_SNEXT:     # and SHIFT-PAGE DOWN SHIFT-SCROLL
+            self.scroll_key(page=True)
 
         elif c == self.BACKSPACE:
-            bsc = self.backspace(sio, KEY)  # PIE editor will send ESC
-            if bsc == ESC:                  # seq after BS
-                self.process_escape_seq(sio)
+            if self.screen.getyx()[1] > 0 or self.txbuf or self.predictions:
+                self.backspaceWait.append(time.perf_counter())
+                self.key_write(sio, chr(8), echoed=True)
 
-        elif curses.keyname(c) == '^\\':  # History key
-            pass
-            #self.commandHistory = True
+        elif curses.keyname(c) == b'^\\':     # Line editing key
+            self.toggle_line_edit()
 
         elif curses.keyname(c) == b'^A':  # Command Key
             self.parse_ctrl_a(sio, scr, scn, st)
 
         else:
             if c <= 255:
-                self.sio_write(sio, chr(c))
+                self.key_write(sio, chr(c), echoed=31 < c < 127)
             else:
                 self.bell()
 #                self.popup_error("For SHIFT ARROW keys, press F9, see help.")
 
-    def xmodem_send(self,sio):
-        SOH = b'\x01'
-        EOT = b'\x04'
-        ACK = b'\x06'
-        NAK = b'\x15'
-
-        ser = serial.Serial(XMODEM_PORT, timeout=0)  # or whatever port you need
+    def xmodem_open(self, port=None):
+        port = port or XMODEM_PORT
+        server = self.driveServer
+        if server and port == server.port:
+            server.pause()
+        try:
+            ser = self.open_transport(port, XMODEM_RATE, False)
+        except (OSError, ValueError):
+            if server and port == server.port:
+                server.resume()
+            raise
         ser.baudrate = XMODEM_RATE
         ser.xonoff = False
         ser.rtscts = False
         ser.dsrdtr = False
+        return ser
+
+    # Close an XMODEM port, the drive server gets it back
+    def xmodem_close(self, ser):
+        ser.close()
+        server = self.driveServer
+        if server and getattr(ser, 'port', None) == server.port:
+            server.resume()
+
+    def start_drive_server(self, spec):
+        self.driveServer = DriveServer(XMODEM_PORT, CpmMachine.open_drives(spec),
+                                       lambda: self.open_transport(XMODEM_PORT, XMODEM_RATE, False))
+        self.driveServer.start()
+
+    # Type the RX command on the H8 so it is waiting for the transfer
+    def xmodem_autorun(self, sio, filename):
+        for c in "RX -n ":
+            self.sio_write(sio, c)
+        for c in os.path.basename(filename):
+            self.sio_write(sio, c)
+        self.sio_write(sio, '\r')
+
+    # Ask the receiver to move both ends of the link to rate.  Returns True
+    # if the test pattern came back at the new rate, False if it didn't and
+    # we are back where we started, None if the receiver never answered.
+    def xmodem_try_rate(self, ser, rate):
+        old = ser.baudrate
+        ser.reset_input_buffer()
+        ser.write(('\x1br' + chr(65 + H19_RATES.index(rate))).encode())
+        ser.flush()
+        deadline = time.time() + BOOST_TIMEOUT
+        while True:     # a NAK asking for the first block may get here first
+            ser.timeout = max(deadline - time.time(), 0.01)
+            c = ser.read(1)
+            if c == ACK:
+                break
+            if c == b'' or time.time() > deadline:
+                return None
+        ser.baudrate = rate
+        ser.timeout = BOOST_TIMEOUT
+        ser.write(BOOST_PATTERN)
+        ser.flush()
+        if ser.read(len(BOOST_PATTERN)) == BOOST_PATTERN:
+            return True
+        ser.baudrate = old
+        time.sleep(BOOST_TIMEOUT)   # until the receiver gives up and goes back
+        ser.reset_input_buffer()
+        return False
+
+    # Try the rates between where we are and XMODEM_BOOST, fastest first,
+    # returns the rate the link ends up at
+    def xmodem_boost(self, ser):
+        for rate in reversed([r for r in H19_RATES if ser.baudrate < r <= XMODEM_BOOST]):
+            ok = self.xmodem_try_rate(ser, rate)
+            if ok or ok is None:    # there, or the receiver can't do it
+                break
+        return ser.baudrate
+
+    # Tell the receiver we are giving up, returns False for xmodem_transfer
+    def xmodem_cancel(self, ser):
+        ser.write(CAN + CAN)
+        ser.flush()
+        return False
+
+    # Send an open file, progress is called with the percentage done after
+    # each block and retry for each block the receiver NAKs.  Returns True
+    # if the receiver accepted the whole file, False if it stopped answering
+    # or NAKed one block XMODEM_RETRIES times.
+    def xmodem_transfer(self, ser, file, progress_cb=None, retry_cb=None):
+        filesize = max(os.fstat(file.fileno()).st_size, 1)
+        progress_chunk_size = 100 / max(filesize/128, 1)
+
+        t = 0
+        ser.timeout = 1
+        while True:
+            c = ser.read(1)
+            if c != NAK:
+                t += 1
+                if t == 60:
+                    return False
+            else:
+                break
+
+        base = ser.baudrate
+        if XMODEM_BOOST > base and isinstance(ser, serial.Serial):
+            self.xmodem_boost(ser)
+            ser.timeout = 1
+
+        p = 1
+        s = file.read(128)
+
+        progress = 0
+        while s:
+            progress += progress_chunk_size
+            if len(s) < 128:
+                s = s.ljust(128, b'\x1a')
+            chk = 0
+            for c in s:
+                chk += c
+            naks = 0
+            retries = 0
+            while 1:
+                ser.write(SOH)  # send SOH
+                ser.write(bytes([p]))  # send packet number
+                ser.write(bytes([0xFF - p]))  # send invert of packet number
+                ser.write(s)
+                ser.write(bytes([chk % 256]))  # send checksum
+                ser.flush()
+                answer = ser.read(1)
+                if answer == NAK:
+                    naks += 1
+                    retries += 1
+                    if retry_cb:
+                        retry_cb()
+                    if retries >= XMODEM_RETRIES:
+                        return self.xmodem_cancel(ser)
+                    if naks >= BOOST_ERRORS and ser.baudrate > base:
+                        # too fast for the cable after all, one step down.  If
+                        # even that can't be agreed the line is too far gone.
+                        if not self.xmodem_try_rate(ser, H19_RATES[H19_RATES.index(ser.baudrate) - 1]):
+                            return self.xmodem_cancel(ser)
+                        ser.timeout = 1
+                        naks = 0
+                    continue
+                if answer == ACK:
+                    break
+                return False
+            if progress_cb:
+                progress_cb(min(int(progress), 100))
 
+            s = file.read(128)
+            p = (p + 1) % 256
+
+        ser.write(EOT)
+        ser.flush()
+        ser.baudrate = base     # the receiver goes back by itself when it is done
+        return True
+
+    def xmodem_send(self,sio):
         filename, popup = self.popup_filename()
         if filename == None:
             self.screen.touchwin()
@@ -2322,26 +7634,20 @@ class H19Term(H19Keys, H19Screen):
         if AUTORUN_MODE == 'USER':
             resp = chr(self.popup_autorun('USER'))
             if resp == 'A' or resp == 'a':
-                for c in "RX -n ":
-                    self.sio_write(sio, c)
-                for c in os.path.basename(filename):
-                    self.sio_write(sio, c)
-                self.sio_write(sio, '\r')
+                self.xmodem_autorun(sio, filename)
             elif resp != '\r':
                 return False  # implies Q
         elif AUTORUN_MODE == 'AUTO':
-            for c in "RX -n ":
-                self.sio_write(sio, c)
-            for c in os.path.basename(filename):
-                self.sio_write(sio, c)
-            self.sio_write(sio, '\r')
+            self.xmodem_autorun(sio, filename)
         else:  # end up here with option ANY
             resp = chr(self.popup_autorun('ANY'))
 
-        filesize = os.path.getsize(filename)
-        progress_chunk_size = 100 / (filesize/128)
+        try:
+            ser = self.xmodem_open()
+        except (OSError, ValueError):
+            self.popup_error("Can't open %s" % XMODEM_PORT)
+            return False
 
-        t, anim = 0, '|/-\\'
         curses.curs_set(CURSOR_INVISIBLE)
 
         self.background_clear()
@@ -2352,48 +7658,20 @@ class H19Term(H19Keys, H19Screen):
         popup.addstr(2, 2, "Waiting for ACK...")
         popup.refresh()
 
-        ser.timeout = 1
-        while True:
-            c = ser.read(1)
-            if c != NAK:
-                t += 1
-                if t == 60:
-                    return
-            else:
-                break
-
-        popup.addstr(2,2, "Complete: %0            ")
-        p = 1
-        s = file.read(128)
-
-        progress = 0
-        while s:
-            progress += progress_chunk_size
-            if len(s) < 128:
-                s = s.ljust(128, b'\x1a')
-            chk = 0
-            for c in s:
-                chk += c
-            while 1:
-                ser.write(SOH)  # send SOH
-                ser.write(bytes([p]))  # send packet number
-                ser.write(bytes([0xFF - p]))  # send invert of packet number
-                ser.write(s)
-                ser.write(bytes([chk % 256]))  # send checksum
-                ser.flush()
-                answer = ser.read(1)
-                if answer == NAK:
-                    continue
-                if answer == ACK:
-                    break
-                return
-            popup.addstr(2, 13, str(int(progress)))
+        def progress(percent):
+            popup.addstr(2, 2, "Complete: %            ")
+            popup.addstr(2, 13, str(percent))
             popup.refresh()
 
-            s = file.read(128)
-            p = (p + 1) % 256
+        ok = self.xmodem_transfer(ser, file, progress)
+        file.close()
+        self.xmodem_close(ser)
+        if not ok:
+            curses.curs_set(CURSOR_NORMAL)
+            self.screen.touchwin()
+            self.screen.refresh()
+            return False
 
-        ser.write(EOT)
         popup.addstr(2, 13, "100")
         popup.addstr(2, 20, "Transfer complete, press CR")
         popup.refresh()
@@ -2404,14 +7682,244 @@ class H19Term(H19Keys, H19Screen):
         popup = None
         return True
 
+    def fanout_ports(self):
+        return [p.strip() for p in FANOUT_PORTS.split(',') if p.strip()]
+
+    # Send one file to every fan-out port at once.  With autorun the RX
+    # command for each port is typed on the session in the same place in
+    # the list, the first port's on session 1 and so on.
+    def xmodem_fanout(self, sio):
+        ports = self.fanout_ports()
+        if not ports:
+            self.popup_error("No fan-out ports, set FanoutPorts")
+            return False
+        filename, popup = self.popup_filename()
+        if filename == None:
+            self.screen.touchwin()
+            self.screen.refresh()
+            return False
+
+        try:
+            fanout = FanoutSend(self, filename, ports)
+        except OSError:
+            self.popup_error("Can't read %s" % os.path.basename(filename))
+            return False
+
+        autorun = AUTORUN_MODE == 'AUTO'
+        if AUTORUN_MODE != 'AUTO':
+            resp = chr(self.popup_autorun(AUTORUN_MODE if AUTORUN_MODE == 'USER' else 'ANY'))
+            if resp in 'Aa' and AUTORUN_MODE == 'USER':
+                autorun = True
+            elif resp != '\r':
+                fanout.close()
+                return False
+        if autorun:
+            for session in self.sessions[:len(ports)]:
+                session.xmodem_autorun(session.sio, filename)
+
+        curses.curs_set(CURSOR_INVISIBLE)
+        self.background_clear()
+        popup = curses.newwin(len(fanout.targets) + 6, 70, 5, 5)
+        popup.attrset(curses.color_pair(0))
+        popup.nodelay(1)
+        fanout.start()
+        while True:
+            running = fanout.running()
+            popup.erase()
+            popup.border('|', '|', '-', '-', '+', '+', '+', '+')
+            popup.addstr(0, 22, "Fan-out Transfer Progress")
+            popup.addstr(1, 2, os.path.basename(filename)[:64], curses.A_BOLD)
+            for y, line in enumerate(fanout.summary()):
+                popup.addstr(y + 3, 2, line)
+            if not running:
+                break
+            popup.refresh()
+            self.service_sessions()
+            popup.touchwin()
+            time.sleep(FANOUT_TICK)
+        fanout.wait()
+
+        done = len(fanout.targets) - len(fanout.failed())
+        popup.addstr(len(fanout.targets) + 4, 2, "%d of %d sent, press CR" % (done, len(fanout.targets)))
+        popup.nodelay(0)
+        popup.refresh()
+        popup.getch()
+        curses.curs_set(CURSOR_NORMAL)
+        self.screen.touchwin()
+        self.screen.refresh()
+        return not fanout.failed()
+
+    # The auto date settings are triggers that only look at the first
+    # screens after a boot, resets with CTRL-A R
+    def get_triggers(self):
+        triggers = list(TRIGGERS)
+        if AUTO_CPM_DATE:
+            triggers.append({'name': 'CpmDate', 'match': CPM_DATE_FORMAT,
+                             'send': '{date:%m/%d/%y}\n', 'regex': False, 'bootonly': True})
+            triggers.append({'name': 'CpmTime', 'match': CPM_TIME_FORMAT,
+                             'send': '{date:%H:%M:%S}\n', 'regex': False, 'bootonly': True})
+        if AUTO_HDOS_DATE:
+            triggers.append({'name': 'HdosDate', 'match': HDOS_DATE_FORMAT,
+                             'send': '{date:%d-%b-%y}\n', 'regex': True, 'bootonly': True})
+        return [t for t in triggers if t['match']]
+
+    # A trigger with a bad pattern is left out, the rest still work
+    def setup_responder(self):
+        triggers = []
+        for t in self.get_triggers():
+            if t['regex']:
+                try:
+                    re.compile(t['match'])
+                except re.error as e:
+                    message = "Bad pattern in trigger %s: %s" % (t['name'], e)
+                    if self.headless:
+                        print(message)
+                    else:
+                        self.popup_error(message)
+                    continue
+            triggers.append(t)
+        self.responder = Responder(triggers)
+
+    def process_char(self, sc, sio):
+        if 31 < ord(sc) < 127:  # not a control char just print it
+            self.addchar(sc, sio)
+        elif sc == TAB:     # past the last stop one column at a time, never off the line
+            y, x = self.screen.getyx()
+            self.screen.addstr(' ' * (8 - x % 8 if x < 72 else min(1, 79 - x)))
+        elif sc == CR:
+            self.carriage_return()
+        elif sc == LF:
+            self.linefeed()
+        elif sc == ESC:
+            self.process_escape_seq(sio)
+        elif sc == BS:
+            self.backspace()
+        elif sc == NUL:
+            pass
+        elif sc == BEL:
+            self.bell()
+        elif sc == DEL:
+            self.rubout()
+
+    # Run without curses, used for --headless replay.  Returns the number
+    # of bytes processed.
+    def setup_headless(self):
+        self.headless = True
+        self.screen = HeadlessWindow(25, 80)
+        self.status = HeadlessWindow(4, 80)
+        self.screen.scrollok(True)
+        self.screen.setscrreg(0, 23)
+        self.X0 = 0
+        self.Y0 = 0
+        self.bell_start_time = 0.0
+        self.BACKSPACE = curses.KEY_BACKSPACE
+        self.setup_responder()
+        self.reset()
+
+    def run_headless(self, sio):
+        count = 0
+        while True:
+            self.sio_fill(sio)
+            sc = self.sio_read(sio)     # waits for the next byte if none buffered
+            if sc == '':
+                return count
+            count += 1
+            self.process_char(sc, sio)
+
+    def script_echo(self, text):
+        if self.headless:
+            print(text)
+            return
+        y,x = self.screen.getyx()
+        self.status.hline(2, 2, curses.ACS_HLINE, 68)
+        self.status.addnstr(2, 2, "[ %s ]" % text, 68, curses.A_BOLD)
+        self.screen.move(y,x)
+        self.status.refresh()
+
+    # Start sending a file for a script.  The transfer runs on its own
+    # thread so every session keeps going, result gets True or False when
+    # it is over.
+    def script_xmodem(self, sio, filename, autorun, result):
+        file = open(filename, 'rb')
+        try:
+            ser = self.xmodem_open()
+        except:
+            file.close()
+            raise
+        if autorun:
+            self.xmodem_autorun(sio, filename)
+
+        def transfer():
+            try:
+                result.append(self.xmodem_transfer(ser, file))
+            except OSError:
+                result.append(False)
+            finally:
+                self.xmodem_close(ser)
+                file.close()
+
+        thread = threading.Thread(target=transfer, daemon=True)
+        thread.start()
+        return thread
+
+    def run_script(self, sio):
+        # Step the script and keep the session going, for --script --headless
+        while self.script.step(sio):
+            self.sio_fill(sio, timeout=max(self.script.wait_time(), 0.001))
+            self.process_buffered(sio)
+        return self.script.status
+
+    # Another session on its own port, sharing this process and its loop
+    def add_session(self, port):
+        other = H19Term()
+        other.sessions = self.sessions
+        other.number = len(self.sessions) + 1
+        root, ext = os.path.splitext(LOG_FILE)
+        other.logFile = '%s-%d%s' % (root, other.number, ext)
+        other.sio = other.open_port(port)
+        self.sessions.append(other)
+        return other
+
+    # Later sessions share the terminal the first one set up and start hidden
+    def setup_session(self, first):
+        self.cur = first.cur
+        self.X0 = first.X0
+        self.Y0 = first.Y0
+        self.bell_start_time = 0.0
+        self.BACKSPACE = first.BACKSPACE
+        self.predicting = PREDICT_ECHO
+        self.make_windows()
+        self.hide()
+        self.setup_responder()
+        self.reset()
+        if self.recordFile:
+            self.start_recording(self.recordFile)
+        self.show_status_line()
+        self.show_intro(self.screen)
+
+    def hide(self):
+        self.visible = False
+        self.screen = HiddenWindow(self.screen)
+        self.status = HiddenWindow(self.status)
+
+    def show(self):
+        self.visible = True
+        self.screen = self.screen.win
+        self.status = self.status.win
+        self.status.touchwin()
+        self.status.refresh()
+        self.screen.touchwin()
+        self.screen.refresh()
+        curses.curs_set(self.cursorMode)
+
     def main(self, scr, term, sio):
 
         scn, st = term.setup_screen()
+        self.startup_step('screen set up')
+        term.setup_responder()
         term.reset()
 
-        # Create a sine wave, with a pitch of 25, for use with the H19 BELL.
-        self.sinewave = SineWave(pitch=25)
-        self.bell_start_time = 0.0
+        self.bell_start_time = 0.0      # the bell's sine wave is made on first use
 
         # if curses.termname() == 'linux':
         self.BACKSPACE = curses.KEY_BACKSPACE
@@ -2419,118 +7927,351 @@ class H19Term(H19Keys, H19Screen):
         #    self.BACKSPACE = 127  # xterms do this
 
         self.offline = False
+        self.predicting = PREDICT_ECHO
+
+        self.firstChar = True
 
-        date_string = ''
-        first_char = True
-        today = datetime.datetime.today()
+        if self.recordFile:
+            self.start_recording(self.recordFile)
+        if self.traceFile:
+            self.start_trace(self.traceFile, self.traceOps)
+
+        term.sio = sio
+        for other in self.sessions[1:]:
+            other.setup_session(self)
 
         self.show_status_line()
         curses.curs_set(CURSOR_INVISIBLE)
         self.show_intro(scn)
         curses.curs_set(CURSOR_NORMAL)
+        if self.startupBench is not None:
+            self.startup_step('first frame')
+            return
+        self.probe_ports()      # ready for CTRL-A P
+        active = self
 
-        # command history is a work in process do not enable
-        self.commandHistory = False
-        self.idx = 0  # command history index
-        self.mycp = 0 # initial command length
-
-        lasttime = time.time()
-        lastchar = ''
-        charcount = 0  # char count before repeat rate kicks in
+        lastchar = NOCHAR
 
         # Loop here getting keys doing serial I/O
         loop_time = 0.0
 
         while True:
-            c = NOCHAR
-
             # reset bell after a second, don't ask it will be fixed.
             if time.time() - self.bell_start_time > 1.0:
                 self.bell_start_time = 0.0
-            # Make sure keys don't repeat too fast.
-            nowtime = time.time()
+
+            # Take every key waiting, a paste arrives all at once.  CTRL-A
+            # reads its command key itself so we stop there.
+            if scn.is_wintouched():
+                active.stats.refreshes += 1     # getch() refreshes scn
+            keys = []
             c = scn.getch()
-            if c != NOCHAR:
-                if c == lastchar:
-                    charcount += 1
-                else:
-                    charcount = 0
+            while c != NOCHAR:
+                keys.append(c)
+                if len(keys) >= KEY_DRAIN or curses.keyname(c) == b'^A':
+                    break
+                c = scn.getch()
 
-                if (nowtime - lasttime) < KEY_REPEAT_RATE and charcount > 20:
-                    lastchar = c
-                    c = NOCHAR
-                else:
-                    lastchar = c
-                    lasttime = nowtime
+            # A key on its own, the same as the last one, while earlier typing
+            # is still waiting to go out is the key repeating, drop it so it
+            # stops when the key comes up.
+            if len(keys) == 1 and keys[0] == lastchar and active.txbuf:
+                keys = []
+            if keys:
+                lastchar = keys[-1]
 
-            if c != NOCHAR:
+            for c in keys:
                 loop_time = 0.0
 
-                if first_char:
-                    term.clear_display(reset=True)
-                    first_char = False
+                if active.firstChar:
+                    active.clear_display(reset=True)
+                    active.firstChar = False
                     curses.curs_set(CURSOR_NORMAL)
 
-                self.process_key(c, sio, scr, scn, st)
+                active.process_key(c, active.sio, scr, scn, st)
 
-            sc = ''
-            sc = term.sio_read(sio, TIMEOUT=SIO_NO_WAIT)
-            if len(sc) >= 1:
-                loop_time = 0.0
-                if first_char:
-                    term.clear_display(reset=True)
-                    first_char = False
+                if active.switchTo:
+                    other = active.switchTo
+                    active.switchTo = None
+                    active.hide()
+                    active = other
+                    active.show()
+                    scn, st = active.screen, active.status
 
-                # Don't bother with this after a couple of screens, resets with CTRL-A R
-                if self.linesSinceBoot < 50:
-                    if sc == LF:
-                        date_string = ''
-                        self.linesSinceBoot += 1
-                    else:
-                        date_string += sc
-
-                    if AUTO_CPM_DATE:
-                        if date_string == CPM_DATE_FORMAT:
-                            ds = today.strftime('%m/%d/%y\n')
-                            term.sio_write(sio, ds)
-                        elif date_string == CPM_TIME_FORMAT:
-                            ts = today.strftime('%I/%M/%S\n')
-                            term.sio_write(sio, ts)
-
-                    if AUTO_HDOS_DATE:
-                        if re.search(HDOS_DATE_FORMAT, date_string):
-                            ds = today.strftime('%d-%b-%y\n')
-                            term.sio_write(sio, ds)
-
-                if 31 < ord(sc) < 127:  # not a control char just print it
-                    term.addchar(sc, sio)
-                elif sc == TAB:
-                    term.addchar(sc,sio)
-                elif sc == CR:
-                    term.carriage_return()
-                elif sc == LF:
-                    term.linefeed()
-                elif sc == ESC:
-                    term.process_escape_seq(sio)
-                    sc=""
-                elif sc == BS:
-                    term.backspace(sio, sc)
-                elif sc == NUL:
-                    pass
-                elif sc == BEL:
-                    term.bell()
-                elif sc == DEL:
-                    term.rubout()
+            # Work through everything that arrived since the last pass
+            start = time.perf_counter()
+            if self.service_sessions():
+                loop_time = 0.0
+            self.stats.loop_pass(time.perf_counter() - start)
 
-            if loop_time <= 0.1:
+            # Ports that can be waited on wake us as soon as anything arrives,
+            # the rest are polled with a growing sleep.
+            # Typing waiting on the rate limit cuts the sleep short.
+            if loop_time > 0.0 and self.sio_wait(self.typing_wait()):
+                pass
+            elif loop_time <= 0.1:
                 loop_time += 0.000001
             else:
-                time.sleep(loop_time)
+                time.sleep(min(loop_time, self.typing_wait()))
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Heathkit H19 terminal emulator')
+    parser.add_argument('--record', metavar='FILE',
+                        help='record the session to FILE for later replay')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='play back a session recorded with --record or CTRL-A W')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='write each escape sequence, control character and run of '
+                             'text from the host to FILE as JSON lines')
+    parser.add_argument('--trace-ops', metavar='OPS', default=','.join(TRACE_OPS),
+                        help='comma separated operations to --trace, out of %s' %
+                             ', '.join(TRACE_OPS))
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='replay speed multiplier, 0 replays as fast as possible')
+    parser.add_argument('--headless', action='store_true',
+                        help='replay without a display, print the final screen and throughput')
+    parser.add_argument('--script', metavar='FILE',
+                        help='run an expect style script, with --headless it runs unattended')
+    parser.add_argument('--port', metavar='PORT', action='append',
+                        help='use PORT instead of the configured one, a serial device, '
+                             'tcp://host:port, telnet://host:port, pty:command or '
+                             'cpm:DIR[,DIR...] for the built in CP/M machine.  Give it '
+                             'more than once for a session on each port')
+    parser.add_argument('--fake-host', metavar='ADDRESS', nargs='?', const='pty',
+                        help='pretend to be an H8 running CP/M for testing, on a pair of ptys '
+                             'or tcp://host:port')
+    parser.add_argument('--drive-server', metavar='DIR[,DIR...]',
+                        help='serve the directories as drives to a driver on the H8 over '
+                             'the XMODEM port, with --headless it does nothing else')
+    parser.add_argument('--fanout', metavar='FILE',
+                        help='send FILE by XMODEM to every fan-out port at once, RX must '
+                             'already be waiting on each machine, then exit')
+    parser.add_argument('--fanout-ports', metavar='PORT[,PORT...]',
+                        help='the ports --fanout sends to, instead of FanoutPorts')
+    parser.add_argument('--host-dir', metavar='DIR', default='.',
+                        help='directory the fake host uses as its disk')
+    parser.add_argument('--host-baud', type=int, default=0,
+                        help='fake host output speed, 0 is as fast as possible')
+    parser.add_argument('--nak-rate', type=float, default=0.0,
+                        help='chance the fake host RX NAKs a good block')
+    parser.add_argument('--ack-loss', type=float, default=0.0,
+                        help='chance the fake host RX does not ACK a good block')
+    parser.add_argument('--stats-socket', metavar='PATH',
+                        help='answer connections on the Unix socket PATH with the '
+                             'session statistics as JSON')
+    parser.add_argument('--render', metavar='FILE', nargs='+',
+                        help='write transcripts of recordings or raw captures, FILE.txt '
+                             'for each, and exit')
+    parser.add_argument('--render-mode', choices=TranscriptRenderer.MODES, default='final',
+                        help='final screen, scrollback and final screen, or every frame')
+    parser.add_argument('--html', action='store_true',
+                        help='write --render transcripts as HTML')
+    parser.add_argument('--out', metavar='DIR',
+                        help='directory for --render transcripts, beside each FILE if not given')
+    parser.add_argument('--jobs', type=int,
+                        help='captures rendered at once, one for each core if not given')
+    parser.add_argument('--mirror', metavar='PATH',
+                        help='serve the screens on the Unix socket PATH, send "watch" '
+                             'or "screen" and a session number')
+    parser.add_argument('--mirror-websocket', metavar='PORT', type=int,
+                        help='serve the screens to WebSocket clients on localhost PORT')
+    parser.add_argument('--probe', action='store_true',
+                        help='look for the H8 on every serial port, or the --port ones, '
+                             'report the baud rate that works and exit')
+    parser.add_argument('--startup-bench', action='store_true',
+                        help='start up as far as the first screen, then exit and '
+                             'report how long each step took')
+    parser.add_argument('--host-max-baud', type=int, default=0,
+                        help='fake host XMODEM speed boosts above this fail, 0 is no limit')
+    parser.add_argument('--view', metavar='FILE',
+                        help='open FILE, such as h19term.log, in the file viewer and exit')
+    args = parser.parse_args()
+    traceOps = [op.strip() for op in args.trace_ops.split(',') if op.strip()]
+    for op in traceOps:
+        if op not in TRACE_OPS:
+            parser.error("unknown --trace-ops operation %s, choose from %s" %
+                         (op, ', '.join(TRACE_OPS)))
+
+    if args.fake_host:
+        host = FakeHost(args.host_dir, args.host_baud, args.nak_rate, args.ack_loss,
+                        args.host_max_baud)
+        try:
+            if args.fake_host == 'pty':
+                print("Console port: %s\nXMODEM port:  %s" % host.open_ptys())
+            else:
+                print("Listening on %s:%d, console first then XMODEM" % host.listen(args.fake_host)[:2])
+        except (OSError, ValueError) as e:
+            print("Can't start the fake host: %s" % e)
+            sys.exit(1)
+        sys.stdout.flush()
+        try:
+            host.run()
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    if args.view:
+        try:
+            viewer = FileViewer(args.view)
+        except OSError as e:
+            print("Can't open %s: %s" % (args.view, e))
+            sys.exit(1)
+        def view(scr):
+            curses.curs_set(CURSOR_INVISIBLE)
+            viewer.run(scr)
+        curses.wrapper(view)
+        sys.exit(0)
+
+    if args.render:
+        renderer = TranscriptRenderer(args.render_mode, args.html, args.out, args.jobs)
+        failed = 0
+        for path, outname, error in renderer.run(args.render):
+            if error:
+                print("Can't render %s: %s" % (path, error))
+                failed += 1
+            else:
+                print("%s -> %s" % (path, outname))
+        sys.exit(1 if failed else 0)
+
     term = H19Term()
-    term.get_h19config()
-    sio = term.open_port()
+    if args.startup_bench:
+        term.startupBench = [('imports', term.uptime())]
+    if args.probe:
+        term.get_h19config()
+        try:
+            ports = [port for port, desc, hwid in term.serial_ports()]
+        except Exception:
+            ports = [SERIAL_PORT]
+        ports = args.port or ports
+        rates = [BAUD_RATE] + [r for r in BAUD_RATES if r != BAUD_RATE]
+        results = BaudProbe(ports, rates).run()
+        for port in ports:
+            if port in results:
+                score, rate, data = results[port]
+                print("%-20s %6d baud  score %.2f  %r" % (port, rate, score, bytes(data[:24])))
+            else:
+                print("%-20s no answer" % port)
+        sys.exit(0)
+    if args.replay:
+        try:
+            sio = ReplayPort(args.replay, args.speed)
+        except (OSError, ValueError) as e:
+            print("Can't replay %s: %s" % (args.replay, e))
+            sys.exit(1)
+        if args.headless:
+            term.setup_headless()
+            try:
+                if args.trace:
+                    term.start_trace(args.trace, traceOps)
+            except OSError as e:
+                print("Can't trace to %s: %s" % (args.trace, e))
+                sys.exit(1)
+            start = time.time()
+            count = term.run_headless(sio)
+            elapsed = max(time.time() - start, 0.000001)
+            term.stop_trace()
+            for line in term.screen.rows():
+                print(line.rstrip())
+            print("\nReplayed %d bytes in %.3f seconds, %.0f bytes/second" %
+                  (count, elapsed, count / elapsed))
+            sys.exit(0)
+        term.get_h19config()
+    else:
+        if not os.path.exists(CONFIG_FILE):
+            term.probe_ports()      # first run asks which port to use
+        term.get_h19config()
+        term.startup_step('configuration read')
+        if args.fanout:
+            ports = [p.strip() for p in (args.fanout_ports or FANOUT_PORTS).split(',') if p.strip()]
+            if not ports:
+                print("No fan-out ports, set FanoutPorts or use --fanout-ports")
+                sys.exit(1)
+            try:
+                fanout = FanoutSend(term, args.fanout, ports)
+            except OSError as e:
+                print("Can't read %s: %s" % (args.fanout, e))
+                sys.exit(1)
+            start = time.time()
+            fanout.start()
+            fanout.wait()
+            for line in fanout.summary(width=200):
+                print(line)
+            print("\n%d of %d sent in %.1f seconds" % (len(fanout.targets) - len(fanout.failed()),
+                                                     len(fanout.targets), time.time() - start))
+            sys.exit(1 if fanout.failed() else 0)
+        if args.drive_server and args.headless and not args.script:
+            try:
+                term.start_drive_server(args.drive_server)
+            except (OSError, ValueError) as e:
+                print("Can't serve drives on %s: %s" % (XMODEM_PORT, e))
+                sys.exit(1)
+            for i, drive in enumerate(term.driveServer.bdos.drives):
+                print("%c: %s" % (65 + i, drive.path))
+            print("Serving on %s, CTRL-C stops" % XMODEM_PORT)
+            sys.stdout.flush()
+            try:
+                while term.driveServer.running:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                pass
+            term.driveServer.stop()
+            print("%d calls, %d NAKs" % (term.driveServer.calls, term.driveServer.naks))
+            sys.exit(0)
+        ports = args.port or [SERIAL_PORT] + [p.strip() for p in SESSION_PORTS.split(',') if p.strip()]
+        SERIAL_PORT = ports[0]
+        sio = term.open_port()
+        term.sio = sio
+        for port in ports[1:]:
+            term.add_session(port)
+        term.startup_step('ports opened')
+        if args.drive_server or DRIVE_SERVER:
+            try:
+                term.start_drive_server(args.drive_server or DRIVE_SERVER)
+            except (OSError, ValueError) as e:
+                print("Can't serve drives on %s: %s" % (XMODEM_PORT, e))
+                sys.exit(1)
+    term.recordFile = args.record
+    term.traceFile = args.trace
+    term.traceOps = traceOps
+    if args.stats_socket:
+        try:
+            term.serve_stats(args.stats_socket)
+        except OSError as e:
+            print("Can't listen on %s: %s" % (args.stats_socket, e))
+            sys.exit(1)
+    if args.mirror or args.mirror_websocket:
+        term.mirror = ScreenMirror(term.sessions)
+        try:
+            if args.mirror:
+                term.mirror.listen(args.mirror)
+            if args.mirror_websocket:
+                term.mirror.listen_websocket(args.mirror_websocket)
+        except OSError as e:
+            print("Can't serve the screens: %s" % e)
+            sys.exit(1)
+    if args.script:
+        try:
+            term.script = Script(term, args.script)
+        except (OSError, ValueError) as e:
+            print("Can't run script %s: %s" % (args.script, e))
+            sys.exit(1)
+        if args.headless:
+            term.setup_headless()
+            if args.record:
+                term.start_recording(args.record)
+            if args.trace:
+                term.start_trace(args.trace, traceOps)
+            status = term.run_script(sio)
+            term.stop_recording()
+            term.stop_trace()
+            print(term.script.message)
+            sys.exit(status)
     curses.wrapper(term.main, term, sio)
+    if term.startupBench:
+        last = 0.0
+        for step, seconds in term.startupBench:
+            print("%-20s %7.3f  (+%.3f)" % (step, seconds, seconds - last))
+            last = seconds
+        print("\nFirst frame %.3f seconds after starting" % last)
 
@@ -0,0 +1,50 @@
+"""Fixtures shared by the tests."""
+import pytest
+
+import h19term
+
+
+class QuietPort:
+    """A port with nothing more to say, reading it would hang a real one.
+
+    Each write is kept, sent has them all run together.
+    """
+    in_waiting = 0
+    out_waiting = 0
+    timeout = 0
+    baudrate = 9600
+    rts = True
+
+    def __init__(self):
+        self.writes = []
+
+    @property
+    def sent(self):
+        return b''.join(self.writes)
+
+    def read(self, n):
+        raise AssertionError("parser waited on the port")
+
+    def write(self, data):
+        self.writes.append(data)
+        return len(data)
+
+
+@pytest.fixture
+def headless():
+    """Makes terminals with no display, as many as the test wants."""
+    def make():
+        term = h19term.H19Term()
+        term.setup_headless()
+        return term
+    return make
+
+
+@pytest.fixture
+def term(headless):
+    return headless()
+
+
+@pytest.fixture
+def port():
+    return QuietPort()
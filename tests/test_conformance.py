@@ -0,0 +1,270 @@
+"""H19 escape sequences against the manual, golden screens and time budgets.
+
+The golden screens are in tests/golden, a test with none fails.  After a
+change that is meant to alter what ends up on the screen, look at the
+differences and rewrite them, or write a new one, with
+
+    H19_GOLDEN=update python -m pytest tests/test_conformance.py
+
+H19_BUDGET_SCALE multiplies the time budgets for slow machines.
+"""
+import os
+import time
+import random
+import hashlib
+
+import pytest
+
+import h19term
+
+
+GOLDEN = os.path.join(os.path.dirname(__file__), 'golden')
+UPDATE = os.environ.get('H19_GOLDEN') == 'update'
+BUDGET_SCALE = float(os.environ.get('H19_BUDGET_SCALE', '1'))
+
+
+def run(term, port, data, ansi=False):
+    if ansi:
+        term.rxbuf += b'\x1b<'
+    term.rxbuf += data
+    term.process_buffered(port)
+    return term
+
+
+def pos(y, x):
+    return b'\x1bY' + bytes([y + 32, x + 32])
+
+
+# (input, cursor afterwards, {row: text}) from the H19 operation manual
+HEATH = [
+    (pos(5, 8), (5, 8), {}),
+    (pos(5, 8) + b'\x1bA', (4, 8), {}),
+    (b'\x1bA', (0, 0), {}),
+    (pos(5, 8) + b'\x1bB', (6, 8), {}),
+    (pos(23, 0) + b'\x1bB', (23, 0), {}),
+    (pos(5, 8) + b'\x1bC', (5, 9), {}),
+    (pos(5, 79) + b'\x1bC', (5, 79), {}),
+    (pos(5, 8) + b'\x1bD', (5, 7), {}),
+    (b'\x1bD', (0, 0), {}),
+    (pos(5, 8) + b'\x1bH', (0, 0), {}),
+    (pos(24, 8) + b'\x1bH', (24, 0), {}),
+    (pos(5, 8) + b'\x1bY~!', (5, 1), {}),               # line out of range
+    (pos(5, 8) + b'\x1bY%z', (5, 79), {}),              # column past the end
+    (pos(5, 8) + b'\x1bj\x1bH\x1bk', (5, 8), {}),
+    (b'abc\x1bH\x1bI', (0, 0), {0: '', 1: 'abc'}),
+    (b'abc\r\n\x1bI', (0, 0), {0: 'abc'}),
+    (b'abc\x1bE', (0, 0), {0: ''}),
+    (b'abc\r\ndef\x1bH\x1bC\x1bJ', (0, 1), {0: 'a', 1: ''}),
+    (b'abcdef\r\x1bC\x1bC\x1bK', (0, 2), {0: 'ab'}),
+    (b'abcdef\x1bl', (0, 0), {0: ''}),
+    (b'abc\r\ndef\x1bH\x1bL', (0, 0), {0: '', 1: 'abc', 2: 'def'}),
+    (b'abc\r\ndef\x1bH\x1bC\x1bM', (0, 0), {0: 'def', 1: ''}),
+    (b'abcdef\r\x1bN', (0, 0), {0: 'bcdef'}),
+    (b'abc\r\x1b@X\x1bOY', (0, 2), {0: 'XYbc'}),
+    (b'\x1bx9abc\n', (1, 0), {0: 'abc'}),
+    (b'\x1bx8abc\r', (1, 0), {0: 'abc'}),
+    (b'\x1bx8\x1by8abc\r', (0, 0), {0: 'abc'}),
+    (b'\x1bw' + b'x' * 85, (0, 79), {0: 'x' * 80, 1: ''}),
+    (b'\x1bv' + b'x' * 85, (1, 5), {0: 'x' * 80, 1: 'x' * 5}),
+    # wrapping off the bottom line scrolls, the 25th line stays put
+    (b'\x1bv' + pos(23, 78) + b'xyz', (23, 1), {22: ' ' * 78 + 'xy', 23: 'z', 24: ''}),
+    (b'\x1bv\x1bF' + pos(23, 79) + b'^^', (23, 1),
+     {22: ' ' * 79 + h19term.H19Screen.h19_graphics[0], 23: h19term.H19Screen.h19_graphics[0]}),
+    (b'\x1bv\x1bx1' + pos(24, 0) + b'x' * 80 + b'y', (24, 1), {23: '', 24: 'y' + 'x' * 79}),
+    (b'abc\x08\x08', (0, 1), {0: 'abc'}),
+    (b'ab\tc', (0, 9), {0: 'ab      c'}),
+    (pos(0, 70) + b'\t\t\tx' + pos(1, 79) + b'\t', (1, 79), {0: ' ' * 74 + 'x', 2: ''}),
+    (b'\x1bF^\x1bG^', (0, 2), {0: h19term.H19Screen.h19_graphics[0] + '^'}),
+]
+
+
+@pytest.mark.parametrize('data, cursor, rows', HEATH)
+def test_heath_sequences(term, port, data, cursor, rows):
+    run(term, port, data)
+    assert term.rxpos == len(term.rxbuf)
+    assert term.screen.getyx() == cursor
+    screen = term.screen.rows()
+    for y, text in rows.items():
+        assert screen[y].rstrip() == text
+
+
+ANSI = [
+    (b'\x1b[5;9H', (4, 8), {}),
+    (b'\x1b[5;9f\x1b[H', (0, 0), {}),
+    (b'\x1b[5;9H\x1b[2A', (2, 8), {}),
+    (b'\x1b[5;9H\x1b[9A', (0, 8), {}),
+    (b'\x1b[5;9H\x1b[B', (5, 8), {}),
+    (b'\x1b[5;9H\x1b[99B', (23, 8), {}),
+    (b'\x1b[5;9H\x1b[3C', (4, 11), {}),
+    (b'\x1b[5;9H\x1b[99C', (4, 79), {}),
+    (b'\x1b[5;9H\x1b[0D', (4, 7), {}),
+    (b'\x1b[5;9H\x1b[99D', (4, 0), {}),
+    (b'\x1b[5;9H\x1b[s\x1b[H\x1b[u', (4, 8), {}),
+    (b'abc\r\ndef\x1b[H\x1b[C\x1b[J', (0, 1), {0: 'a', 1: ''}),
+    (b'abc\r\ndefg\x1b[2D\x1b[1J', (0, 0), {0: '', 1: '   g'}),
+    (b'abc\x1b[2J', (0, 0), {0: ''}),
+    (b'abcdef\r\x1b[2C\x1b[K', (0, 2), {0: 'ab'}),
+    (b'abcdef\x1b[2D\x1b[1K', (0, 4), {0: '    ef'}),
+    (b'abcdef\x1b[2K', (0, 0), {0: ''}),
+    (b'abc\r\ndef\x1b[H\x1b[2L', (0, 0), {0: '', 1: '', 2: 'abc', 3: 'def'}),
+    (b'abc\r\ndef\r\nghi\x1b[H\x1b[2M', (0, 0), {0: 'ghi', 1: ''}),
+    (b'abcdef\r\x1b[3P', (0, 0), {0: 'def'}),
+    (b'abc\r\x1b[4hXY\x1b[4lZ', (0, 3), {0: 'XYZbc'}),
+    (b'\x1b[?7l' + b'x' * 85, (0, 79), {1: ''}),
+    (b'\x1bM', (0, 0), {}),
+]
+
+
+@pytest.mark.parametrize('data, cursor, rows', ANSI)
+def test_ansi_sequences(term, port, data, cursor, rows):
+    run(term, port, data, ansi=True)
+    assert term.rxpos == len(term.rxbuf)
+    assert term.screen.getyx() == cursor
+    screen = term.screen.rows()
+    for y, text in rows.items():
+        assert screen[y].rstrip() == text
+
+
+@pytest.mark.parametrize('data, ansi, answer', [
+    (pos(5, 8) + b'\x1bn', False, b'\x1bY%('),
+    (b'\x1bZ', False, b'\x1b/K'),
+    (b'\x1b[5;9H\x1b[6n', True, b'\x1b[5;9R'),
+])
+def test_reports(term, port, data, ansi, answer):
+    run(term, port, data, ansi)
+    assert port.sent == answer
+
+
+def reverse(term):
+    return term.screen.attr & h19term.curses.A_REVERSE
+
+
+def test_modes(headless, port):
+    term = run(headless(), port, b'\x1b<\x1b[>5h\x1b[7m\x1b[10m')
+    assert term.ansiMode and term.cursorOff and reverse(term) and term.graphicsMode
+    term = run(headless(), port, b'\x1bp\x1bF\x1b<\x1b[0;11m\x1b[?2l')
+    assert not term.ansiMode and not reverse(term) and not term.graphicsMode
+
+
+# Corpora for the golden screens and the time budgets, each is fed
+# repeat times and must get through in budget seconds
+def text_corpus():
+    return b''.join(b'%05d %s\x1bK\r\n' % (n, bytes(range(33 + n % 26, 100)))
+                    for n in range(2000))
+
+
+def editor_corpus():
+    data = b''
+    for frame in range(40):
+        data += b'\x1bH\x1bJ'
+        for y in range(24):
+            data += pos(y, 0) + b'\x1bp%02d\x1bq ' % y
+            data += b'line %d of frame %d' % (y, frame) + b'\x1bK'
+        data += pos(24, 0) + b'\x1bp STATUS %d \x1bq' % frame + pos(frame % 24, 10)
+        data += b'\x1bL\x1bM\x1b@inserted\x1bO\x1bN'
+    return data
+
+
+def ansi_corpus():
+    data = b'\x1b<'
+    for frame in range(40):
+        data += b'\x1b[H\x1b[2J'
+        for y in range(24):
+            data += b'\x1b[%d;1H\x1b[7m%02d\x1b[0m ' % (y + 1, y)
+            data += b'line %d of frame %d\x1b[K' % (y, frame)
+        data += b'\x1b[%d;11H\x1b[2L\x1b[2M\x1b[4hins\x1b[4l\x1b[3P' % (frame % 24 + 1)
+    return data
+
+
+def fuzz_stream(seed, length=400):
+    rnd = random.Random(seed)
+    alphabet = (b'\x1b[;0123456789ABCDEFGHIJKLMNOPYZbjklnopqrtuvwxyz@#{}[]=<>\\'
+                b'\r\n\x08\x07\t\x7f\x00 abcdef?')
+    return bytes(rnd.choice(alphabet) for _ in range(length))
+
+
+# Mixed into the long streams so wrapping, insert, graphics and the 25th
+# line all get to the bottom of the screen and the end of the line
+MODE_SWITCHES = [b'\x1bv', b'\x1bw', b'\x1b@', b'\x1bO', b'\x1bF', b'\x1bG', b'\x1bx1',
+                 b'\x1by1', b'\x1bY7n', b'\x1bY8n', b'\x1b<', b'\x1b[?2l', b'\x1b[?7h',
+                 b'\x1b[?7l', b'\x1b[4h', b'\x1b[4l', b'\x1b[10m', b'\x1b[11m', b'\x1b[>1h',
+                 b'\x1b[>1l', b'\x1b[24;70H', b'\x1b[25;70H']
+
+
+def long_fuzz_stream(seed, length=8000):
+    rnd = random.Random(seed)
+    data = bytearray()
+    while len(data) < length:
+        data += rnd.choice(MODE_SWITCHES)
+        data += bytes(rnd.randrange(256) for _ in range(rnd.randrange(100)))
+    return bytes(data)
+
+
+def fuzz_corpus():
+    return b''.join(fuzz_stream(seed) for seed in range(50))
+
+
+CORPORA = {
+    'text': (text_corpus, 1, 1.5),
+    'editor': (editor_corpus, 3, 1.5),
+    'ansi': (ansi_corpus, 3, 1.5),
+    'fuzz': (fuzz_corpus, 3, 1.5),
+}
+
+
+def snapshot(term):
+    y, x = term.screen.getyx()
+    lines = ['cursor %d %d' % (y, x)]
+    for row, (text, attrs) in enumerate(zip(term.screen.text, term.screen.attrs)):
+        line = '%2d|%s' % (row, ''.join(text).rstrip())
+        spans = [col for col, attr in enumerate(attrs) if attr & h19term.curses.A_REVERSE]
+        if spans:
+            line += '  reverse %d-%d' % (spans[0], spans[-1])
+        lines.append(line.rstrip())
+    return '\n'.join(lines) + '\n'
+
+
+def check_golden(name, text):
+    path = os.path.join(GOLDEN, name + '.screen')
+    if UPDATE:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+    assert os.path.exists(path), "%s has no golden screen, make it with H19_GOLDEN=update" % name
+    with open(path, encoding='utf-8') as f:
+        assert text == f.read(), "%s differs from the golden screen" % name
+
+
+@pytest.mark.parametrize('name', sorted(CORPORA))
+def test_golden_screens(term, port, name):
+    corpus, repeat, budget = CORPORA[name]
+    run(term, port, corpus())
+    check_golden(name, snapshot(term))
+
+
+@pytest.mark.parametrize('name', sorted(CORPORA))
+def test_time_budgets(headless, port, name):
+    corpus, repeat, budget = CORPORA[name]
+    data = corpus()
+    start = time.perf_counter()
+    for i in range(repeat):
+        run(headless(), port, data)
+    elapsed = time.perf_counter() - start
+    assert elapsed < budget * BUDGET_SCALE, \
+        "%s took %.2f seconds, the budget is %.2f" % (name, elapsed, budget * BUDGET_SCALE)
+
+
+@pytest.mark.parametrize('name, stream, seeds', [('fuzz-digests', fuzz_stream, 300),
+                                                  ('fuzz-long-digests', long_fuzz_stream, 20)])
+def test_fuzz_streams(headless, port, name, stream, seeds):
+    # Nothing may crash the parser or put the cursor off the screen, and
+    # the same bytes always give the same screen
+    digests = []
+    for seed in range(seeds):
+        for ansi in (False, True):
+            term = run(headless(), port, stream(seed), ansi)
+            y, x = term.screen.getyx()
+            assert 0 <= y < 25 and 0 <= x < 80, "seed %d" % seed
+            screen = snapshot(term).encode('utf-8')
+            digests.append('%d %s %s' % (seed, 'ansi' if ansi else 'heath',
+                                         hashlib.sha1(screen).hexdigest()[:16]))
+    check_golden(name, '\n'.join(digests) + '\n')
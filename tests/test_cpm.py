@@ -0,0 +1,203 @@
+import os
+import time
+
+import pytest
+
+import h19term
+
+
+BUDGET_SCALE = float(os.environ.get('H19_BUDGET_SCALE', '1'))
+
+# LD DE,msg  LD C,9  CALL 5  RET
+HELLO = bytes.fromhex('1109010e09cd0500c9') + b'Hello, world\r\n$'
+# Types the file in the first FCB a record at a time with BDOS 15, 20 and 2
+CAT = bytes.fromhex('115c000e0fcd05003cc8115c000e14cd0500b7c021800'
+                    '07efe1ac8e55f0e02cd0500e12c20f118e2')
+# Makes the file in the first FCB and writes three records of the DMA buffer
+WRITE = bytes.fromhex('115c000e16cd05000603c5115c000e15cd0500c110f4'
+                      '115c000e10c30500')
+
+
+class Halted(Exception):
+    pass
+
+
+def run(code, setup=None):
+    cpu = h19term.Z80()
+    cpu.mem[0x100:0x100 + len(code)] = bytes(code)
+    cpu.pc = 0x100
+    cpu.sp = 0xF000
+
+    def halt():
+        raise Halted
+    cpu.halt = halt
+    if setup:
+        setup(cpu)
+    with pytest.raises(Halted):
+        cpu.run(100000)
+    return cpu
+
+
+def pair(cpu, high):
+    return cpu.reg[high] << 8 | cpu.reg[high + 1]
+
+
+def fill(addr, data):
+    def setup(cpu):
+        cpu.mem[addr:addr + len(data)] = data
+    return setup
+
+
+@pytest.mark.parametrize('code, setup, check', [
+    # 15 + 27 in BCD, then 42 - 15
+    ('3e15c62727', None, lambda c: c.reg[7] == 0x42 and c.reg[6] == 0x14),
+    ('3e42d61527', None, lambda c: c.reg[7] == 0x27),
+    # 1 + 2 + ... + 10 with DJNZ
+    ('060aaf8010fd', None, lambda c: c.reg[7] == 55),
+    # LDIR a copy and a fill that runs into itself
+    ('210020110030010500edb0', fill(0x2000, b'HELLO'),
+     lambda c: c.mem[0x3000:0x3005] == b'HELLO' and pair(c, 0) == 0 and c.reg[6] == 0x28),
+    ('210020110120010f00edb0', fill(0x2000, b'U'),
+     lambda c: c.mem[0x2000:0x2011] == b'U' * 16 + b'\0'),
+    # CPIR finds the d
+    ('2100200106003e64edb1', fill(0x2000, b'abcdef'),
+     lambda c: pair(c, 4) == 0x2004 and pair(c, 0) == 2 and c.reg[6] == 0x46),
+    # (IX+d) and (IY-d)
+    ('dd210020dd360542dd7e05dd3405dd4605', None,
+     lambda c: c.reg[7] == 0x42 and c.reg[0] == 0x43),
+    ('fd211020110101fd19fd36fe77', None, lambda c: c.iy == 0x2111 and c.mem[0x210F] == 0x77),
+    # SBC HL with a borrow and ADC HL overflowing
+    ('21001011010037ed52', None, lambda c: pair(c, 4) == 0x0FFE and c.reg[6] == 0x1A),
+    ('21ff7f110100b7ed5a', None, lambda c: pair(c, 4) == 0x8000 and c.reg[6] == 0x94),
+    # CALL, PUSH AF, POP BC, RET
+    ('cd06017600003e99f5c1c9', None, lambda c: c.reg[0] == 0x99 and c.pc == 0x103),
+    # SET 0,(HL)  BIT 7,A  RL C  RES 7,(IX+0)
+    ('210020cbc63e80cb7f0e81cb11dd210020ddcb00be', fill(0x2000, b'\xf0'),
+     lambda c: c.mem[0x2000] == 0x71 and c.reg[1] == 2 and c.reg[6] == 1),
+    # EX AF,AF' and EXX
+    ('3e01083e0208013412d9010000d9', None,
+     lambda c: c.reg[7] == 1 and pair(c, 0) == 0x1234),
+    # LD IXH and IXL leave H and L alone
+    ('2611dd2605dd2e06', None, lambda c: c.ix == 0x0506 and c.reg[4] == 0x11),
+])
+def test_instructions(code, setup, check):
+    cpu = run(bytes.fromhex(code) + b'\x76', setup)
+    assert check(cpu)
+
+
+def test_speed():
+    # DEC BC  LD A,B  OR C  JP NZ, round and round
+    cpu = h19term.Z80()
+    cpu.mem[0x100:0x109] = bytes.fromhex('0b78b1c20001c30001')
+    cpu.pc = 0x100
+    start = time.perf_counter()
+    cpu.run(1000000)
+    elapsed = time.perf_counter() - start
+    assert elapsed < 2.0 * BUDGET_SCALE, "a million Z80 instructions took %.2f seconds" % elapsed
+
+
+class Console:
+    """ A cpm: port and what it has printed. """
+
+    def __init__(self, port):
+        self.port = h19term.CpmPort(port)
+        self.expect(b'A>')
+
+    def expect(self, text, timeout=5.0):
+        out = b''
+        end = time.time() + timeout
+        while text not in out:
+            assert time.time() < end, "no %r in %r" % (text, out)
+            if self.port.in_waiting:
+                out += self.port.read(4096)
+            else:
+                time.sleep(0.005)
+        return out
+
+    def command(self, line):
+        self.port.write(line.encode('latin-1') + b'\r')
+        out = self.expect(b'\r\nA>')
+        return out[len(line) + 1:-4].decode('latin-1')
+
+
+@pytest.fixture
+def console(tmp_path):
+    (tmp_path / 'hello.com').write_bytes(HELLO)
+    (tmp_path / 'CAT.COM').write_bytes(CAT)
+    (tmp_path / 'WRITE.COM').write_bytes(WRITE)
+    (tmp_path / 'Notes.txt').write_bytes(b'one\r\ntwo\r\n' * 40 + b'\x1a')
+    (tmp_path / 'too long name.txt').write_bytes(b'')
+    console = Console('cpm:%s' % tmp_path)
+    yield console
+    console.port.close()
+
+
+def test_ccp(console, tmp_path):
+    assert console.command('dir') == '\nA: CAT      COM : HELLO    COM : NOTES    TXT : WRITE    COM'
+    assert console.command('dir *.txt') == '\nA: NOTES    TXT'
+    assert console.command('type notes.txt') == '\n' + 'one\r\ntwo\r\n' * 40
+    assert console.command('save 2 x.bin') == '\n'
+    assert (tmp_path / 'x.bin').stat().st_size == 512
+    assert console.command('ren y.bin=x.bin') == '\n'
+    assert console.command('ren y.bin=notes.txt') == '\nFILE EXISTS'
+    assert console.command('era y.bin') == '\n'
+    assert not (tmp_path / 'y.bin').exists()
+    assert console.command('b:') == '\n\r\nBdos Err On B: Select'
+    assert console.command('nothing') == '\nNOTHING?'
+
+
+def test_programs(console, tmp_path):
+    assert console.command('hello') == '\nHello, world\r\n'
+    assert console.command('cat notes.txt') == '\n' + 'one\r\ntwo\r\n' * 40
+    assert console.command('cat missing.txt') == '\n'
+    assert console.command('write new.dat') == '\n'
+    data = (tmp_path / 'new.dat').read_bytes()
+    assert len(data) == 384 and data[:128] == data[128:256]
+
+
+def test_break_warm_boots(console):
+    with open(os.path.join(console.port.machine.drives[0].path, 'loop.com'), 'wb') as f:
+        f.write(b'\x18\xfe')                # JR $
+    console.port.write(b'loop\r')
+    time.sleep(0.2)
+    console.port.sendBreak()
+    console.expect(b'\r\nA>')
+    assert console.command('hello') == '\nHello, world\r\n'
+
+
+def image(files):
+    # An 8 inch disk written the way a BIOS would, with the skew
+    data = bytearray(b'\xe5' * h19term.CPM_IMAGE_SIZE)
+
+    def record(block, n, text):
+        track, sector = divmod(52 + block * 8 + n, 26)
+        offset = (track * 26 + h19term.CPM_IMAGE_SKEW[sector] - 1) * 128
+        data[offset:offset + 128] = text.ljust(128, b'\x1a')
+    directory = b''
+    block = 2
+    for name, text in files:
+        records = [text[i:i + 128] for i in range(0, len(text), 128)]
+        blocks = list(range(block, block + (len(records) + 7) // 8))
+        for i, chunk in enumerate(records):
+            record(blocks[i // 8], i % 8, chunk)
+        block += len(blocks)
+        directory += b'\0' + name + bytes((0, 0, 0, len(records))) + bytes(blocks).ljust(16, b'\0')
+    directory = directory.ljust(2048, b'\xe5')
+    for i in range(16):
+        record(i // 8, i % 8, directory[i * 128:i * 128 + 128])
+    return bytes(data)
+
+
+def test_disk_image(tmp_path):
+    text = b''.join(b'line %03d\r\n' % n for n in range(200))
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'a' / 'CAT.COM').write_bytes(CAT)
+    (tmp_path / 'b.img').write_bytes(image([(b'README  TXT', text), (b'HELLO   COM', HELLO)]))
+    console = Console('cpm:%s,%s' % (tmp_path / 'a', tmp_path / 'b.img'))
+    try:
+        assert console.command('dir b:') == '\nB: HELLO    COM : README   TXT'
+        assert console.command('cat b:readme.txt') == '\n' + text.decode()
+        assert console.command('b:hello') == '\nHello, world\r\n'
+        assert console.command('era b:readme.txt') == '\n\r\nBdos Err On B: R/O'
+    finally:
+        console.port.close()
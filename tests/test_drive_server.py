@@ -0,0 +1,97 @@
+import socket
+
+import pytest
+
+import h19term
+
+
+class Driver:
+    """ The H8 end, frames over a TCP connection to the server. """
+
+    def __init__(self, drives):
+        listener = socket.create_server(('localhost', 0))
+        port = 'tcp://localhost:%d' % listener.getsockname()[1]
+        self.server = h19term.DriveServer(port, drives, lambda: h19term.NetworkPort(port))
+        self.server.start()
+        self.sock, addr = listener.accept()
+        self.sock.settimeout(5)
+        listener.close()
+
+    def recv(self, n):
+        data = b''
+        while len(data) < n:
+            data += self.sock.recv(n - len(data))
+        return data
+
+    def call(self, call, fcb=b'', record=b''):
+        body = bytes((call, len(fcb + record))) + fcb + record
+        self.sock.sendall(b'\x02' + body + bytes((sum(body) & 0xFF,)))
+        head = self.recv(3)
+        assert head[0] == 2
+        data = self.recv(head[2] + 1)
+        assert (head[1] + head[2] + sum(data[:-1])) & 0xFF == data[-1]
+        return head[1], data[:-1]
+
+    def close(self):
+        self.sock.close()
+        self.server.stop()
+
+
+def fcb(name, drive=0):
+    base, dot, ext = name.partition('.')
+    return bytes((drive,)) + ('%-8s%-3s' % (base, ext)).encode() + bytes(24)
+
+
+@pytest.fixture
+def driver(tmp_path):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'a' / 'Prog.com').write_bytes(bytes(range(256)) * 3)
+    (tmp_path / 'b.img').write_bytes(b'\xe5' * h19term.CPM_IMAGE_SIZE)    # an empty disk
+    driver = Driver(h19term.CpmMachine.open_drives('%s,%s' % (tmp_path / 'a', tmp_path / 'b.img')))
+    yield driver
+    driver.close()
+
+
+def test_hello_and_search(driver):
+    assert driver.call(0) == (0, b'\x02')
+    status, data = driver.call(17, fcb('????????.???'))
+    assert status == 0 and data[37:48] == b'PROG    COM'
+    assert driver.call(18, fcb('????????.???'))[0] == 0xFF
+    assert driver.call(17, fcb('????????.???', 2))[0] == 0xFF
+    assert driver.call(17, fcb('????????.???', 3))[0] == 0xFF     # no C:
+
+
+def test_read_sequential(driver):
+    status, data = driver.call(15, fcb('PROG.COM'))
+    assert status == 0 and data[15] == 6
+    records = []
+    while True:
+        status, data = driver.call(20, data[:36])
+        if status:
+            break
+        records.append(data[36:])
+    assert b''.join(records) == bytes(range(256)) * 3
+    assert driver.call(15, fcb('MISSING.COM'))[0] == 0xFF
+
+
+def test_write_and_cache(driver, tmp_path):
+    status, data = driver.call(22, fcb('NEW.DAT'))
+    assert status == 0
+    status, data = driver.call(21, data[:36], b'x' * 128)
+    status, data = driver.call(21, data[:36], b'y' * 128)
+    assert status == 0 and data[32] == 2
+    assert (tmp_path / 'a' / 'new.dat').read_bytes() == b'x' * 128 + b'y' * 128
+    # Read into the cache, change the file behind the server's back
+    random = fcb('NEW.DAT')[:33] + b'\x01\x00\x00'
+    assert driver.call(33, random)[1][36:] == b'y' * 128
+    (tmp_path / 'a' / 'new.dat').write_bytes(b'x' * 128 + b'z' * 256)
+    assert driver.call(33, random)[1][36:] == b'z' * 128
+    # The image is read only
+    assert driver.call(22, fcb('NEW.DAT', 2))[0] == 0xFF
+
+
+def test_damaged_frame(driver):
+    driver.sock.sendall(b'\x02\x0f\x01\x00\x00')
+    assert driver.recv(1) == b'\x15'
+    assert driver.call(0) == (0, b'\x02')
+    assert driver.server.naks == 1
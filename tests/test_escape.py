@@ -0,0 +1,28 @@
+import pytest
+
+
+def feed(term, port, data):
+    term.rxbuf += data
+    return term.process_buffered(port)
+
+
+@pytest.mark.parametrize('first, rest', [(b'ab\x1bY', b'#%'),
+                                         (b'ab\x1b', b'Y#%'),
+                                         (b'ab\x1bY#', b'%')])
+def test_partial_heath_sequence_waits(term, port, first, rest):
+    assert feed(term, port, first) == 2
+    feed(term, port, rest)
+    assert term.screen.getyx() == (3, 5)
+
+
+def test_partial_ansi_sequence_waits(term, port):
+    term.ansiMode = True
+    feed(term, port, b'\x1b[4;')
+    feed(term, port, b'6H')
+    assert term.screen.getyx() == (3, 5)
+
+
+def test_escapes_are_counted(term, port):
+    feed(term, port, b'\x1bY#%\x1bK\x1bK\x1b!')
+    assert term.stats.escapes == {'ESC Y': 1, 'ESC K': 2, 'ESC !': 1}
+    assert term.stats.dropped == 1
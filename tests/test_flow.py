@@ -0,0 +1,44 @@
+import h19term
+
+
+def test_backlog_sends_xoff_then_xon(term, port):
+    term.rxbuf += b'x' * (h19term.FLOW_HIGH + 1)
+    term.flow_check(port)
+    term.flow_check(port)
+    assert port.sent == h19term.XOFF
+    term.process_buffered(port, h19term.FLOW_HIGH)
+    term.flow_check(port)
+    assert port.sent == h19term.XOFF + h19term.XON
+    assert (term.stats.xoffSent, term.stats.xonSent) == (1, 1)
+
+
+def test_process_buffered_limit(term, port):
+    term.rxbuf += b'abcdef'
+    assert term.process_buffered(port, 4) == 4
+    assert term.process_buffered(port, 4) == 2
+
+
+def test_hold_screen_stops_until_scroll(term, port):
+    term.rxbuf += b'\x1b[' + b'line\r\n' * 3
+    term.process_buffered(port)
+    assert term.holdScreenMode
+    term.set_held(True)
+    term.flow_check(port)
+    assert port.sent == h19term.XOFF
+    before = term.rxpos
+    assert term.process_buffered(port) == 0 and term.rxpos == before
+    term.scroll_key(page=True)
+    assert not term.held and term.holdLines == h19term.HOLD_PAGE
+    term.flow_check(port)
+    assert port.sent == h19term.XOFF + h19term.XON
+
+
+def test_rtscts_drops_rts(monkeypatch, headless, port):
+    monkeypatch.setattr(h19term, 'FLOW_CONTROL', 'rtscts')
+    term = headless()
+    term.set_held(True)
+    term.flow_check(port)
+    assert port.rts is False and port.sent == b''
+    term.exit_hold_screen_mode()
+    term.flow_check(port)
+    assert port.rts is True
@@ -0,0 +1,57 @@
+import curses
+
+import h19term
+
+
+def type_keys(editor, keys):
+    sent = ''
+    for k in keys:
+        sent += editor.key(ord(k) if isinstance(k, str) else k) or ''
+    return sent
+
+
+def test_edit_and_send(tmp_path):
+    editor = h19term.LineEditor(str(tmp_path / 'history'))
+    assert type_keys(editor, 'dr' + '\x7f' + 'ir') == ''
+    assert editor.line == 'dir'
+    assert type_keys(editor, [curses.KEY_LEFT, curses.KEY_LEFT, 'e']) == ''
+    assert editor.line == 'deir'
+    assert type_keys(editor, [curses.KEY_DC, curses.KEY_END] + list(' b:\r')) == 'der b:\r'
+    assert editor.line == ''
+    assert (tmp_path / 'history').read_text() == 'der b:\n'
+
+
+def test_history_and_search(tmp_path):
+    (tmp_path / 'history').write_text('dir\npip a:=b:*.com\nstat\n')
+    editor = h19term.LineEditor(str(tmp_path / 'history'))
+    type_keys(editor, 'x')
+    type_keys(editor, [curses.KEY_UP, curses.KEY_UP])
+    assert editor.line == 'pip a:=b:*.com'
+    type_keys(editor, [curses.KEY_DOWN, curses.KEY_DOWN])
+    assert editor.line == 'x'
+    type_keys(editor, ['\x12', 'd', 'i'])
+    assert editor.line == 'dir'
+    assert type_keys(editor, ['\x07']) == '' and editor.line == 'x'
+    assert type_keys(editor, ['\x12', 'p', curses.KEY_END, 'x', '\r']) == 'pip a:=b:*.comx\r'
+
+
+def test_control_keys_pass_at_empty_prompt(tmp_path):
+    editor = h19term.LineEditor(str(tmp_path / 'history'))
+    assert editor.key(3) is None
+    type_keys(editor, 'a')
+    assert editor.key(3) == ''
+
+
+def test_line_is_drawn_then_put_back(tmp_path, monkeypatch, headless):
+    monkeypatch.setattr(h19term, 'HISTORY_FILE', str(tmp_path / 'history'))
+    term = headless()
+    term.screen.addstr(0, 0, 'A>')
+    term.toggle_line_edit()
+    for k in 'dir':
+        term.process_key(ord(k), None, None, None, None)
+    assert term.screen.rows()[0].startswith('A>dir ')
+    assert term.txbuf == ''
+    term.process_key(13, None, None, None, None)
+    assert term.screen.rows()[0].rstrip() == 'A>'
+    assert term.screen.getyx() == (0, 2)
+    assert term.txbuf == 'dir\r'
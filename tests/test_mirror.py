@@ -0,0 +1,115 @@
+import json
+import socket
+import struct
+import time
+
+import pytest
+
+import h19term
+
+
+@pytest.fixture
+def mirror(tmp_path, term):
+    term.screen.addstr(0, 0, 'A>dir')
+    mirror = h19term.ScreenMirror(term.sessions)
+    mirror.listen(str(tmp_path / 'mirror'))
+    mirror.path = str(tmp_path / 'mirror')
+    mirror.term = term
+    return mirror
+
+
+def connect(mirror, request):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(5)
+    client.connect(mirror.path)
+    client.sendall(request)
+    return client
+
+
+def attached(mirror, count=1):
+    for _ in range(500):
+        if len(mirror.viewers) >= count:
+            return
+        time.sleep(0.01)
+    raise AssertionError("viewer never attached")
+
+
+def test_screen_query(mirror):
+    client = connect(mirror, b'screen\n')
+    attached(mirror)
+    mirror.tick()
+    reply = json.loads(client.makefile('rb').readline())
+    assert reply['type'] == 'screen'
+    assert reply['rows'][0].rstrip() == 'A>dir'
+    assert len(reply['rows']) == 25 and reply['cursor'] == [0, 5]
+
+
+def test_watch_gets_changed_rows(mirror):
+    client = connect(mirror, b'watch\n')
+    lines = client.makefile('rb')
+    attached(mirror)
+    mirror.tick()
+    assert json.loads(lines.readline())['type'] == 'snapshot'
+    mirror.term.screen.addstr(3, 0, 'STAT')
+    mirror.lastTick = 0.0
+    mirror.tick()
+    update = json.loads(lines.readline())
+    assert update['type'] == 'rows'
+    assert list(update['rows']) == ['3'] and update['rows']['3'].startswith('STAT')
+    assert update['cursor'] == [3, 4]
+
+
+def test_slow_viewer_starts_again(mirror):
+    client = connect(mirror, b'watch\n')
+    attached(mirror)
+    viewer = mirror.viewers[0]
+    for _ in range(h19term.MIRROR_BACKLOG):
+        viewer['queue'].put({})         # a viewer that has stopped reading
+    mirror.tick()
+    assert viewer['snapshot']
+
+
+def test_websocket(mirror):
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    port = server.getsockname()[1]
+    server.close()
+    mirror.listen_websocket(port)
+    client = socket.create_connection(('127.0.0.1', port), timeout=5)
+    client.sendall(b'GET /screen HTTP/1.1\r\nHost: x\r\nUpgrade: websocket\r\n'
+                   b'Connection: Upgrade\r\nSec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n\r\n')
+    answer = b''
+    while b'\r\n\r\n' not in answer:
+        answer += client.recv(1024)
+    assert b's3pPLMBiTxaQ9kYGzzhZRbK+xOo=' in answer
+    attached(mirror)
+    mirror.tick()
+    data = answer.split(b'\r\n\r\n', 1)[1]
+    while len(data) < 4:
+        data += client.recv(4096)
+    op, size = struct.unpack('!BB', data[:2])
+    assert op == 0x81 and size == 126
+    size = struct.unpack('!H', data[2:4])[0]
+    while len(data) < 4 + size:
+        data += client.recv(4096)
+    assert json.loads(data[4:4 + size])['rows'][0].startswith('A>dir')
+
+
+def test_graphics_are_mirrored(mirror, port):
+    mirror.term.rxbuf += b'\x1bY" \x1bFfa^\x1bGx'
+    mirror.term.process_buffered(port)
+    client = connect(mirror, b'screen\n')
+    attached(mirror)
+    mirror.tick()
+    rows = json.loads(client.makefile('rb').readline())['rows']
+    assert rows[2].rstrip() == '┏━●x'
+    assert all(len(row) == 80 for row in rows)
+
+
+def test_listen_replaces_only_a_socket(mirror, tmp_path):
+    mirror.listen(mirror.path)      # the fixture's socket, as an earlier run would leave it
+    path = tmp_path / 'notes.txt'
+    path.write_text('keep me')
+    with pytest.raises(FileExistsError):
+        mirror.listen(str(path))
+    assert path.read_text() == 'keep me'
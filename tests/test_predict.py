@@ -0,0 +1,67 @@
+class EchoPort:
+    """A host that echoes what it is sent, or answers with reply instead."""
+    out_waiting = 0
+    timeout = 0
+
+    def __init__(self, reply=None):
+        self.reply = reply
+        self.pending = b''
+
+    @property
+    def in_waiting(self):
+        return len(self.pending)
+
+    def read(self, n):
+        data, self.pending = self.pending[:n], self.pending[n:]
+        return data
+
+    def write(self, data):
+        self.pending += data if self.reply is None else self.reply
+        return len(data)
+
+
+def predicting(term, port):
+    term.firstChar = False
+    term.sio = port
+    term.predicting = True
+    term.screen.addstr(0, 0, 'A>')
+
+
+def test_guess_shown_then_confirmed(term):
+    predicting(term, EchoPort())
+    for c in 'di':
+        term.key_write(term.sio, c, echoed=True)
+    assert term.screen.rows()[0].startswith('A>di')
+    assert term.screen.getyx() == (0, 4)
+    term.service_sessions()
+    assert term.predictions == []
+    assert term.screen.rows()[0].startswith('A>di ')
+    assert term.screen.getyx() == (0, 4)
+
+
+def test_wrong_guess_is_taken_back(term):
+    predicting(term, EchoPort(reply=b'*'))
+    for c in 'pw':
+        term.key_write(term.sio, c, echoed=True)
+    term.service_sessions()
+    assert term.predictions == []
+    assert term.screen.rows()[0].startswith('A>* ')
+    term.key_write(term.sio, 'x', echoed=True)    # quiet for a while after a miss
+    assert term.predictions == []
+
+
+def test_escape_sequences_stop_guessing(term):
+    predicting(term, EchoPort())
+    term.rxbuf += b'\x1bH'
+    term.process_buffered(term.sio)
+    term.key_write(term.sio, 'x', echoed=True)
+    assert term.predictions == []
+
+
+def test_unpredictable_key_takes_guesses_back(term):
+    predicting(term, EchoPort())
+    term.key_write(term.sio, 'd', echoed=True)
+    term.key_write(term.sio, '\x03')
+    assert term.predictions == []
+    assert term.screen.rows()[0].startswith('A> ')
+    assert term.screen.getyx() == (0, 2)
@@ -0,0 +1,44 @@
+import os
+import threading
+
+import h19term
+
+
+def test_prompt_scores_well():
+    assert h19term.BaudProbe.score(b'\r\nA>') == 1.0
+    assert h19term.BaudProbe.score(b'\x1bH\x1bJA>') == 1.0
+
+
+def test_wrong_speed_scores_badly():
+    assert h19term.BaudProbe.score(b'\x00\xf8\x80\x00\xfe\x00') < 0.2
+    assert h19term.BaudProbe.score(b'A') == 0.0     # too little to tell
+
+
+def fake_h8(master, reply):
+    # answer every CR with reply until the port is closed
+    def run():
+        try:
+            while True:
+                if b'\r' in os.read(master, 100):
+                    os.write(master, reply)
+        except OSError:
+            pass
+    threading.Thread(target=run, daemon=True).start()
+
+
+def test_probe_finds_the_port_that_answers():
+    ports = []
+    fds = []
+    for reply in (b'\r\nA>', b'\x00\xf8\x80\x00'):
+        master, slave = os.openpty()
+        fake_h8(master, reply)
+        ports.append(os.ttyname(slave))
+        fds += [master, slave]
+    try:
+        port, rate, score = h19term.BaudProbe(ports, [9600, 19200]).best()
+    finally:
+        for fd in fds:
+            os.close(fd)
+    assert port == ports[0]
+    assert rate == 9600
+    assert score == 1.0
@@ -0,0 +1,48 @@
+import h19term
+
+
+def capture(tmp_path, data, name='capture.raw'):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_final_screen_follows_cursor_addressing(tmp_path):
+    path = capture(tmp_path, b'A>dir\r\nNO FILE\r\n\x1bY"%OK')
+    text = h19term.TranscriptRenderer.render(path, 'final')
+    assert text.splitlines() == ['A>dir', 'NO FILE', '     OK']
+
+
+def test_scrollback_keeps_what_scrolled_off(tmp_path):
+    path = capture(tmp_path, b''.join(b'line %d\r\n' % i for i in range(30)))
+    lines = h19term.TranscriptRenderer.render(path, 'scrollback').splitlines()
+    assert lines[:2] == ['line 0', 'line 1']
+    assert lines[-1] == 'line 29'
+
+
+def test_frames_from_a_recording(tmp_path):
+    path = str(tmp_path / 'session.h19rec')
+    recorder = h19term.SessionRecorder(path)
+    recorder.record(h19term.RECEIVED, b'A>')
+    recorder.flush()
+    recorder.record(h19term.SENT, b'x')
+    recorder.flush()
+    recorder.record(h19term.RECEIVED, b'x')
+    recorder.close()
+    text = h19term.TranscriptRenderer.render(path, 'frames')
+    assert text.count('--- ') == 2
+    assert text.splitlines()[-1] == 'A>x'
+
+
+def test_html_marks_reverse_video(tmp_path):
+    path = capture(tmp_path, b'\x1bpHELP\x1bq <&>')
+    page = h19term.TranscriptRenderer.render(path, 'final', as_html=True)
+    assert '<pre><span class="rev">HELP</span> &lt;&amp;&gt;</pre>' in page
+
+
+def test_run_writes_each_transcript(tmp_path):
+    paths = [capture(tmp_path, b'one', 'a.raw'), capture(tmp_path, b'two', 'b.raw')]
+    renderer = h19term.TranscriptRenderer(outdir=str(tmp_path), jobs=2)
+    done = sorted(renderer.run(paths))
+    assert [(p, e) for p, out, e in done] == [(paths[0], None), (paths[1], None)]
+    assert (tmp_path / 'b.raw.txt').read_text() == 'two\n'
@@ -0,0 +1,78 @@
+import h19term
+
+
+def trigger(name, match, send, regex=False, bootonly=False):
+    return {'name': name, 'match': match, 'send': send, 'regex': regex, 'bootonly': bootonly}
+
+
+def fired(responder, *chunks):
+    answers = []
+    for chunk in chunks:
+        answers += [(t['name'], response) for t, response in responder.feed(chunk)]
+    return answers
+
+
+def test_literals_fire_across_chunks():
+    responder = h19term.Responder([trigger('user', 'login:', 'guest\r'),
+                                   trigger('pass', 'Password:', 'secret\r'),
+                                   trigger('in', 'in:', '')])
+    assert fired(responder, b'lo', b'gin: ') == [('user', 'guest\r'), ('in', '')]
+    # the high bit is stripped the way the H8 may send it
+    assert fired(responder, bytes(b | 0x80 for b in b'Password:')) == [('pass', 'secret\r')]
+
+
+def test_bootonly_triggers_stop_after_the_boot_screens():
+    responder = h19term.Responder([trigger('date', 'Date?', 'now\r', bootonly=True),
+                                   trigger('always', 'More?', ' ')])
+    assert fired(responder, b'Date?') == [('date', 'now\r')]
+    fired(responder, b'\n' * h19term.TRIGGER_BOOT_LINES)
+    assert fired(responder, b'Date? More?') == [('always', ' ')]
+    responder.reset()
+    assert fired(responder, b'Date?') == [('date', 'now\r')]
+
+
+def test_every_regex_on_a_line_fires_once():
+    # Two patterns on one line both answer, and only once each however
+    # many chunks the line arrives in
+    responder = h19term.Responder([trigger('user', r'Login: *$', 'me\r', regex=True),
+                                   trigger('pass', r'Password: *$', 'pw\r', regex=True)])
+    assert fired(responder, b'Login: ') == [('user', 'me\r')]
+    assert fired(responder, b'x', b'\r\nPassword: ') == [('pass', 'pw\r')]
+    assert fired(responder, b'Login: Password: ') == []
+    assert fired(responder, b'\nLogin: Password: ') == [('pass', 'pw\r')]
+    responder = h19term.Responder([trigger('user', r'Login:', 'me\r', regex=True),
+                                   trigger('pass', r'Password:', 'pw\r', regex=True)])
+    assert fired(responder, b'Login: ', b'Password: ') == [('user', 'me\r'), ('pass', 'pw\r')]
+
+
+def test_regex_groups_and_dates_fill_the_response():
+    responder = h19term.Responder([
+        trigger('date', r'Date.(\d\d-\w\w\w-\d\d)', '{1} {date:%Y}\r', regex=True)])
+    (name, response), = fired(responder, b'Date 01-Jan-80 ')
+    assert response.startswith('01-Jan-80 ') and response.rstrip().split()[-1].isdigit()
+
+
+def test_inline_flags_stay_with_their_pattern():
+    responder = h19term.Responder([trigger('yes', r'(?i)continue\?', 'Y', regex=True),
+                                   trigger('ok', r'OK\?', 'O', regex=True),
+                                   trigger('echo', r'(\w+)=\1', '{1}', regex=True)])
+    assert fired(responder, b'CONTINUE? ok?\n') == [('yes', 'Y')]
+    assert fired(responder, b'OK? ab=ab\n') == [('ok', 'O'), ('echo', 'ab')]
+
+
+def test_match_end_is_just_past_the_first_match():
+    responder = h19term.Responder([trigger('p', r'A>', '', regex=True)])
+    responder.feed(b'dir\r\nA>rest')
+    assert responder.match_end == 7
+    responder.feed(b'more')
+    assert responder.match_end is None
+
+
+def test_a_bad_pattern_leaves_the_others_working(monkeypatch, capsys, headless):
+    monkeypatch.setattr(h19term, 'TRIGGERS', [trigger('bad', '(', 'x', regex=True),
+                                              trigger('good', 'More?', ' ')])
+    monkeypatch.setattr(h19term, 'AUTO_CPM_DATE', False)
+    monkeypatch.setattr(h19term, 'AUTO_HDOS_DATE', False)
+    term = headless()
+    assert 'Bad pattern in trigger bad' in capsys.readouterr().out
+    assert fired(term.responder, b'More?') == [('good', ' ')]
@@ -0,0 +1,42 @@
+import pytest
+
+import h19term
+
+
+def run_script(tmp_path, text, *chunks):
+    path = tmp_path / 'test.txt'
+    path.write_text(text)
+    script = h19term.Script(None, str(path))
+    running = script.step(None)
+    for data in chunks:
+        script.received(data)
+        running = script.step(None)
+    return running, script
+
+
+@pytest.mark.parametrize('first', ['expect foo', 'expect-re "fo+"'])
+def test_expect_keeps_rest_of_chunk(tmp_path, first):
+    running, script = run_script(tmp_path, first + '\nexpect bar\n', b'xx foo bar\r\n')
+    assert not running
+    assert script.status == 0
+
+
+def test_prompt_after_expect_re_in_same_chunk(tmp_path):
+    running, script = run_script(tmp_path, 'expect-re "END OF ASSEMBLY"\nprompt\n',
+                                 b'\r\nEND OF ASSEMBLY\r\nA>')
+    assert not running
+    assert script.status == 0
+
+
+def test_expect_re_across_chunks(tmp_path):
+    running, script = run_script(tmp_path, 'expect-re "fo+ b"\nexpect ar\n',
+                                 b'xx fo', b'o bar\r\n')
+    assert not running
+    assert script.status == 0
+
+
+def test_expect_in_chunk_longer_than_backlog(tmp_path):
+    data = b'x' * (h19term.SCRIPT_BACKLOG * 2) + b' done\r\nA>'
+    running, script = run_script(tmp_path, 'expect done\nprompt\n', data)
+    assert not running
+    assert script.status == 0
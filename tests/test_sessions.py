@@ -0,0 +1,111 @@
+import pytest
+
+import h19term
+
+
+class FeedPort:
+    """ What the host sends next, and what was sent to it. """
+    timeout = 0
+    out_waiting = 0
+    baudrate = 9600
+    rts = True
+
+    def __init__(self, port):
+        self.port = port
+        self.pending = b''
+        self.sent = b''
+
+    @property
+    def in_waiting(self):
+        return len(self.pending)
+
+    def read(self, n=1):
+        data, self.pending = self.pending[:n], self.pending[n:]
+        return data
+
+    def write(self, data):
+        self.sent += data
+        return len(data)
+
+
+class KeyWindow:
+    """ Hands parse_ctrl_a its command key. """
+
+    def __init__(self, key):
+        self.key = key
+
+    def getch(self):
+        return ord(self.key)
+
+
+class CountingWindow(h19term.HeadlessWindow):
+    refreshes = 0
+
+    def refresh(self):
+        self.refreshes += 1
+
+
+@pytest.fixture
+def sessions(monkeypatch, tmp_path, headless):
+    monkeypatch.setattr(h19term, 'LOG_FILE', str(tmp_path / 'h19term.log'))
+    monkeypatch.setattr(h19term.H19Term, 'open_port', lambda self, port=None: FeedPort(port))
+    first = headless()
+    first.sio = FeedPort('/dev/ttyUSB0')
+    for port in ('tcp://h8b:2001', 'pty:h8c'):
+        other = first.add_session(port)
+        other.setup_headless()
+        other.hide()
+    return first.sessions
+
+
+def test_add_session(sessions, tmp_path):
+    assert [s.number for s in sessions] == [1, 2, 3]
+    assert all(s.sessions is sessions for s in sessions)
+    assert [s.sio.port for s in sessions[1:]] == ['tcp://h8b:2001', 'pty:h8c']
+    assert sessions[2].logFile == str(tmp_path / 'h19term-3.log')
+    assert not sessions[1].visible
+
+
+@pytest.mark.parametrize('number, key, target', [
+    (1, '2', 2), (1, '3', 3), (3, '1', 1), (1, '\t', 2), (3, '\t', 1),
+])
+def test_ctrl_a_picks_the_session(sessions, number, key, target):
+    term = sessions[number - 1]
+    term.parse_ctrl_a(term.sio, None, KeyWindow(key), None)
+    assert term.switchTo is sessions[target - 1]
+
+
+def test_no_such_session_rings_the_bell(sessions, monkeypatch):
+    rung = []
+    monkeypatch.setattr(sessions[0], 'bell', lambda: rung.append(True))
+    sessions[0].parse_ctrl_a(sessions[0].sio, None, KeyWindow('4'), None)
+    assert sessions[0].switchTo is None and rung
+
+
+def test_background_sessions_keep_running(sessions):
+    # Each session's output lands on its own screen, hidden or not
+    sessions[0].sio.pending = b'A>'
+    sessions[1].sio.pending = b'B>dir'
+    sessions[2].sio.pending = b'\x1bY%%C>'
+    sessions[0].service_sessions()
+    rows = [s.screen.rows() for s in sessions]
+    assert rows[0][0].rstrip() == 'A>'
+    assert rows[1][0].rstrip() == 'B>dir'
+    assert rows[2][0].strip() == '' and rows[2][5].rstrip() == '     C>'
+    assert all(s.rxpos == len(s.rxbuf) for s in sessions)
+
+
+def test_typing_goes_to_its_own_session(sessions):
+    sessions[1].txbuf = 'dir\r'
+    sessions[0].service_sessions()
+    assert sessions[1].sio.sent == b'dir\r'
+    assert sessions[0].sio.sent == sessions[2].sio.sent == b''
+
+
+def test_hidden_windows_draw_without_refreshing():
+    win = CountingWindow(25, 80)
+    hidden = h19term.HiddenWindow(win)
+    hidden.addstr(0, 0, 'B>')
+    hidden.refresh()
+    hidden.noutrefresh()
+    assert win.refreshes == 0 and win.rows()[0].rstrip() == 'B>'
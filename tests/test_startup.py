@@ -0,0 +1,93 @@
+import ctypes
+import json
+import os
+import time
+
+import pytest
+
+import h19term
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def console(glyphs, count, width, height):
+    # A KDFONTOP that hands back glyphs the way the kernel lays them out
+    row = (width + 7) // 8
+
+    def ioctl(fd, request, arg):
+        assert request == h19term.KDFONTOP
+        op, flags, room, rows, chars, data = h19term.CONSOLE_FONT_OP.unpack(arg)
+        assert op == h19term.KD_FONT_OP_GET and rows >= height and chars >= count
+        for i in range(count):
+            glyph = glyphs[i * row * height:(i + 1) * row * height]
+            ctypes.memmove(data + i * row * h19term.FONT_VPITCH, glyph, len(glyph))
+        return h19term.CONSOLE_FONT_OP.pack(op, flags, width, height, count, data)
+    return ioctl
+
+
+@pytest.fixture
+def font(monkeypatch):
+    monkeypatch.setattr(h19term, 'INSTALL_PATH', ROOT)
+    monkeypatch.setattr(h19term, 'FONT', 'H19term16x32.psfu.gz')
+    return h19term.H19Term.read_font(os.path.join(ROOT, 'H19term16x32.psfu.gz'))
+
+
+def test_read_font(font):
+    glyphs, count, width, height = font
+    assert (count, width, height) == (256, 16, 32) and len(glyphs) == 256 * 64
+
+
+def test_font_loaded_compares_the_glyphs(font, monkeypatch):
+    glyphs, count, width, height = font
+    monkeypatch.setattr(h19term.fcntl, 'ioctl', console(glyphs, count, width, height))
+    assert h19term.H19Term().font_loaded()
+    # Same size, different graphics, the way Terminus 16x32 is
+    other = bytearray(glyphs)
+    other[0x5E * 64 + 10] ^= 0xFF
+    monkeypatch.setattr(h19term.fcntl, 'ioctl', console(bytes(other), count, width, height))
+    assert not h19term.H19Term().font_loaded()
+    monkeypatch.setattr(h19term.fcntl, 'ioctl', console(bytes(8 * 16 * 256), 256, 8, 16))
+    assert not h19term.H19Term().font_loaded()
+
+
+def test_no_console_means_not_loaded(font, monkeypatch):
+    def ioctl(fd, request, arg):
+        raise OSError(25, 'Inappropriate ioctl for device')
+    monkeypatch.setattr(h19term.fcntl, 'ioctl', ioctl)
+    assert not h19term.H19Term().font_loaded()
+
+
+@pytest.fixture
+def probe(monkeypatch, tmp_path):
+    import serial.tools.list_ports
+    probed = []
+
+    def comports():
+        probed.append(True)
+        return [serial.tools.list_ports_common.ListPortInfo('/dev/null')]
+    monkeypatch.setattr(serial.tools.list_ports, 'comports', comports)
+    monkeypatch.setattr(h19term, 'PORTS_FILE', str(tmp_path / 'ports'))
+    return probed
+
+
+def ports(refresh=False):
+    term = h19term.H19Term()
+    term.probe_ports(refresh)
+    return [port for port, desc, hwid in term.serial_ports()]
+
+
+def test_port_probe_is_saved_for_next_time(probe):
+    assert ports() == ['/dev/null'] and len(probe) == 1
+    assert ports() == ['/dev/null'] and len(probe) == 1
+    assert ports(refresh=True) == ['/dev/null'] and len(probe) == 2
+
+
+def test_old_or_vanished_ports_are_probed_again(probe):
+    with open(h19term.PORTS_FILE, 'w') as f:
+        json.dump({'time': time.time(), 'ports': [['/dev/null', 'n/a', 'n/a'],
+                                                  ['/dev/ttyGONE', 'n/a', 'n/a']]}, f)
+    assert ports() == ['/dev/null'] and not probe
+    with open(h19term.PORTS_FILE, 'w') as f:
+        json.dump({'time': time.time() - h19term.PORTS_MAX_AGE - 1, 'ports': []}, f)
+    assert ports() == ['/dev/null'] and len(probe) == 1
@@ -0,0 +1,63 @@
+import json
+import socket
+import time
+
+import pytest
+
+import h19term
+
+
+def test_histogram_percentiles():
+    histogram = h19term.LatencyHistogram()
+    for ms in range(1, 101):
+        histogram.record(ms / 1000.0)
+    assert histogram.count == 100
+    assert histogram.max == pytest.approx(0.1)
+    assert histogram.percentile(50) == pytest.approx(0.050, rel=0.07)
+    assert histogram.percentile(99) == pytest.approx(0.099, rel=0.07)
+    assert histogram.percentile(100) == pytest.approx(0.1)
+
+
+def test_histogram_small_values_exact():
+    histogram = h19term.LatencyHistogram()
+    histogram.record(0.000005)
+    assert histogram.percentile(50) == pytest.approx(0.000005)
+
+
+def test_echo_matched_in_order():
+    term = h19term.H19Term()
+    now = time.perf_counter()
+    term.echoWait = [(ord('d'), now), (ord('i'), now)]
+    term.match_echo(b'\r\nd')
+    assert term.stats.echo.count == 1
+    assert term.echoWait == [(ord('i'), now)]
+
+
+def test_echo_given_up_after_timeout():
+    term = h19term.H19Term()
+    term.echoWait = [(ord('d'), time.perf_counter() - h19term.ECHO_TIMEOUT - 1)]
+    term.match_echo(b'd')
+    assert term.stats.echo.count == 0
+    assert term.stats.echoLost == 1
+
+
+def test_stats_socket_replaces_only_a_socket(tmp_path):
+    path = str(tmp_path / 'stats')
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    term = h19term.H19Term()
+    term.serve_stats(path)
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(5)
+    client.connect(path)
+    assert json.loads(client.makefile('rb').readline())['sessions'][0]['bytes_in'] == 0
+    client.close()
+
+
+def test_stats_socket_leaves_other_files_alone(tmp_path):
+    path = tmp_path / 'notes.txt'
+    path.write_text('keep me')
+    with pytest.raises(FileExistsError):
+        h19term.H19Term().serve_stats(str(path))
+    assert path.read_text() == 'keep me'
@@ -0,0 +1,29 @@
+import json
+
+import h19term
+
+
+def trace(term, port, tmp_path, data, ops=h19term.TRACE_OPS):
+    path = tmp_path / 'trace.jsonl'
+    term.start_trace(str(path), ops)
+    term.rxbuf += data
+    term.process_buffered(port)
+    term.stop_trace()
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_operations_in_order(term, port, tmp_path):
+    records = trace(term, port, tmp_path, b'A>dir\r\n\x1bY"%\x1bK\x1bpOK\x1bq\x1bn')
+    assert [(r['op'], r.get('seq', r.get('text'))) for r in records] == [
+        ('print', 'A>dir'), ('cursor', '\r'), ('cursor', '\n'), ('cursor', '\x1bY"%'),
+        ('erase', '\x1bK'), ('mode', '\x1bp'), ('print', 'OK'), ('mode', '\x1bq'),
+        ('report', '\x1bn')]
+    assert records[3]['y'] == 2 and records[3]['x'] == 5
+    assert records[-1]['sent'].startswith('\x1bY')
+    assert records == sorted(records, key=lambda r: r['t'])
+    assert 'process_char' not in vars(term)
+
+
+def test_filtered_by_operation(term, port, tmp_path):
+    records = trace(term, port, tmp_path, b'one\x1bE\x1bJtwo\x1bH', ['erase'])
+    assert [r['seq'] for r in records] == ['\x1bE', '\x1bJ']
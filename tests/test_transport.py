@@ -0,0 +1,133 @@
+import socket
+
+import pytest
+
+import h19term
+
+
+IAC, DONT, DO, WONT, WILL, SB, SE = 255, 254, 253, 252, 251, 250, 240
+
+
+class Server:
+    """ The far end of a NetworkPort. """
+
+    def __init__(self, scheme):
+        listener = socket.create_server(('localhost', 0))
+        self.port = h19term.NetworkPort('%s://localhost:%d' % (scheme, listener.getsockname()[1]))
+        self.port.timeout = 5
+        self.sock, addr = listener.accept()
+        self.sock.settimeout(5)
+        listener.close()
+
+    def recv(self, n):
+        data = b''
+        while len(data) < n:
+            data += self.sock.recv(n - len(data))
+        return data
+
+    def quiet(self):
+        # Nothing more has been sent to us
+        self.sock.settimeout(0.2)
+        try:
+            return self.sock.recv(100) == b''
+        except socket.timeout:
+            return True
+        finally:
+            self.sock.settimeout(5)
+
+    def command(self, *words):
+        self.sock.sendall(bytes(words))
+        # a marker shows when the port has been through the command
+        self.sock.sendall(b'.')
+        for _ in range(50):     # a read can end early on a packet of negotiation
+            data = self.port.read(1)
+            if data:
+                assert data == b'.'
+                return
+        raise AssertionError("the marker never arrived")
+
+
+@pytest.fixture
+def telnet():
+    server = Server('telnet')
+    yield server
+    server.port.close()
+    server.sock.close()
+
+
+def test_opening_negotiation(telnet):
+    assert telnet.recv(12) == bytes((IAC, DO, 0, IAC, DO, 1, IAC, DO, 3, IAC, WILL, 0))
+    assert telnet.quiet()
+
+
+@pytest.mark.parametrize('words, answer', [
+    ((IAC, WILL, 1), b''),                      # confirms our DO
+    ((IAC, WILL, 24), bytes((IAC, DONT, 24))),
+    ((IAC, DO, 24), bytes((IAC, WONT, 24))),
+    ((IAC, DO, 1), bytes((IAC, WONT, 1))),      # we don't echo
+    ((IAC, DO, 3), bytes((IAC, WILL, 3))),      # their DO 3 isn't our DO 3
+    ((IAC, DO, 0), b''),                        # confirms our WILL
+    ((IAC, WONT, 3), bytes((IAC, DONT, 3))),
+    ((IAC, DONT, 0), bytes((IAC, WONT, 0))),
+])
+def test_option_replies(telnet, words, answer):
+    telnet.recv(12)
+    telnet.command(*words)
+    assert telnet.recv(len(answer)) == answer
+    assert telnet.quiet()
+
+
+def test_a_reply_is_never_answered_again(telnet):
+    telnet.recv(12)
+    telnet.command(IAC, DO, 3)
+    assert telnet.recv(3) == bytes((IAC, WILL, 3))
+    telnet.command(IAC, DO, 3)
+    telnet.command(IAC, WILL, 3)
+    assert telnet.quiet()
+    # WONT ECHO to their DO ECHO is not forgetting we said DO ECHO
+    telnet.command(IAC, DO, 1)
+    assert telnet.recv(3) == bytes((IAC, WONT, 1))
+    telnet.command(IAC, WILL, 1)
+    assert telnet.quiet()
+
+
+def test_binary_and_escapes(telnet):
+    telnet.recv(12)
+    telnet.port.write(b'A\r\xff')
+    assert telnet.recv(5) == b'A\r\x00\xff\xff'
+    telnet.command(IAC, DO, 0)
+    assert telnet.port.binary
+    telnet.port.write(b'A\r')
+    assert telnet.recv(2) == b'A\r'
+    telnet.command(IAC, DONT, 0)
+    assert telnet.recv(3) == bytes((IAC, WONT, 0))
+    assert not telnet.port.binary
+
+
+def test_commands_are_stripped_from_the_data(telnet):
+    telnet.recv(12)
+    telnet.sock.sendall(bytes((65, IAC, IAC, 66, IAC, SB, 24, 1, IAC, IAC, 2, IAC, SE, 67, IAC)))
+    telnet.sock.sendall(bytes((WILL, 1, 68)))
+    data = b''
+    while len(data) < 5:
+        data += telnet.port.read(10)
+    assert data == b'A\xffBCD'
+    assert telnet.quiet()
+
+
+def test_raw_tcp_leaves_the_bytes_alone():
+    server = Server('tcp')
+    try:
+        server.port.write(b'\r\xff')
+        assert server.recv(2) == b'\r\xff'
+        server.sock.sendall(bytes((IAC, DO, 1)))
+        assert server.port.read(3) == bytes((IAC, DO, 1))
+        assert server.quiet()
+    finally:
+        server.port.close()
+        server.sock.close()
+
+
+def test_address_needs_a_port():
+    with pytest.raises(ValueError):
+        h19term.NetworkPort('telnet://localhost')
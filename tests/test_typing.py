@@ -0,0 +1,78 @@
+import pytest
+
+import h19term
+
+
+def test_bucket_bursts_then_paces(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(h19term.time, 'perf_counter', lambda: now[0])
+    bucket = h19term.TokenBucket(10, 4)
+    assert bucket.take(6) == 4
+    assert bucket.take(1) == 0
+    assert bucket.wait() == pytest.approx(0.1)
+    now[0] += 0.25
+    assert bucket.take(6) == 2
+
+
+def test_typing_goes_out_in_one_write(term, port):
+    for c in 'dir b:':
+        term.key_write(port, c)
+    assert port.writes == []
+    assert term.send_typed(port) == 6
+    assert port.writes == [b'dir b:']
+    assert term.echoWait == []
+
+
+def test_paste_is_paced_not_dropped(term, port):
+    paste = 'x' * (h19term.KEY_BURST + 5)
+    for c in paste:
+        term.key_write(port, c, echoed=True)
+    term.send_typed(port)
+    assert port.writes == [paste[:h19term.KEY_BURST].encode()]
+    assert term.txbuf == 'x' * 5
+    assert len(term.echoWait) == h19term.KEY_BURST  # the rest aren't timed until sent
+    assert term.txEchoed == [0, 1, 2, 3, 4]
+    assert 0 < term.typing_wait() <= h19term.KEY_REPEAT_RATE
+
+
+def test_offline_typing_is_dropped(term, port):
+    term.offline = True
+    term.key_write(port, 'a')
+    assert term.txbuf == ''
+
+
+def test_backspace_is_sent_without_waiting(term, port):
+    term.screen.addstr(0, 0, 'A>dir')
+    term.process_key(h19term.curses.KEY_BACKSPACE, port, None, None, None)
+    term.send_typed(port)
+    assert port.writes == [b'\x08']
+    assert len(term.backspaceWait) == 1
+
+
+def test_backspace_echo_erases(term, port):
+    term.screen.addstr(0, 0, 'A>dir')
+    term.backspaceWait.append(h19term.time.perf_counter())
+    term.rxbuf += b'\x08 \x08X'
+    term.process_buffered(port)
+    assert term.screen.rows()[0].rstrip() == 'A>diX'
+    assert term.backspaceWait == []
+
+
+def test_backspace_echo_in_pieces(term, port):
+    term.screen.addstr(0, 0, 'A>dir')
+    term.backspaceWait.append(h19term.time.perf_counter())
+    term.rxbuf += b'\x08 '
+    assert term.process_buffered(port) == 0
+    term.rxbuf += b'\x08'
+    term.process_buffered(port)
+    assert term.screen.rows()[0].rstrip() == 'A>di'
+    assert term.screen.getyx() == (0, 4)
+
+
+def test_other_bytes_after_backspace_stay_in_order(term, port):
+    term.screen.addstr(0, 0, 'A>dir')
+    term.backspaceWait.append(h19term.time.perf_counter())
+    term.rxbuf += b'\x08\x1bK'      # PIE moves back and erases the line
+    term.process_buffered(port)
+    assert term.screen.rows()[0].rstrip() == 'A>di'
+    assert term.rxpos == len(term.rxbuf)
@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+import h19term
+
+
+def lines(n, start=1):
+    return b''.join(b'line %d\r\n' % i for i in range(start, start + n))
+
+
+@pytest.fixture
+def viewer(tmp_path):
+    path = tmp_path / 'h19term.log'
+    path.write_bytes(lines(300000))     # a few VIEW_CHUNKs
+    viewer = h19term.FileViewer(str(path))
+    viewer.path = path
+    yield viewer
+    viewer.close()
+
+
+def search(viewer, pattern, pos=0):
+    viewer.start_search(pattern, pos)
+    viewer.search_thread.join(10)
+    return viewer.search_result
+
+
+def test_goto_line(viewer):
+    while viewer.index_more():
+        pass
+    for n in (1, 2, 150000, 300000):
+        pos = viewer.goto_line(n)
+        assert viewer.display_line(pos) == 'line %d' % n
+        assert viewer.line_number(pos) == n
+
+
+def test_search(viewer):
+    start, end = search(viewer, r'line 29999\d')
+    assert viewer.mm[start:end] == b'line 299990'
+    again = search(viewer, r'line 29999\d', start + 1)
+    assert viewer.mm[again[0]:again[1]] == b'line 299991'
+    assert search(viewer, 'no such line') is False
+    viewer.start_search('(', 0)
+    assert viewer.message.startswith('Bad pattern')
+
+
+def test_follow_sees_the_file_grow(viewer):
+    assert not viewer.remap()
+    with open(viewer.path, 'ab') as f:
+        f.write(b'A>dir\r\n')
+    assert viewer.remap()
+    assert viewer.display_line(viewer.last_page(1)) == 'A>dir'
+
+
+def test_remap_during_a_search(viewer, monkeypatch):
+    # The search is held in its first step until the file has grown, then
+    # carries on over the new map instead of dying on the old one
+    started, go = threading.Event(), threading.Event()
+
+    def held(pos):
+        mm = viewer.mm
+        if threading.current_thread() is viewer.search_thread and not go.is_set():
+            started.set()
+            go.wait(10)
+        end = mm.find(b'\n', pos)
+        return len(mm) if end < 0 else end
+    monkeypatch.setattr(viewer, 'line_end', held)
+    viewer.start_search('A>stat', 0)
+    assert started.wait(10)
+    with open(viewer.path, 'ab') as f:
+        f.write(lines(1000, 300001) + b'A>stat\r\n')
+    threading.Timer(0.1, go.set).start()
+    assert viewer.remap()
+    viewer.search_thread.join(10)
+    start, end = viewer.search_result
+    assert viewer.mm[start:end] == b'A>stat'
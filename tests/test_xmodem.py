@@ -0,0 +1,152 @@
+import os
+import threading
+
+import serial
+
+import h19term
+
+
+def send(tmp_path, host, data):
+    console, xmodem = host.open_ptys()
+    receiver = threading.Thread(target=host.rx, args=('TEST.BIN', False), daemon=True)
+    receiver.start()
+    (tmp_path / 'src.bin').write_bytes(data)
+    ser = serial.Serial(xmodem, 9600, timeout=1)
+    try:
+        with open(tmp_path / 'src.bin', 'rb') as file:
+            ok = h19term.H19Term().xmodem_transfer(ser, file)
+    finally:
+        ser.close()
+    receiver.join(10)
+    return ok, os.read(host.slaves[0], 1000)
+
+
+def test_boost_falls_back_to_what_the_cable_takes(tmp_path, monkeypatch):
+    monkeypatch.setattr(h19term, 'XMODEM_BOOST', 38400)
+    data = bytes(range(256)) * 10
+    ok, console = send(tmp_path, h19term.FakeHost(str(tmp_path), maxBaud=19200), data)
+    assert ok
+    assert b'at 19200 baud' in console
+    assert (tmp_path / 'TEST.BIN').read_bytes()[:len(data)] == data
+
+
+def test_no_boost_by_default(tmp_path):
+    data = b'hello\r\n' * 50
+    ok, console = send(tmp_path, h19term.FakeHost(str(tmp_path)), data)
+    assert ok
+    assert b'baud' not in console
+    assert (tmp_path / 'TEST.BIN').read_bytes().rstrip(b'\x1a') == data
+
+
+class FadingLine(serial.Serial):
+    """ A receiver on a line that takes a speed boost and then goes bad. """
+
+    def __init__(self):
+        serial.Serial.__init__(self)
+        self.baudrate = 9600
+        self.queue = bytearray(h19term.NAK)
+        self.pattern = False
+        self.part = None        # writes of the block so far, None between blocks
+        self.blocks = []        # number of each block sent, resends and all
+        self.faded = False
+
+    def read(self, n=1):
+        data = bytes(self.queue[:n])
+        del self.queue[:n]
+        return data
+
+    def write(self, data):
+        if self.pattern:
+            self.pattern = False
+            self.queue += data
+        elif data[:2] == b'\x1br':
+            if not self.faded:     # the step down is garbled like everything else
+                self.queue += h19term.ACK
+                self.pattern = True
+        elif self.part is None:
+            if data == h19term.SOH:
+                self.part = 0
+        else:
+            self.part += 1
+            if self.part == 1:
+                self.blocks.append(data[0])
+            if self.part == 4:
+                self.queue += h19term.NAK if self.faded else h19term.ACK
+                self.faded = True
+                self.part = None
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        self.queue.clear()
+
+
+def test_failed_step_down_gives_up(tmp_path, monkeypatch):
+    monkeypatch.setattr(h19term, 'XMODEM_BOOST', 19200)
+    monkeypatch.setattr(h19term, 'BOOST_TIMEOUT', 0.01)
+    (tmp_path / 'src.bin').write_bytes(bytes(1024))
+    line = FadingLine()
+    with open(tmp_path / 'src.bin', 'rb') as file:
+        assert not h19term.H19Term().xmodem_transfer(line, file)
+    assert line.blocks == [1] + [2] * h19term.BOOST_ERRORS
+
+
+def test_a_block_naked_too_often_gives_up(tmp_path):
+    ok, console = send(tmp_path, h19term.FakeHost(str(tmp_path), nakRate=1.0), bytes(1024))
+    assert not ok
+    assert b'transfer failed after 0 blocks, %d NAKs' % h19term.XMODEM_RETRIES in console
+
+
+def test_fanout_sends_to_every_machine(tmp_path):
+    data = bytes(range(256)) * 20
+    (tmp_path / 'src.bin').write_bytes(data)
+    hosts, ports, receivers = [], [], []
+    for n, nakRate in enumerate((0.0, 0.0, 0.5)):
+        (tmp_path / str(n)).mkdir()
+        host = h19term.FakeHost(str(tmp_path / str(n)), nakRate=nakRate)
+        console, xmodem = host.open_ptys()
+        receiver = threading.Thread(target=host.rx, args=('TEST.BIN', False), daemon=True)
+        receiver.start()
+        hosts.append(host)
+        ports.append(xmodem)
+        receivers.append(receiver)
+    ports.append(str(tmp_path / 'no-such-port'))
+    fanout = h19term.FanoutSend(h19term.H19Term(), str(tmp_path / 'src.bin'), ports + ports[:1])
+    fanout.start()
+    fanout.wait()
+    for receiver in receivers:
+        receiver.join(10)
+    assert [t.state for t in fanout.targets] == ['done', 'done', 'done', 'failed']
+    assert fanout.targets[2].retries > 0 and fanout.targets[0].retries == 0
+    for n in range(3):
+        assert (tmp_path / str(n) / 'TEST.BIN').read_bytes()[:len(data)] == data
+    summary = fanout.summary()
+    assert len(summary) == 4 and 'done' in summary[0] and 'failed' in summary[3]
+
+
+def test_fanout_gives_up_on_a_machine_that_naks_everything(tmp_path):
+    (tmp_path / 'src.bin').write_bytes(bytes(1024))
+    ports, receivers = [], []
+    for n, nakRate in enumerate((0.0, 1.0)):
+        (tmp_path / str(n)).mkdir()
+        host = h19term.FakeHost(str(tmp_path / str(n)), nakRate=nakRate)
+        console, xmodem = host.open_ptys()
+        receiver = threading.Thread(target=host.rx, args=('TEST.BIN', False), daemon=True)
+        receiver.start()
+        ports.append(xmodem)
+        receivers.append(receiver)
+    fanout = h19term.FanoutSend(h19term.H19Term(), str(tmp_path / 'src.bin'), ports)
+    fanout.start()
+    waiter = threading.Thread(target=fanout.wait, daemon=True)
+    waiter.start()
+    waiter.join(60)
+    assert not waiter.is_alive(), "wait() never returned"
+    for receiver in receivers:
+        receiver.join(10)
+        assert not receiver.is_alive()
+    assert [t.state for t in fanout.targets] == ['done', 'failed']
+    assert fanout.targets[1].retries == h19term.XMODEM_RETRIES
+    assert 'NAKed' in fanout.targets[1].error
+    assert fanout.failed() == fanout.targets[1:]